@@ -0,0 +1,1088 @@
+#!/usr/bin/env python3
+"""
+benchmark.py — اندازه‌گیری مسیرهای داغ bot.py بدون شبکه
+اجرا:  python3 benchmark.py [نام‌بنچمارک ...]
+بدون آرگومان همه بنچمارک‌ها اجرا می‌شوند.
+
+داده: عنوان‌های واقعی stories.json (+ هر فایل RSS در BENCH_FEEDS_DIR)
+نسخه قدیمی هر تابع اینجا نگه داشته شده تا هم سرعت و هم یکسان بودن نتیجه چک شود.
+"""
+
+import json, os, sys, time
+from pathlib import Path
+
+import bot
+
+# ══════════════════════════════════════════════════════════════════════════
+# داده — عنوان/متن واقعی
+# ══════════════════════════════════════════════════════════════════════════
+def load_corpus(n: int = 3000) -> list[str]:
+    """
+    چند هزار متن «عنوان + خلاصه» از stories.json و فایل‌های RSS ذخیره‌شده.
+    خلاصه = عنوان خبر بعدی — تا طول متن شبیه entry واقعی RSS باشد.
+    """
+    titles = []
+    if Path(bot.STORIES_FILE).exists():
+        titles += [it[0] for it in json.load(open(bot.STORIES_FILE))
+                   if isinstance(it, list) and it]
+    feeds_dir = os.environ.get("BENCH_FEEDS_DIR", "")
+    if feeds_dir and Path(feeds_dir).is_dir():
+        for fp in sorted(Path(feeds_dir).glob("*.xml")):
+            for e in bot.feedparser.parse(fp.read_bytes()).entries:
+                titles.append(f"{e.get('title','')} {bot.clean_html(e.get('summary',''))}")
+    if not titles:
+        sys.exit("❌ داده‌ای نیست — stories.json یا BENCH_FEEDS_DIR لازم است")
+    out = []
+    i = 0
+    while len(out) < n:
+        out.append(f"{titles[i % len(titles)]} {titles[(i + 1) % len(titles)]}")
+        i += 1
+    return out
+
+def _rate(fn, items, repeat=3) -> float:
+    """بهترین items/sec از چند تکرار"""
+    best = 0.0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for it in items: fn(it)
+        best = max(best, len(items) / (time.perf_counter() - t0))
+    return best
+
+# ══════════════════════════════════════════════════════════════════════════
+# is_war_relevant — نسخه قدیمی (چندصد اسکن substring)
+# ══════════════════════════════════════════════════════════════════════════
+def legacy_is_war_relevant(text: str, is_embassy=False, is_tg=False, is_tw=False) -> bool:
+    txt = text.lower()
+    if any(k in txt for k in bot.HARD_EXCLUDE):
+        return False
+    if is_embassy and any(k in txt for k in bot.EMBASSY_OVERRIDE):
+        return True
+    if is_tw or is_tg:
+        return (
+            any(k in txt for k in bot.IRAN_MILITARY_KW) or
+            any(k in txt for k in bot.USA_KW) or
+            any(k in txt for k in bot.ISRAEL_KW) or
+            any(k in txt for k in bot.PROXY_KW) or
+            any(k in txt for k in bot.WAR_CONTEXT_KW) or
+            "iran" in txt or "iranian" in txt or "ایران" in txt or
+            "irgc" in txt or "sepah" in txt or "سپاه" in txt or
+            "tehran" in txt or "تهران" in txt or
+            "israel" in txt or "اسراییل" in txt or
+            "nuclear" in txt or "هسته" in txt or
+            "missile" in txt or "موشک" in txt or
+            "trump" in txt or "ترامپ" in txt or
+            "netanyahu" in txt or "نتانیاهو" in txt or
+            "war" in txt or "attack" in txt or "strike" in txt or
+            "حمله" in txt or "جنگ" in txt
+        )
+    has_iran_mil  = any(k in txt for k in bot.IRAN_MILITARY_KW)
+    has_iran_name = ("iran" in txt or "iranian" in txt or "ایران" in txt
+                     or "تهران" in txt or "خامنه" in txt or "پزشکیان" in txt
+                     or "عراقچی" in txt or "irgc" in txt or "tehran" in txt
+                     or "سپاه" in txt or "نطنز" in txt or "فردو" in txt)
+    has_usa       = any(k in txt for k in bot.USA_KW)
+    has_israel    = any(k in txt for k in bot.ISRAEL_KW)
+    has_war_ctx   = any(k in txt for k in bot.WAR_CONTEXT_KW)
+    has_proxy     = any(k in txt for k in bot.PROXY_KW)
+    if has_iran_mil or has_proxy:
+        return True
+    if has_iran_name and (has_usa or has_israel or has_war_ctx):
+        return True
+    if has_usa and has_israel:
+        return True
+    if (has_usa or has_israel) and has_war_ctx:
+        return True
+    return False
+
+def bench_relevance():
+    corpus = load_corpus()
+    # متن‌های منفی/مرزی هم اضافه شوند تا همه شاخه‌ها پوشش داده شوند
+    corpus += [f"{k} {w}" for k in bot.HARD_EXCLUDE[:20] for w in ("iran", "war")]
+    corpus += [f"Iran {k} report" for k in bot.IRAN_NAME_KW + bot.LOOSE_KW]
+    flags = [dict(), dict(is_tw=True), dict(is_tg=True), dict(is_embassy=True)]
+
+    mismatch = 0
+    for txt in corpus:
+        for fl in flags:
+            if legacy_is_war_relevant(txt, **fl) != bot.is_war_relevant(txt, **fl):
+                mismatch += 1
+    old = _rate(lambda t: legacy_is_war_relevant(t), corpus)
+
+    def new_fn(t):
+        bot.classify.cache_clear()  # بدون cache — هزینه واقعی اسکن
+        return bot.is_war_relevant(t)
+    new = _rate(new_fn, corpus)
+    print(f"is_war_relevant  n={len(corpus)}")
+    print(f"  قدیمی : {old:10,.0f} items/s")
+    print(f"  جدید  : {new:10,.0f} items/s   ×{new / old:.2f}")
+    print(f"  اختلاف تصمیم: {mismatch}")
+    return mismatch == 0
+
+# ══════════════════════════════════════════════════════════════════════════
+# sentiment / importance / triple — نسخه‌های قدیمی (هر کدام اسکن جداگانه)
+# ══════════════════════════════════════════════════════════════════════════
+def legacy_analyze_sentiment(text: str) -> list:
+    txt = text.lower()
+    found = []
+    for icon, en_kws, fa_kws in bot.SENTIMENT_RULES:
+        if any(kw in txt for kw in en_kws) or any(kw in txt for kw in fa_kws):
+            found.append(icon)
+        if len(found) >= 3: break
+    return found or ["📰"]
+
+def legacy_calc_importance(title, body, icons, stype) -> int:
+    txt = (title + " " + body).lower()
+    score = sum(bot.IMPORTANCE_BOOST.get(ic, 0) for ic in icons)
+    if any(k in txt for k in bot.BREAKING_KEYWORDS): score += 2
+    if stype == "tw" and score > 0: score += 1
+    return min(score, 10)
+
+def legacy_entity_triple(title):
+    txt = title.lower()
+    actor1, actor2, act = "", "", ""
+    for i, grp in enumerate(bot.ENTITY_ACTORS):
+        if any(a in txt for a in grp):
+            if not actor1: actor1 = str(i)
+            elif not actor2: actor2 = str(i)
+    for code, kws in bot.ENTITY_ACTIONS.items():
+        if any(k in txt for k in kws): act = code; break
+    return actor1, actor2, act
+
+def bench_classify():
+    """هر خبر: فیلتر + triple عنوان + sentiment + importance"""
+    corpus = load_corpus()
+    items = [(txt[:len(txt) // 2], txt[len(txt) // 2:]) for txt in corpus]
+
+    def old(it):
+        t, s = it
+        legacy_is_war_relevant(f"{t} {s}")
+        legacy_entity_triple(t)
+        icons = legacy_analyze_sentiment(f"{t} {s}")
+        return legacy_calc_importance(t, s, icons, "rss")
+
+    def new(it):
+        t, s = it
+        bot.classify.cache_clear()  # بدون cache — هزینه واقعی اسکن
+        feats = bot.classify(t, s)
+        bot.is_war_relevant(f"{t} {s}", feats=feats)
+        return bot.calc_importance(t, s, list(feats.icons), "rss")
+
+    mismatch = 0
+    for t, s in items:
+        if (legacy_entity_triple(t) != bot._entity_triple(t)
+                or legacy_analyze_sentiment(f"{t} {s}") != bot.analyze_sentiment(f"{t} {s}")
+                or legacy_analyze_sentiment(f"{t} {s}") != list(bot.classify(t, s).icons)
+                or old((t, s)) != new((t, s))):
+            mismatch += 1
+    o = _rate(old, items); n = _rate(new, items)
+    print(f"classify (فیلتر+triple+sentiment+importance)  n={len(items)}")
+    print(f"  قدیمی : {o:10,.0f} items/s")
+    print(f"  جدید  : {n:10,.0f} items/s   ×{n / o:.2f}")
+    print(f"  اختلاف: {mismatch}")
+    return mismatch == 0
+
+# ══════════════════════════════════════════════════════════════════════════
+# is_story_dup — نسخه قدیمی (مقایسه خطی با همه story ها)
+# ══════════════════════════════════════════════════════════════════════════
+def legacy_is_story_dup(title: str, stories: list) -> bool:
+    bag1 = bot._bag(title)
+    if not bag1: return False
+    a1, a2, act1 = bot._entity_triple(title)
+    for item in stories:
+        if not (isinstance(item, (list, tuple)) and len(item) == 3):
+            continue
+        _, prev_bag_raw, prev_triple = item
+        prev_bag = set(prev_bag_raw) if isinstance(prev_bag_raw, list) else prev_bag_raw
+        pa, pb, pact = prev_triple
+        if act1 and pact and act1 in bot._VIOLENCE_CODES and pact in bot._VIOLENCE_CODES:
+            if a1 == pa and a2 == pb: return True
+        if act1 and pact and act1 in bot._POLITICAL_CODES and pact in bot._POLITICAL_CODES:
+            if a1 == pa: return True
+        union = bag1 | prev_bag
+        if union and len(bag1 & prev_bag) / len(union) >= bot.JACCARD_THRESHOLD:
+            return True
+    return False
+
+def _story_titles(n: int, seed: int = 7) -> list[str]:
+    """
+    n عنوان متمایز: عنوان‌های واقعی + چند کلمه از عنوان‌های دیگر
+    (تا توزیع token ها شبیه خبر واقعی بماند ولی story ها تکراری نباشند)
+    """
+    import random
+    rnd = random.Random(seed)
+    words = [w for t in load_corpus(400) for w in t.split() if len(w) > 3]
+    base = load_corpus(400)
+    return [" ".join(rnd.sample(base[i % len(base)].split()[:12], 6)
+                     + rnd.sample(words, 4)) for i in range(n)]
+
+def bench_stories():
+    ok = True
+    # نیمی تکراری نزدیک (عنوان موجود با یک کلمه جابه‌جا)، نیمی عنوان تازه
+    fresh = _story_titles(200, seed=11)
+    for n in (150, 5_000, 50_000):
+        titles = _story_titles(n)
+        legacy = [[t, list(bot._bag(t)), list(bot._entity_triple(t))] for t in titles]
+        index  = bot.StoryIndex(maxlen=n)
+        for t, b, tr in legacy: index.add(t, b, tr)
+        near  = [" ".join(t.split()[1:] + ["update"]) for t in titles[-100:]]
+        qs = (near[:100] + fresh[:100]) if n <= 5_000 else (near[:25] + fresh[:25])
+
+        mismatch = sum(legacy_is_story_dup(q, legacy) != index.is_dup(q) for q in qs)
+        o = _rate(lambda q: legacy_is_story_dup(q, legacy), qs, repeat=1)
+        m = _rate(index.is_dup, qs)
+        print(f"is_story_dup  stories={n:>6,}  queries={len(qs)}")
+        print(f"  خطی   : {o:10,.0f} q/s")
+        print(f"  index : {m:10,.0f} q/s   ×{m / o:.1f}   اختلاف: {mismatch}")
+        ok = ok and mismatch == 0
+    return ok
+
+# ══════════════════════════════════════════════════════════════════════════
+# stories.json ↔ stories.bin — حجم و زمان load
+# ══════════════════════════════════════════════════════════════════════════
+def bench_stories_file():
+    import tempfile
+    ok = True
+    real = []
+    if Path(bot.STORIES_FILE).exists():
+        real = [it[0] for it in json.load(open(bot.STORIES_FILE)) if isinstance(it, list) and it]
+    for n in (len(real) or 150, 5_000, 50_000):
+        titles = real if n == len(real) else _story_titles(n)
+        index = bot.StoryIndex(maxlen=n)
+        for t in titles: index.add(t)
+        with tempfile.TemporaryDirectory() as d:
+            js, bn = Path(d) / "stories.json", Path(d) / "stories.bin"
+            json.dump(index.to_list(), open(js, "w"))
+            bn.write_bytes(bot.encode_stories(index))
+
+            def load_json():
+                idx = bot.StoryIndex(maxlen=n)
+                for t, b, tr in json.load(open(js)): idx.add(t, b, tr)
+                return idx
+            def load_bin():
+                bot.STORIES_BIN_FILE = str(bn)
+                idx = bot.StoryIndex(maxlen=n)
+                with open(bn, "rb") as f, bot.mmap.mmap(f.fileno(), 0, access=bot.mmap.ACCESS_READ) as mm:
+                    for t, b, tr in bot.decode_stories(mm): idx.add(t, b, tr)
+                return idx
+
+            def parse_json():
+                return json.load(open(js))
+            def parse_bin():
+                with open(bn, "rb") as f, bot.mmap.mmap(f.fileno(), 0, access=bot.mmap.ACCESS_READ) as mm:
+                    return list(bot.decode_stories(mm))
+
+            same = list(load_json().items()) == list(load_bin().items())
+            tj, pj = (min(_timeit(fn) for _ in range(3)) for fn in (load_json, parse_json))
+            tb, pb = (min(_timeit(fn) for _ in range(3)) for fn in (load_bin, parse_bin))
+            print(f"stories={n:>6,}  یکسان: {same}")
+            print(f"  json : {js.stat().st_size / 1024:9,.1f} KB   parse {pj * 1000:7.1f} ms"
+                  f"   parse+index {tj * 1000:7.1f} ms")
+            print(f"  bin  : {bn.stat().st_size / 1024:9,.1f} KB   parse {pb * 1000:7.1f} ms"
+                  f"   parse+index {tb * 1000:7.1f} ms")
+            ok = ok and same
+    return ok
+
+# ══════════════════════════════════════════════════════════════════════════
+# seen — هزینه هر چرخه (۵۰ id جدید) با seen.json قدیمی و seen.log
+# ══════════════════════════════════════════════════════════════════════════
+def legacy_save_seen(path: str, seen: set, ttl_h: float, cap: int):
+    now_ts = time.time(); cutoff_ts = now_ts - ttl_h * 3600
+    existing = {}
+    if Path(path).exists():
+        raw = json.load(open(path))
+        existing = {k: v for k, v in raw.items() if v > cutoff_ts}
+    for eid in seen:
+        if eid not in existing: existing[eid] = now_ts
+    if len(existing) > cap:
+        existing = dict(sorted(existing.items(), key=lambda x: x[1], reverse=True)[:cap])
+    json.dump(existing, open(path, "w"))
+
+def bench_seen():
+    import tempfile
+    for n in (5_000, 100_000, 300_000):
+        with tempfile.TemporaryDirectory() as d:
+            ids = [f"{i:032x}" for i in range(n)]
+            js = str(Path(d) / "seen.json")
+            legacy = set(ids)
+            legacy_save_seen(js, legacy, 6, n)
+            store = bot.SeenStore(str(Path(d) / "seen.log"), cap=n)
+            for eid in ids: store.add(eid)
+            store.flush()
+
+            t_old = t_new = 0.0
+            for c in range(5):
+                new_ids = [f"new{c}-{i}" for i in range(50)]
+                legacy.update(new_ids)
+                t_old += _timeit(lambda: legacy_save_seen(js, legacy, 6, n))
+                def cycle():
+                    for eid in new_ids: store.add(eid)
+                    store.flush()
+                t_new += _timeit(cycle)
+            print(f"seen={n:>7,}   seen.json {t_old / 5 * 1000:8.1f} ms/چرخه"
+                  f"   seen.log {t_new / 5 * 1000:6.2f} ms/چرخه")
+
+# ══════════════════════════════════════════════════════════════════════════
+# fetch_twitter — hedge در برابر fallback ترتیبی، روی mirror های شبیه‌سازی‌شده
+# ══════════════════════════════════════════════════════════════════════════
+TW_SCALE = 0.1   # همه زمان‌ها (timeout، تأخیر، stagger) × این ضریب — اجرای سریع‌تر
+
+# رفتار هر mirror: hang = تا timeout جواب نمی‌دهد، dead = فوراً connection error
+TW_MIRRORS = {
+    "https://rsshub-hang.test": ("hang", 0),
+    "https://rsshub-dead.test": ("dead", 0),
+    "https://nitter-dead.test": ("dead", 0),
+    "https://nitter-slow.test": ("ok",   3.0),
+    "https://nitter-fast.test": ("ok",   0.3),
+}
+
+def _tw_items(handle: str, n: int) -> str:
+    return "".join(f"<item><title>{handle} post {i} about Iran strike</title>"
+                   f"<dc:creator>@{handle}</dc:creator>"
+                   f"<link>https://x.com/{handle}/status/{i}</link></item>" for i in range(n))
+
+def _tw_rss(handle: str, n: int = 5, items: str = "") -> str:
+    return ('<?xml version="1.0"?><rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<channel><title>{handle}</title>{items or _tw_items(handle, n)}</channel></rss>')
+
+TW_VARIED = False   # bench_twitter_batch: تعداد پست متفاوت برای هر handle
+
+def _tw_posts(handle: str) -> int:
+    """تعداد پست هر handle در بنچمارک batch — بعضی صفر (handle ساکت)"""
+    return int(handle[4:]) % 3
+
+async def _tw_mirror(request):
+    """stand-in محلی برای RSSHub/Nitter (httpx.MockTransport)"""
+    import asyncio
+    base = f"{request.url.scheme}://{request.url.host}"
+    kind, delay = TW_MIRRORS[base]
+    if kind == "dead":
+        await asyncio.sleep(0.05 * TW_SCALE)
+        raise bot.httpx.ConnectError("refused", request=request)
+    if kind == "hang":
+        await asyncio.sleep(request.extensions["timeout"]["read"] * TW_SCALE)
+        raise bot.httpx.ReadTimeout("timeout", request=request)
+    await asyncio.sleep(delay * TW_SCALE)
+    rss = {"content-type": "application/rss+xml"}
+    if request.url.path.startswith("/search"):
+        if kind != "search":    # mirror بدون search RSS → صفحه HTML
+            return bot.httpx.Response(200, text="<html>search</html>",
+                                      headers={"content-type": "text/html"})
+        hs = [w[5:] for w in request.url.params["q"].split() if w.startswith("from:")]
+        items = "".join(_tw_items(h, _tw_posts(h)) for h in hs)
+        return bot.httpx.Response(200, text=_tw_rss("search", items=items), headers=rss)
+    handle = request.url.path.strip("/").split("/")[0]
+    n = _tw_posts(handle) if TW_VARIED else 5
+    return bot.httpx.Response(200, text=_tw_rss(handle, n), headers=rss)
+
+def _tw_phase(hedge_n: int, handles: list) -> tuple[float, dict]:
+    import asyncio
+    async def run():
+        bot._rsshub_pool = [u for u in TW_MIRRORS if "rsshub" in u]
+        bot._nitter_pool = [u for u in TW_MIRRORS if "nitter" in u]
+        bot._INST_SEMA.clear()
+        bot.STATE.json("nitter", bot.NITTER_CACHE_FILE)["health"] = {}  # شروع سرد
+        bot._TW_SEMA = asyncio.Semaphore(20)
+        bot.TW_HEDGE_N, bot.TW_HEDGE_STAGGER = hedge_n, 0.5 * TW_SCALE
+        async with bot.httpx.AsyncClient(transport=bot.httpx.MockTransport(_tw_mirror)) as c:
+            t0  = time.perf_counter()
+            res = await asyncio.gather(*[bot.fetch_twitter(c, h, h) for h in handles])
+            return time.perf_counter() - t0, {h: len(r) for h, r in zip(handles, res)}
+    return asyncio.run(run())
+
+def bench_twitter_batch():
+    """تعداد درخواست فاز X: هر handle جدا در برابر search RSS گروهی"""
+    import asyncio
+    global TW_MIRRORS, TW_VARIED
+    TW_VARIED = True
+    saved, TW_MIRRORS = TW_MIRRORS, {
+        "https://rsshub-dead.test":    ("dead",   0),
+        "https://nitter-nosrch.test":  ("ok",     0.3),  # search ندارد
+        "https://nitter-search.test":  ("search", 0.3),
+    }
+    handles = [(f"user{i}", f"user{i}") for i in range(60)]
+    async def run(batch: int):
+        bot._rsshub_pool = [u for u in TW_MIRRORS if "rsshub" in u]
+        bot._nitter_pool = [u for u in TW_MIRRORS if "nitter" in u]
+        bot._INST_SEMA.clear()
+        st = bot.STATE.json("nitter", bot.NITTER_CACHE_FILE)
+        st["health"], st["batch"] = {}, {}
+        # nosearch پرتر امتیاز بگیرد تا اول امتحان شود (بدترین حالت برای batch)
+        st["health"]["https://nitter-nosrch.test"] = dict(
+            bot.HEALTH._get("https://nitter-nosrch.test"), ok=1.0)
+        bot._TW_SEMA = asyncio.Semaphore(20)
+        bot.TW_HEDGE_STAGGER = 0.5 * TW_SCALE
+        bot._TW_STATS["req"] = 0
+        async with bot.httpx.AsyncClient(transport=bot.httpx.MockTransport(_tw_mirror)) as c:
+            if batch > 1:
+                res = await asyncio.gather(*[bot.fetch_twitter_batch(c, handles[i:i + batch])
+                                             for i in range(0, len(handles), batch)])
+            else:
+                res = await asyncio.gather(*[bot.fetch_twitter(c, l, h) for l, h in handles])
+        got = sorted((x[1], x[0]["link"]) for r in res for x in r)
+        return bot._TW_STATS["req"], got
+    try:
+        req1, got1 = asyncio.run(run(1))
+        req10, got10 = asyncio.run(run(10))
+    finally:
+        TW_MIRRORS, TW_VARIED = saved, False
+    same = got1 == got10
+    print(f"handles={len(handles)}  تکی {req1} req   batch(10) {req10} req   ×{req1 / max(req10, 1):.1f}")
+    print(f"entries={len(got1)}  تقسیم درست به handle/برچسب: {'✅' if same else '❌'}")
+    return same
+
+def bench_twitter():
+    handles = [f"user{i}" for i in range(40)]
+    t_seq, got_seq = _tw_phase(1, handles)
+    t_hdg, got_hdg = _tw_phase(3, handles)
+    same = got_seq == got_hdg and all(got_seq.values())
+    real = lambda t: t / TW_SCALE
+    print(f"handles={len(handles)}  ترتیبی {real(t_seq):6.1f}s   hedge(N=3) {real(t_hdg):6.1f}s"
+          f"   ×{t_seq / t_hdg:.1f}   (زمان واقعی، مقیاس {TW_SCALE})")
+    print(f"نتیجه یکسان: {'✅' if same else '❌'}")
+    return same
+
+# ══════════════════════════════════════════════════════════════════════════
+# صفحه t.me/s — BeautifulSoup(html.parser) قدیمی در برابر parse_tg_page (lxml)
+# ══════════════════════════════════════════════════════════════════════════
+def legacy_tg_parse(html: str, handle: str, cutoff) -> list[dict]:
+    import re
+    from datetime import datetime
+    soup = bot.BeautifulSoup(html, "html.parser")
+    msgs = soup.select(".tgme_widget_message_wrap") or soup.select(".tgme_widget_message")
+    results = []
+    for msg in msgs[-40:]:
+        txt_el = (msg.select_one(".tgme_widget_message_text")
+                  or msg.select_one(".tgme_widget_message_bubble .js-message_text")
+                  or msg.select_one("[data-post]"))
+        text = txt_el.get_text(" ", strip=True) if txt_el else ""
+        text = re.sub(r'\s+', ' ', text).strip()
+        if not text or len(text) < 10:
+            continue
+        time_el  = msg.select_one("time[datetime]")
+        dt_str   = time_el.get("datetime", "") if time_el else ""
+        entry_dt = None
+        if dt_str:
+            try: entry_dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
+            except Exception: pass
+        if entry_dt and entry_dt < cutoff:
+            continue
+        link_el = (msg.select_one("a.tgme_widget_message_date")
+                   or msg.select_one("a[href*='t.me']"))
+        link = link_el.get("href", "") if link_el else f"https://t.me/{handle}"
+        first_line = text.split('\n')[0][:300].strip()
+        results.append({"title": first_line if first_line else text[:200],
+                        "summary": text[:1000], "link": link, "_tg_dt": entry_dt})
+    return results
+
+def synth_tg_page(handle: str, n: int = 20, first_id: int = 5000,
+                  t0=None, headline=None) -> str:
+    """
+    صفحه شبیه t.me/s واقعی: head سنگین، script، پیش‌نمایش لینک، emoji، reaction،
+    پیام بدون متن (عکس تنها). برای صفحه واقعی: BENCH_TG_DIR=<پوشه *.html>
+    t0: زمان اولین پیام؛ headline(i): متن خبر پیام i (replay.py synth)
+    """
+    from datetime import datetime, timedelta, timezone
+    t0 = t0 or datetime(2026, 6, 1, 8, 0, tzinfo=timezone.utc)
+    headline = headline or (lambda i: f"Iranian missile strike number {i} reported near")
+    head = ("<!DOCTYPE html><html><head><meta charset='utf-8'><title>" + handle +
+            "</title>" + "<link rel='stylesheet' href='//telegram.org/css/widget.css?1'>" * 6 +
+            "<style>" + ".tgme_x{color:#000}" * 300 + "</style>"
+            "<script>" + "var a=1;" * 400 + "</script></head><body class='widget_frame_base'>"
+            "<header class='tgme_header'><div class='tgme_header_title'>" + handle +
+            "</div></header><main class='tgme_main'><section class='tgme_channel_history js-message_history'>")
+    body = []
+    for i in range(n):
+        mid = first_id + i
+        dt  = (t0 + timedelta(minutes=7 * i)).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        text = ("" if i % 9 == 4 else
+                f"<i class='emoji' style=\"background-image:url('//x/e.png')\"><b>🔴</b></i>"
+                f"<b>BREAKING</b>: {headline(i)} "
+                f"<a href='https://example.com/n{i}'>Haifa</a> port<br/>"
+                f"IDF says interceptors were launched &amp; sirens sounded in the north.<br/>"
+                f"<a href='?q=%23Iran'>#Iran</a> <a href='?q=%23Israel'>#Israel</a>")
+        preview = ("<a class='tgme_widget_message_link_preview' href='https://example.com/a'>"
+                   "<div class='link_preview_site_name'>Example</div>"
+                   "<div class='link_preview_title'>Preview title</div>"
+                   "<div class='link_preview_description'>" + "lorem ipsum " * 20 +
+                   "</div></a>") if i % 3 == 0 else ""
+        body.append(
+            f"<div class='tgme_widget_message_wrap js-widget_message_wrap'>"
+            f"<div class='tgme_widget_message text_not_supported_wrap js-widget_message' "
+            f"data-post='{handle}/{mid}' data-view='eyJjIjotMT'>"
+            f"<div class='tgme_widget_message_user'><a href='https://t.me/{handle}'>"
+            f"<i class='tgme_widget_message_user_photo bgcolor0'><img src='//cdn/p.jpg'></i></a></div>"
+            f"<div class='tgme_widget_message_bubble'><i class='tgme_widget_message_bubble_tail'>"
+            f"<svg class='bubble_icon' width='9px' height='20px'><path d='M0 0'/></svg></i>"
+            f"<div class='tgme_widget_message_author accent_color'><a class='tgme_widget_message_owner_name' "
+            f"href='https://t.me/{handle}'><span dir='auto'>{handle}</span></a></div>"
+            + (f"<div class='tgme_widget_message_text js-message_text' dir='auto'>{text}</div>" if text else
+               f"<a class='tgme_widget_message_photo_wrap' href='https://t.me/{handle}/{mid}' "
+               f"style=\"background-image:url('//cdn/ph.jpg')\"></a>")
+            + preview +
+            f"<div class='tgme_widget_message_reactions'>" +
+            "".join(f"<span class='tgme_reaction'><i class='emoji'><b>👍</b></i>{k}</span>" for k in range(4)) +
+            f"</div><div class='tgme_widget_message_footer compact js-message_footer'>"
+            f"<div class='tgme_widget_message_info short js-message_info'>"
+            f"<span class='tgme_widget_message_views'>12.{i}K</span>"
+            f"<span class='tgme_widget_message_meta'><a class='tgme_widget_message_date' "
+            f"href='https://t.me/{handle}/{mid}'><time datetime='{dt}' class='time'>08:{i:02d}</time>"
+            f"</a></span></div></div></div></div></div>")
+    return head + "".join(body) + "</section></main><script>" + "x();" * 200 + "</script></body></html>"
+
+def _tg_fixtures() -> list[tuple[str, str]]:
+    d = os.environ.get("BENCH_TG_DIR", "")
+    if d and Path(d).is_dir():
+        return [(fp.stem, fp.read_text("utf-8")) for fp in sorted(Path(d).glob("*.html"))]
+    return [(f"chan{i}", synth_tg_page(f"chan{i}")) for i in range(12)]
+
+def bench_telegram():
+    from datetime import datetime, timezone
+    cutoff = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    pages  = _tg_fixtures()
+    same = all(legacy_tg_parse(h, name, cutoff) == bot.parse_tg_page(h, name, cutoff)
+               for name, h in pages)
+    kb = sum(len(h) for _, h in pages) / len(pages) / 1024
+    r_old = _rate(lambda p: legacy_tg_parse(p[1], p[0], cutoff), pages, 2)
+    r_new = _rate(lambda p: bot.parse_tg_page(p[1], p[0], cutoff), pages, 3)
+    # چرخه بعد: فقط ۲ پیام جدید از آخرین id دیده‌شده
+    after = {name: bot._tg_msg_id(bot.parse_tg_page(h, name, cutoff)[-3]["link"])
+             for name, h in pages}
+    r_inc = _rate(lambda p: bot.parse_tg_page(p[1], p[0], cutoff, after[p[0]]), pages, 3)
+    print(f"pages={len(pages)} (~{kb:.0f} KB)   bs4 {r_old:7.1f} page/s   "
+          f"lxml {r_new:7.1f} page/s ×{r_new / r_old:.1f}   lxml+after_id {r_inc:7.1f} page/s ×{r_inc / r_old:.1f}")
+    print(f"نتیجه یکسان با bs4: {'✅' if same else '❌'}")
+    return same
+
+# ══════════════════════════════════════════════════════════════════════════
+# lag event loop زیر بار parse/تصویر — inline در برابر executor
+# ══════════════════════════════════════════════════════════════════════════
+def synth_rss(n: int = 60, seed: int = 0, t0=None, headline=None) -> str:
+    from datetime import datetime, timedelta, timezone
+    t0 = t0 or datetime(2026, 6, 1, 8, 0, tzinfo=timezone.utc)
+    headline = headline or (lambda i: f"Iran missile strike {seed}-{i} on Israeli base reported")
+    pub = lambda i: (t0 + timedelta(minutes=i)).strftime("%a, %d %b %Y %H:%M:%S GMT")
+    items = "".join(
+        f"<item><title>{headline(i)}</title>"
+        f"<link>https://news.example/{seed}/{i}</link><guid>{seed}-{i}</guid>"
+        f"<pubDate>{pub(i)}</pubDate>"
+        f"<description><![CDATA[<p>{'Officials said the attack targeted air defence sites. ' * 8}</p>"
+        f"<img src='https://img.example/{i}.jpg'/>]]></description></item>" for i in range(n))
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>s{seed}</title>{items}</channel></rss>'
+
+def _synth_jpeg(w=2000, h=1200) -> bytes:
+    import io, random
+    img = bot.Image.new("RGB", (w, h))
+    img.putdata([(random.randrange(256), 90, 160) for _ in range(w * h)])
+    out = io.BytesIO(); img.save(out, "JPEG", quality=90); return out.getvalue()
+
+def _lag_run(threads: int, procs: int, feeds, pages, images) -> tuple:
+    import asyncio
+    from datetime import datetime, timezone
+    cutoff = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    bot.CPU_THREADS, bot.CPU_PROCS = threads, procs
+    async def run():
+        # گرم کردن pool ها (spawn process زمان‌بر است — جزو اندازه‌گیری نیست)
+        await asyncio.gather(bot.run_cpu(bot._parse_feed, feeds[0], kind="proc"),
+                             bot.run_cpu(len, ""))
+        mon = bot.LoopLagMonitor(0.005); mon.start()
+        await asyncio.sleep(0.05); mon.report()
+        t0 = time.perf_counter()
+        jobs  = [bot.run_cpu(bot._parse_feed, f, kind="proc") for f in feeds]
+        jobs += [bot.run_cpu(bot.parse_tg_page, h, n, cutoff) for n, h in pages]
+        jobs += [bot.run_cpu(bot._prep_image, im) for im in images]
+        res = await asyncio.gather(*jobs)
+        wall = time.perf_counter() - t0
+        await asyncio.sleep(0.02)   # نمونه آخر (stall کامل حالت inline) ثبت شود
+        p50, p99, mx = mon.report(); mon.stop()
+        bot.shutdown_pools()
+        return wall, p50, p99, mx, sum(len(r) if isinstance(r, list) else 1 for r in res)
+    return asyncio.run(run())
+
+def bench_looplag():
+    if not bot.PIL_OK:
+        print("Pillow نصب نیست"); return
+    feeds  = [synth_rss(60, i) for i in range(30)]
+    pages  = [(f"chan{i}", synth_tg_page(f"chan{i}")) for i in range(20)]
+    images = [_synth_jpeg() for _ in range(4)]
+    rows = [("inline (قدیمی)", 0, 0), ("thread", 4, 0), ("thread+process", 4, 2)]
+    counts = set()
+    for name, th, pr in rows:
+        wall, p50, p99, mx, n = _lag_run(th, pr, feeds, pages, images)
+        counts.add(n)
+        print(f"{name:<16} wall {wall:5.2f}s   lag p50 {p50:6.1f}ms  p99 {p99:7.1f}ms  max {mx:7.1f}ms")
+    print(f"نتیجه یکسان: {'✅' if len(counts) == 1 else '❌'}   (cpu={os.cpu_count()})")
+    return len(counts) == 1
+
+def _timeit(fn) -> float:
+    t0 = time.perf_counter(); fn(); return time.perf_counter() - t0
+
+# ══════════════════════════════════════════════════════════════════════════
+# ترجمه Gemini — یک درخواست بزرگ قدیمی در برابر chunk های هم‌زمان
+# ══════════════════════════════════════════════════════════════════════════
+TR_SCALE = 0.05   # زمان‌ها (تأخیر مدل، timeout) × این ضریب
+
+def _gemini_latency(n_items: int) -> float:
+    """تولید خروجی LLM تقریباً خطی در طول خروجی: ~۰.۶s برای هر خبر + ۱s ثابت"""
+    return 1.0 + 0.6 * n_items
+
+def _gemini_mock(drop: float, seed: int = 3):
+    import asyncio, random, re
+    rng = random.Random(seed)
+    async def handler(request):
+        body   = json.loads(request.content)
+        prompt = body["contents"][0]["parts"][0]["text"]
+        items  = re.findall(r"###ITEM_(\d+)###\nEN_TITLE: (.*)", prompt)
+        await asyncio.sleep(min(_gemini_latency(len(items)),
+                                request.extensions["timeout"]["read"] / TR_SCALE) * TR_SCALE)
+        if _gemini_latency(len(items)) * TR_SCALE > request.extensions["timeout"]["read"]:
+            raise bot.httpx.ReadTimeout("timeout", request=request)
+        # گاهی مدل یک بلوک را جا می‌اندازد / خراب می‌نویسد
+        out = "".join(f"###ITEM_{i}###\nT: عنوان ترجمه‌شده شماره {i}\nB: متن ترجمه‌شده\n\n"
+                      for i, _ in items if rng.random() >= drop)
+        return bot.httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": out}]}}]})
+    return handler
+
+async def legacy_translate_gemini(client, articles: list) -> list | None:
+    """نسخه قبلی: همه خبرها در یک prompt، یک مدل، timeout ۴۰ ثانیه"""
+    items_txt = "".join(f"###ITEM_{i}###\nEN_TITLE: {t[:300]}\nEN_BODY: {s[:400]}\n\n"
+                        for i, (t, s) in enumerate(articles))
+    for model in bot.GEMINI_MODELS:
+        try:
+            r = await client.post(
+                f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent",
+                json={"contents": [{"parts": [{"text": bot.GEMINI_PROMPT.format(items=items_txt)}]}]},
+                timeout=bot.httpx.Timeout(40.0 * TR_SCALE))
+            text_out = r.json()["candidates"][0]["content"]["parts"][0]["text"]
+            return [r or a for r, a in zip(bot._parse_gemini(text_out, len(articles)), articles)]
+        except Exception:
+            continue
+    return None
+
+def bench_translate():
+    """۵۰ خبر: زمان کل و تعداد ترجمه‌شده، با ۵٪ بلوک خراب در پاسخ مدل"""
+    import asyncio
+    arts = [(f"Headline {i}: " + "missile strike reported near the border " * 3,
+             "Officials said the attack targeted military sites. " * 6) for i in range(50)]
+    saved = (bot.GEMINI_API_KEY, bot.GEMINI_TIMEOUT, bot.GEMINI_DEADLINE)
+    bot.GEMINI_API_KEY  = "bench"
+    bot.GEMINI_TIMEOUT  = 25.0 * TR_SCALE
+    bot.GEMINI_DEADLINE = 60.0 * TR_SCALE
+    async def run(fn):
+        st = bot.STATE.json("gemini", bot.GEMINI_STATE_FILE)
+        st["rl"], st["models_order"] = {}, list(bot.GEMINI_MODELS)
+        async with bot.httpx.AsyncClient(transport=bot.httpx.MockTransport(_gemini_mock(0.05))) as c:
+            t0  = time.perf_counter()
+            res = await fn(c, arts)
+            return time.perf_counter() - t0, res
+    try:
+        t_old, r_old = asyncio.run(run(legacy_translate_gemini))
+        t_new, r_new = asyncio.run(run(bot._translate_gemini))
+    finally:
+        bot.GEMINI_API_KEY, bot.GEMINI_TIMEOUT, bot.GEMINI_DEADLINE = saved
+    ok_old = sum(1 for r, a in zip(r_old or [], arts) if r != a)
+    ok_new = sum(1 for r in r_new if r)
+    real = lambda t: t / TR_SCALE
+    print(f"items={len(arts)}  یک درخواست {real(t_old):5.1f}s ({ok_old} ترجمه)"
+          f"   chunk هم‌زمان {real(t_new):5.1f}s ({ok_new} ترجمه)   ×{t_old / t_new:.1f}")
+    return ok_new == len(arts) and t_new < t_old
+
+# ══════════════════════════════════════════════════════════════════════════
+# ارسال Telegram — حلقه ترتیبی قدیمی در برابر TelegramSender
+# ══════════════════════════════════════════════════════════════════════════
+SEND_SCALE   = 0.02   # زمان‌ها × این ضریب (۵۰ خبر در محدودیت ۲۰/دقیقه ≈ ۲.۵ دقیقه واقعی)
+SEND_LIMIT   = 20     # محدودیت شبیه‌سازی‌شده کانال: پیام در ۶۰ ثانیه (پنجره لغزان)
+SEND_LATENCY = 0.35   # تأخیر هر فراخوانی Bot API
+
+def _tg_limited():
+    """Bot API جعلی با پنجره لغزان ۶۰ ثانیه‌ای؛ retry_after مثل Telegram تا آزاد شدن پنجره"""
+    import asyncio
+    window, stats = [], {"ok": 0, "429": 0}
+    async def handler(request):
+        await asyncio.sleep(SEND_LATENCY * SEND_SCALE)
+        now = time.monotonic()
+        window[:] = [t for t in window if now - t < 60 * SEND_SCALE]
+        if len(window) >= SEND_LIMIT:
+            stats["429"] += 1
+            wait = int((window[0] + 60 * SEND_SCALE - now) / SEND_SCALE) + 1
+            return bot.httpx.Response(429, json={"ok": False, "error_code": 429,
+                                                 "parameters": {"retry_after": wait * SEND_SCALE}})
+        window.append(now); stats["ok"] += 1
+        return bot.httpx.Response(200, json={"ok": True, "result": {}})
+    return handler, stats
+
+async def legacy_send_loop(client, captions: list) -> int:
+    """نسخه قبلی: ارسال پشت‌سرهم، 429 کل حلقه را می‌خواباند، SEND_DELAY بین پیام‌ها"""
+    import asyncio
+    sent = 0
+    for text in captions:
+        for attempt in range(3):
+            r = await client.post(bot._tgapi("sendMessage"), json={"text": text})
+            d = r.json()
+            if d.get("ok"): sent += 1; break
+            if d.get("error_code") == 429:
+                await asyncio.sleep(d["parameters"]["retry_after"])
+            elif attempt < 2:
+                await asyncio.sleep(3 * SEND_SCALE)
+        await asyncio.sleep(0.3 * SEND_SCALE)
+    return sent
+
+def bench_send():
+    """burst ۵۰ خبر: زمان تا آخرین ارسال، 429 ها، و زمانی که چرخه منتظر ارسال می‌ماند"""
+    import asyncio
+    caps = [f"<b>خبر {i}</b>" for i in range(50)]
+    saved = bot.TG_CHAT_RATE, bot.TG_GLOBAL_RATE, bot.SENDER
+    bot.TG_CHAT_RATE   = SEND_LIMIT / 60 / SEND_SCALE
+    bot.TG_GLOBAL_RATE = 30 / SEND_SCALE
+    class _Seen(set): pass
+
+    async def run(new: bool):
+        handler, stats = _tg_limited()
+        async with bot.httpx.AsyncClient(transport=bot.httpx.MockTransport(handler)) as c:
+            t0 = time.perf_counter()
+            if not new:
+                await legacy_send_loop(c, caps)
+                return time.perf_counter() - t0, time.perf_counter() - t0, stats
+            bot.SENDER = bot.TelegramSender()
+            bot.SENDER.jobs.clear()
+            bot.SENDER.start(c, _Seen())
+            for i, cap in enumerate(caps):
+                bot.SENDER.submit(f"bench{i}", cap, "", 0, time.time())
+            blocked = time.perf_counter() - t0
+            await bot.SENDER.drain(600)
+            bot.SENDER.stop()
+            return time.perf_counter() - t0, blocked, stats
+    try:
+        t_old, b_old, s_old = asyncio.run(run(False))
+        t_new, b_new, s_new = asyncio.run(run(True))
+    finally:
+        bot.TG_CHAT_RATE, bot.TG_GLOBAL_RATE, bot.SENDER = saved
+    real = lambda t: t / SEND_SCALE
+    rate = lambda t, st: st["ok"] / real(t) * 60
+    print(f"محدودیت {SEND_LIMIT}/دقیقه، {len(caps)} خبر (زمان واقعی، مقیاس {SEND_SCALE}):")
+    print(f"  ترتیبی        {real(t_old):6.1f}s  {s_old['ok']:2d} ارسال  429×{s_old['429']:<3d}"
+          f" {rate(t_old, s_old):5.1f}/دقیقه   چرخه منتظر {real(b_old):6.1f}s")
+    print(f"  TelegramSender {real(t_new):5.1f}s  {s_new['ok']:2d} ارسال  429×{s_new['429']:<3d}"
+          f" {rate(t_new, s_new):5.1f}/دقیقه   چرخه منتظر {real(b_new):6.1f}s")
+    return s_new["ok"] == len(caps)
+
+# ══════════════════════════════════════════════════════════════════════════
+# prefetch تصویر — burst ۲۰ خبر RSS، کل چرخه (fetch → ترجمه → ارسال با عکس)
+# ══════════════════════════════════════════════════════════════════════════
+def bench_prefetch():
+    """
+    replay.py با یک feed: صفحه مقاله ۰.۸s، تصویر ۰.۶s، Gemini ۲s، Telegram ۰.۲s.
+    نرخ صف ارسال باز است تا اثر prefetch دیده شود (با ۲۰/دقیقه ارسال غالب است).
+    """
+    import asyncio, random, tempfile
+    from datetime import datetime, timedelta, timezone
+    import replay
+    if not bot.PIL_OK:
+        print("PIL نصب نیست — رد شد"); return None
+    now  = datetime.now(timezone.utc).replace(microsecond=0)
+    rng  = random.Random(5)
+    feed = "https://feed.bench/rss"
+    saved = (bot.ALL_RSS_FEEDS, bot.TELEGRAM_CHANNELS, bot.TWITTER_HANDLES,
+             bot.GEMINI_API_KEY, bot.TG_CHAT_RATE, bot.IMG_PREFETCH_CONC)
+
+    def run(rec, conc: int):
+        def go():
+            replay._fresh_bot_state(0)
+            bot.IMG_PREFETCH_CONC = conc
+            bot.SENDER = bot.TelegramSender()
+            fakes = {replay.TG_HOST: replay.FakeTelegram(0.2),
+                     replay.GEMINI_HOST: replay.FakeGemini(2.0)}
+            rec.rewind()
+            res = asyncio.run(replay.run_cycle(replay.ReplayTransport(rec, fakes),
+                                               now - timedelta(minutes=bot.MAX_LOOKBACK_MIN)))
+            hs  = bot.METRICS.hists
+            lat = [h[-2] / h[-1] for h in hs.get("item_latency_seconds", {}).values() if h[-1]]
+            # photo_id = همان تصویر قبلاً آپلودشده (JPEG های یکسان) — هر دو عکس تحویل‌شده‌اند
+            photos = sum(h[-1] for k, h in hs.get("tg_send_seconds", {}).items()
+                         if dict(k).get("method") in ("photo", "photo_id") and dict(k).get("ok"))
+            return res["wall"], photos, lat[0] if lat else 0.0
+        return replay._in_tmpdir(go)
+
+    with tempfile.TemporaryDirectory() as d:
+        rec = replay.Recording(d, now)
+        rss = synth_rss(20, 0, now - timedelta(minutes=30), lambda i: replay._headline(rng))
+        rec.add("GET", bot.httpx.URL(feed), 200, {"content-type": "application/rss+xml"},
+                rss.encode(), 0.3)
+        jpeg = _synth_jpeg(1400, 800)
+        for i in range(20):
+            page = (f"<html><head><meta property='og:image' content='https://img.bench/{i}.jpg'>"
+                    f"<meta property='og:image:width' content='1400'></head><body></body></html>")
+            rec.add("GET", bot.httpx.URL(f"https://news.example/0/{i}"), 200,
+                    {"content-type": "text/html"}, page.encode(), 0.8)
+            rec.add("GET", bot.httpx.URL(f"https://img.bench/{i}.jpg"), 200,
+                    {"content-type": "image/jpeg"}, jpeg, 0.6)
+        rec.save()
+        rec = replay.Recording.load(d)
+        try:
+            bot.ALL_RSS_FEEDS   = [{"n": "bench", "u": feed}]
+            bot.TELEGRAM_CHANNELS, bot.TWITTER_HANDLES = [], []
+            bot.GEMINI_API_KEY  = "bench"
+            bot.TG_CHAT_RATE    = 600 / 60
+            t_off, ph_off, l_off = run(rec, 0)
+            t_on,  ph_on,  l_on  = run(rec, saved[5] or 6)
+        finally:
+            (bot.ALL_RSS_FEEDS, bot.TELEGRAM_CHANNELS, bot.TWITTER_HANDLES,
+             bot.GEMINI_API_KEY, bot.TG_CHAT_RATE, bot.IMG_PREFETCH_CONC) = saved
+    print(f"۲۰ خبر RSS با تصویر:  بدون prefetch {t_off:5.1f}s (fetch→sent میانگین {l_off:4.1f}s, {ph_off} عکس)"
+          f"   prefetch {t_on:5.1f}s ({l_on:4.1f}s, {ph_on} عکس)   ×{t_off / t_on:.1f}")
+    return ph_on == ph_off and t_on < t_off
+
+async def legacy_download_image(client, img_url: str):
+    """نسخه قبلی bot._download_image — دانلود کامل، بعد بررسی حجم/ابعاد"""
+    try:
+        ir = await client.get(img_url, timeout=bot.httpx.Timeout(12.0),
+                              headers={**bot.COMMON_UA, "Accept": "image/*,*/*;q=0.5"},
+                              follow_redirects=True)
+    except Exception:
+        return None
+    if ir.status_code != 200:
+        return None
+    raw = ir.content
+    if len(raw) < 15_000:
+        await bot._img_store(img_url, None, (), len(raw)); return None
+    jpeg, info, size = await bot.run_cpu(bot._prep_image, raw)
+    await bot._img_store(img_url, jpeg, size, len(raw))
+    return jpeg
+
+def bench_imgprobe():
+    """
+    ۳۰ مقاله، هر کدام به ترتیب اولویت: لوگوی مربعی PNG، بنر باریک، تصویر خبر.
+    معیار: بایت خوانده‌شده از شبکه به ازای هر تصویر پذیرفته‌شده (بدنه جریانی ۱۶KB به ۱۶KB).
+    """
+    import asyncio, io, os
+    import replay
+    from PIL import Image
+    if not bot.PIL_OK:
+        print("PIL نصب نیست — رد شد"); return None
+
+    def noise(w, h, fmt, **kw):
+        b = io.BytesIO()
+        Image.frombytes("RGB", (w, h), os.urandom(w * h * 3)).save(b, fmt, **kw)
+        return b.getvalue()
+
+    kinds = {"logo.png":   (noise(900, 900, "PNG"), "image/png"),
+             "banner.jpg": (noise(1600, 240, "JPEG", quality=90), "image/jpeg"),
+             "square.jpg": (noise(1200, 1200, "JPEG", quality=90), "image/jpeg"),
+             "hero.jpg":   (noise(1400, 800, "JPEG", quality=85), "image/jpeg")}
+    n_art = 30
+
+    class Chunked(bot.httpx.AsyncByteStream):
+        def __init__(self, data, ctr):
+            self.data, self.ctr = data, ctr
+        async def __aiter__(self):
+            for i in range(0, len(self.data), 16384):
+                chunk = self.data[i:i + 16384]
+                self.ctr[0] += len(chunk)
+                await asyncio.sleep(0)
+                yield chunk
+
+    def run(download):
+        ctr = [0]
+        def handler(req):
+            data, ctype = kinds[req.url.path.rsplit("/", 1)[1]]
+            return bot.httpx.Response(200, stream=Chunked(data, ctr),
+                                      headers={"content-type": ctype})
+        async def go():
+            ok = 0
+            async with bot.httpx.AsyncClient(transport=bot.httpx.MockTransport(handler)) as c:
+                for i in range(n_art):
+                    for k in ("logo.png", "banner.jpg", "square.jpg", "hero.jpg"):
+                        if await bot._fetch_image(c, f"https://img.bench/{i}/{k}"):
+                            ok += 1; break
+            return ok
+        def inner():
+            replay._fresh_bot_state(0)
+            saved, bot._download_image = bot._download_image, download
+            try:
+                t0 = time.perf_counter()
+                ok = asyncio.run(go())
+                return ok, ctr[0], time.perf_counter() - t0
+            finally:
+                bot._download_image = saved
+        return replay._in_tmpdir(inner)
+
+    ok_old, b_old, t_old = run(legacy_download_image)
+    ok_new, b_new, t_new = run(bot._download_image)
+    per_old, per_new = b_old / max(ok_old, 1), b_new / max(ok_new, 1)
+    print(f"{n_art} مقاله × ۴ نامزد:  دانلود کامل {per_old/1024:7.0f}KB/تصویر ({t_old:4.1f}s, {ok_old} پذیرفته)"
+          f"   probe {per_new/1024:7.0f}KB/تصویر ({t_new:4.1f}s, {ok_new} پذیرفته)   ×{per_old / per_new:.1f}")
+    return ok_new == ok_old == n_art and per_new < per_old / 2
+
+def bench_quietfeed():
+    """
+    منبع ساکتی که SourceScheduler چند چرخه ردش کرده، وسط بازه خبر می‌گذارد.
+    چرخه ۱ در T: feed فقط خبر A دارد. poll بعدی feed در T+12m (شبیه‌سازی: عقب بردن
+    last_ok)؛ خبر B در T+4m منتشر شده ولی cutoff سراسری = شروع چرخه قبل − ۴ = T+7m.
+    بدون cutoff هر منبع، B «قدیمی» حساب و بی‌صدا حذف می‌شد.
+    """
+    import asyncio
+    from datetime import datetime, timedelta, timezone
+    import replay
+    feed = "https://feed.bench/quiet"
+    heads = ["Iran launches ballistic missiles at Israeli air base in Negev",
+             "Hezbollah drone strikes IDF outpost near Lebanese border"]
+    saved = (bot.ALL_RSS_FEEDS, bot.TELEGRAM_CHANNELS, bot.TWITTER_HANDLES,
+             bot.GEMINI_API_KEY, bot.TG_CHAT_RATE, bot.SourceScheduler.cutoff)
+
+    def rss(items):
+        body = "".join(
+            f"<item><title>{t}</title><link>https://news.example/q/{i}</link><guid>q-{i}</guid>"
+            f"<pubDate>{dt.strftime('%a, %d %b %Y %H:%M:%S GMT')}</pubDate>"
+            f"<description>Officials said the attack targeted air defence sites.</description></item>"
+            for i, (t, dt) in enumerate(items))
+        return f'<?xml version="1.0"?><rss version="2.0"><channel><title>q</title>{body}</channel></rss>'
+
+    class Net(bot.httpx.AsyncBaseTransport):
+        def __init__(self):
+            self.rss   = ""
+            self.fakes = {replay.TG_HOST: replay.FakeTelegram(0.01),
+                          replay.GEMINI_HOST: replay.FakeGemini(0.05)}
+        async def handle_async_request(self, request):
+            fake = replay._fake_for(request, self.fakes)
+            if fake:
+                return await fake(request)
+            if str(request.url) == feed:
+                return bot.httpx.Response(200, headers={"content-type": "application/rss+xml"},
+                                          stream=bot.httpx.ByteStream(self.rss.encode()),
+                                          request=request)
+            raise bot.httpx.ConnectError("not recorded", request=request)
+
+    def run() -> tuple:
+        def go():
+            replay._fresh_bot_state(0)
+            net  = Net()
+            tg   = net.fakes[replay.TG_HOST].stats
+            now  = datetime.now(timezone.utc).replace(microsecond=0)
+            T    = now - timedelta(minutes=12)
+            # چرخه ۱ (در T)
+            net.rss = rss([(heads[0], T - timedelta(minutes=30))])
+            asyncio.run(replay.run_cycle(net, now - timedelta(minutes=bot.MAX_LOOKBACK_MIN)))
+            st = bot.STATE.json("sched", bot.SCHED_STATE_FILE)[bot._rss_key(bot.ALL_RSS_FEEDS[0])]
+            st["last_ok"] -= 12 * 60; st["next"] = 0          # ۱۲ دقیقه ساکت و رد شده
+            sent1 = tg["sent"]
+            # چرخه بعد (در T+12m): چرخه قبلی (feed رد شد) در T+11m شروع شده بود
+            net.rss = rss([(heads[1], T + timedelta(minutes=4)),
+                           (heads[0], T - timedelta(minutes=30))])
+            asyncio.run(replay.run_cycle(net, now - timedelta(minutes=1 + bot.CUTOFF_BUFFER_MIN)))
+            return sent1, tg["sent"] - sent1
+        return replay._in_tmpdir(go)
+
+    try:
+        bot.ALL_RSS_FEEDS   = [{"n": "quiet", "u": feed}]
+        bot.TELEGRAM_CHANNELS, bot.TWITTER_HANDLES = [], []
+        bot.GEMINI_API_KEY  = "bench"
+        bot.TG_CHAT_RATE    = 6000 / 60
+        bot.SourceScheduler.cutoff = lambda self, key, cutoff: cutoff
+        old = run()
+        bot.SourceScheduler.cutoff = saved[5]
+        new = run()
+    finally:
+        (bot.ALL_RSS_FEEDS, bot.TELEGRAM_CHANNELS, bot.TWITTER_HANDLES,
+         bot.GEMINI_API_KEY, bot.TG_CHAT_RATE, bot.SourceScheduler.cutoff) = saved
+    print(f"خبر وسط بازه منبع ساکت:  cutoff سراسری {old[1]} ارسال   cutoff هر منبع {new[1]} ارسال"
+          f"   (چرخه ۱: {old[0]}/{new[0]})")
+    return new == (1, 1) and old == (1, 0)
+
+# جفت‌های برچسب‌خورده برای کالیبره کردن NEARDUP_THRESHOLD
+NEARDUP_SAME = [   # یک رویداد، بازنویسی منبع دیگر — باید حذف شود
+    ("Iran launches missiles at Israel, explosions heard in Tel Aviv",
+     "Explosions heard in Tel Aviv as Iran launches missiles at Israel"),
+    ("BREAKING: Israeli strike hits Isfahan air base", "Israeli strike hits Isfahan air base - reports"),
+    ("US carrier Eisenhower enters Persian Gulf", "USS Eisenhower carrier enters the Persian Gulf"),
+    ("Hezbollah fires rockets at northern Israel", "Hezbollah fires dozens of rockets at northern Israel"),
+    ("Houthis claim drone attack on ship in Red Sea",
+     "Houthis claim drone attack on commercial ship in the Red Sea"),
+    ("IRGC says it seized tanker in Strait of Hormuz",
+     "IRGC seized a tanker in the Strait of Hormuz, state media says"),
+    ("Explosion reported near Natanz nuclear site", "🚨 Explosion reported near Natanz nuclear site"),
+    ("Israel says it intercepted missile launched from Yemen",
+     "Israel intercepted a missile launched from Yemen, IDF says"),
+    ("Iran's supreme leader vows revenge for Damascus strike",
+     "Iran supreme leader vows revenge over Damascus strike"),
+    ("Pentagon sends more fighter jets to Middle East", "Pentagon to send more fighter jets to the Middle East"),
+    ("خبر فوری: حمله موشکی ایران به پایگاه نواتیم", "حمله موشکی ایران به پایگاه نواتیم"),
+    ("انفجار در نزدیکی تاسیسات هسته‌ای نطنز", "انفجار در نزدیکی تأسیسات هسته‌ای نطنز گزارش شد"),
+]
+NEARDUP_DIFF = [   # رویداد متفاوت با عنوان شبیه — نباید حذف شود
+    ("Strike on Isfahan base", "Strike near Isfahan airport"),
+    ("Israeli strike hits Isfahan air base", "Israeli strike hits Isfahan nuclear facility"),
+    ("Iran launches missiles at Haifa port", "Iran launches drones at Haifa port"),
+    ("Explosion reported near Natanz nuclear site", "Explosion reported near Fordow nuclear site"),
+    ("Hezbollah fires rockets at northern Israel", "Hezbollah fires anti-tank missiles at northern Israel"),
+    ("US strikes Houthi targets in Yemen", "UK strikes Houthi targets in Yemen"),
+    ("Israeli airstrike kills commander in Beirut", "Israeli airstrike kills commander in Damascus"),
+    ("Missile attack on US base in Iraq", "Drone attack on US base in Syria"),
+    ("Iran seizes tanker in Strait of Hormuz", "Iran releases tanker in Strait of Hormuz"),
+    ("Sirens sound in Tel Aviv", "Sirens sound in Haifa"),
+    ("IDF strikes Hezbollah targets in south Lebanon", "IDF strikes Hamas targets in Gaza"),
+    ("Iran foreign minister meets Saudi counterpart", "Iran foreign minister meets Qatari counterpart"),
+    ("حمله پهپادی به پایگاه آمریکا در عراق", "حمله پهپادی به پایگاه آمریکا در سوریه"),
+]
+
+def bench_neardup():
+    """
+    recall (SAME حذف شد) و خطا (DIFF حذف شد = خبر گم‌شده) برای چند آستانه،
+    با و بدون تأیید کلمه‌ای NearDupIndex._distinct. شرط: آستانه فعلی روی DIFF صفر خطا.
+    """
+    distinct = bot.NearDupIndex._distinct
+
+    def score(th: float, words: bool) -> tuple[int, int]:
+        bot.NearDupIndex._distinct = distinct if words else classmethod(lambda cls, a, b: False)
+        try:
+            out = []
+            for pairs in (NEARDUP_SAME, NEARDUP_DIFF):
+                hit = 0
+                for a, b in pairs:
+                    idx = bot.NearDupIndex(threshold=th)
+                    idx.add(idx.signature(a), "s", title=a)
+                    hit += idx.query(idx.signature(b), b)
+                out.append(hit)
+            return tuple(out)
+        finally:
+            bot.NearDupIndex._distinct = distinct
+
+    ns, nd = len(NEARDUP_SAME), len(NEARDUP_DIFF)
+    print(f"جفت: {ns} یک‌رویداد (باید حذف شود)   {nd} رویداد متفاوت (نباید)")
+    res = {}
+    for th in (0.5, 0.55, 0.6, 0.65, 0.7, 0.8):
+        (s0, d0), (s1, d1) = score(th, False), score(th, True)
+        res[th] = (s1, d1)
+        mark = "  ← NEARDUP_THRESHOLD" if th == bot.NEARDUP_THRESHOLD else ""
+        print(f"  θ={th:.2f}  فقط MinHash: حذف {s0:2}/{ns}  خطا {d0:2}/{nd}"
+              f"   + کلمه: حذف {s1:2}/{ns}  خطا {d1:2}/{nd}{mark}")
+    s1, d1 = res.get(bot.NEARDUP_THRESHOLD) or score(bot.NEARDUP_THRESHOLD, True)
+    return d1 == 0 and s1 >= 0.75 * ns
+
+BENCHMARKS = {
+    "relevance": bench_relevance,
+    "classify":  bench_classify,
+    "stories":   bench_stories,
+    "stories_file": bench_stories_file,
+    "seen":      bench_seen,
+    "twitter":   bench_twitter,
+    "twitter_batch": bench_twitter_batch,
+    "telegram":  bench_telegram,
+    "looplag":   bench_looplag,
+    "translate": bench_translate,
+    "send":      bench_send,
+    "prefetch":  bench_prefetch,
+    "imgprobe":  bench_imgprobe,
+    "quietfeed": bench_quietfeed,
+    "neardup":   bench_neardup,
+}
+
+if __name__ == "__main__":
+    bot.log.setLevel("WARNING")
+    bot.logging.getLogger("httpx").setLevel("WARNING")
+    names = sys.argv[1:] or list(BENCHMARKS)
+    ok = True
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit(f"❌ بنچمارک ناشناخته: {name}  (موجود: {', '.join(BENCHMARKS)})")
+        print(f"\n── {name} " + "─" * 50)
+        ok = BENCHMARKS[name]() is not False and ok
+    sys.exit(0 if ok else 1)
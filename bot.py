@@ -1,7 +1,13 @@
-import os, json, hashlib, asyncio, logging, re, io
+import os, sys, json, hashlib, asyncio, logging, re, io, functools, math, mmap, random, signal, struct, time, unicodedata, zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
+import multiprocessing
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
+from typing import NamedTuple
+from urllib.parse import quote, urlparse
 from bs4 import BeautifulSoup
+from lxml import etree as lxml_etree, html as lxml_html
 import feedparser, httpx, pytz
 
 try:
@@ -31,17 +37,50 @@ BOT_TOKEN      = os.environ.get("BOT_TOKEN", "")
 CHANNEL_ID     = os.environ.get("CHANNEL_ID", "")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 
-SEEN_FILE         = "seen.json"
-STORIES_FILE      = "stories.json"
+SEEN_FILE         = "seen.json"    # فرمت قدیم — فقط برای migrate خوانده می‌شود
+SEEN_LOG_FILE     = "seen.log"
+STORIES_FILE      = "stories.json"   # فرمت قدیم — فقط برای migrate خوانده می‌شود
+STORIES_BIN_FILE  = "stories.bin"
 GEMINI_STATE_FILE = "gemini_state.json"
 RUN_STATE_FILE    = "run_state.json"
 NITTER_CACHE_FILE = "nitter_cache.json"
+NEARDUP_FILE      = "stories_lsh.bin"
+SCHED_STATE_FILE  = "sched_state.json"
+HTTP_CACHE_FILE   = "http_cache.json"
+TG_CURSOR_FILE    = "tg_cursors.json"
+TR_CACHE_FILE     = "tr_cache.json"
+SEND_QUEUE_FILE   = "send_queue.json"
+IMG_CACHE_FILE    = "img_cache.json"   # index (git) — فایل‌های JPEG در IMG_CACHE_DIR (actions/cache)
+IMG_CACHE_DIR     = "img_cache"
+TG_FILE_ID_FILE   = "tg_file_ids.json"
+
+# ── cache ترجمه (LRU + TTL) ────────────────────────────────────────────────
+TR_CACHE_MAX      = 4000   # حداکثر مدخل — قدیمی‌ترین استفاده اول حذف می‌شود
+TR_CACHE_TTL_H    = 48     # ترجمه کهنه‌تر دوباره درخواست می‌شود
+
+# ── cache تصویر مقاله (LRU با سقف حجم) ──────────────────────────────────────
+IMG_CACHE_MAX_MB  = 64     # مجموع JPEG های روی دیسک
+IMG_CACHE_MAX_N   = 6000   # سقف مدخل‌های index (صفحه + تصویر، شامل منفی‌ها)
+IMG_PAGE_TTL_H    = 48     # مقاله → تصویر انتخاب‌شده
+IMG_NEG_TTL_H     = 12     # «تصویر مناسب ندارد» / لوگو — بعد از این دوباره بررسی
+IMG_PROBE_BYTES   = 64 * 1024        # ابعاد باید در این مقدار اول فایل پیدا شود (JPEG با EXIF بزرگ → دانلود کامل)
+IMG_MAX_BYTES     = 8 * 1024 * 1024  # سقف دانلود یک تصویر — بیشتر = رها
 
 # ── زمان‌بندی و حلقه دائمی ─────────────────────────────────────────────────
 CUTOFF_BUFFER_MIN  = 4    # overlap — چند دقیقه قبل از آخرین اجرا نگاه کن
 MAX_LOOKBACK_MIN   = 90   # حداکثر برگشت (برای اولین اجرا / crash)
 SEEN_TTL_HOURS     = 6
-NITTER_CACHE_TTL   = 900
+SEEN_MAX           = 300_000
+HEALTH_ALPHA       = 0.2   # وزن EWMA نرخ موفقیت instance
+HEALTH_LAT_N       = 20    # پنجره تأخیر برای p50/p95
+HEALTH_BREAK_FAILS = 3     # خطای پشت‌سرهم تا باز شدن breaker
+HEALTH_COOLDOWN_SEC = 120
+HEALTH_COOLDOWN_MAX = 1800
+
+# ── زمان‌بندی تطبیقی هر منبع (SourceScheduler) ────────────────────────────
+SCHED_MIN_SEC      = 60    # = LOOP_INTERVAL_SEC — منبع پرکار هر چرخه
+SCHED_MAX_SEC      = {"rss": 900, "tg": 600, "tw": 600}   # سقف برای منبع ساکت
+SCHED_GAP_FRAC     = 0.15  # بازه poll = ۱۵٪ فاصله معمول بین خبرهای منبع
 
 LOOP_INTERVAL_SEC  = 60   # هر ۶۰ ثانیه — کافی برای fetch همه منابع
 # در GitHub Actions: bot را ۳۵۰ دقیقه اجرا کن، Actions هر ۶ ساعت restart می‌کند
@@ -50,17 +89,137 @@ _CI = bool(os.environ.get("CI") or os.environ.get("GITHUB_ACTIONS"))
 BOT_MAX_RUNTIME_MIN = 350 if _CI else 99999
 
 MAX_NEW_PER_RUN    = 50   # هر چرخه حداکثر ۵۰ خبر
+CPU_THREADS        = int(os.environ.get("CPU_THREADS", "4"))  # 0 = بدون executor (inline)
+CPU_PROCS          = int(os.environ.get("CPU_PROCS", "2"))    # process برای feedparser/BS4
+LAG_TICK_SEC       = 0.05  # دقت اندازه‌گیری lag event loop
+METRICS_PORT       = int(os.environ.get("METRICS_PORT", "0"))  # 0 = بدون endpoint
+METRICS_JSON       = os.environ.get("METRICS_JSON", "")        # مسیر snapshot — خالی = خاموش
+TR_BATCH_MAX       = 10   # pipeline: حداکثر خبر در یک فراخوانی ترجمه
+TR_LINGER_SEC      = 1.5  # بعد از اولین خبر کمی صبر برای جمع شدن batch (سهمیه Gemini)
 MAX_MSG_LEN        = 4096
-SEND_DELAY         = 0.3
+# ── صف ارسال Telegram — محدودیت Bot API: ~۲۰ پیام/دقیقه در یک کانال، ~۳۰/ثانیه کل
+TG_CHAT_RATE       = int(os.environ.get("TG_CHAT_PER_MIN", "20")) / 60   # پیام/ثانیه
+TG_CHAT_BURST      = 1     # burst به شمارش پنجره ۶۰ ثانیه اضافه می‌شود؛ >1 فقط با نرخ کمتر بدون 429
+TG_GLOBAL_RATE     = 30.0
+TG_SEND_CONC       = 3     # کارگر هم‌زمان (دریافت تصویر موازی، ارسال با توکن)
+TG_SEND_TRIES      = 4     # خطای غیر 429
+IMG_PREFETCH_CONC  = int(os.environ.get("IMG_PREFETCH_CONC", "6"))  # 0 = تصویر فقط هنگام ارسال
+SEND_MAX_AGE_MIN   = 60    # job قدیمی‌تر در صف ذخیره‌شده دیگر ارسال نمی‌شود
+SEND_DRAIN_SEC     = 90    # پایان اجرا: این‌قدر برای خالی شدن صف صبر کن
+TG_FILE_ID_MAX     = 3000  # file_id عکس‌های آپلودشده (hash محتوا → file_id)، LRU
 JACCARD_THRESHOLD  = 0.62  # آزاد — فقط خبرهای تقریباً یکسان رد شوند
-MAX_STORIES        = 150   # کمتر = dedup محدودتر = خبر بیشتر
+MAX_STORIES        = 1000  # کمتر = dedup محدودتر = خبر بیشتر (StoryIndex — هزینه خطی نیست)
+NEARDUP_THRESHOLD  = 0.6   # شباهت MinHash — کالیبره با benchmark.py neardup (جفت‌های رویداد متفاوت)
+NEARDUP_WINDOW_H   = 24
+MINHASH_PERM       = 64
 RSS_TIMEOUT        = 8.0
 TG_TIMEOUT         = 10.0
+TG_PAGE_FULL       = 20   # t.me/s حدوداً ۲۰ پیام در هر صفحه می‌دهد
+TG_MAX_PAGES       = 4    # سقف درخواست هر کانال در یک چرخه (صفحه اول + backfill)
 TW_TIMEOUT         = 6.0
+TW_HEDGE_N         = int(os.environ.get("TW_HEDGE_N", "3"))  # instance همزمان برای هر handle (1 = ترتیبی)
+TW_HEDGE_STAGGER   = 0.5  # فاصله شروع candidate بعدی
+TW_INST_CONC       = 4    # سقف درخواست همزمان به یک instance
+# batch فقط Nitter search است (RSSHub نه) و from: ریتوییت/quote را نمی‌آورد → پیش‌فرض خاموش
+TW_BATCH_SIZE      = int(os.environ.get("TW_BATCH", "1"))   # handle در هر search RSS (≤1 = خاموش)
+TW_BATCH_PAGE      = 20   # اندازه صفحه search نیتر — صفحه پر = شاید handle ی جا مانده
+TW_BATCH_RETRY_H   = 6    # mirror بدون search RSS بعد از این مدت دوباره امتحان شود
 RICH_CARD_THRESHOLD = 5
 
 TEHRAN_TZ = pytz.timezone("Asia/Tehran")
 
+# ══════════════════════════════════════════════════════════════════════════
+# State — همه فایل‌های state در حافظه، نوشتن یک‌جا در پایان هر چرخه
+# ══════════════════════════════════════════════════════════════════════════
+def _atomic_write(path: str, data: bytes):
+    """temp + fsync + rename — اگه Actions وسط نوشتن kill کند فایل نیمه‌کاره نمی‌ماند"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data); f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class StateManager:
+    """
+    بخش‌های state (run_state / seen / stories / nitter_cache / gemini_state / ...)
+    فقط در حافظه تغییر می‌کنند و mark_dirty می‌شوند؛ flush() در پایان هر چرخه
+    و هنگام خروج همه بخش‌های dirty را با _atomic_write می‌نویسد.
+
+    json(name, path)      → dict در حافظه (یک بار از دیسک خوانده می‌شود)
+    register(name, write) → بخش با writer اختصاصی (مثلاً فرمت باینری)
+    """
+    def __init__(self):
+        self._json:    dict[str, dict] = {}
+        self._writers: dict[str, object] = {}
+        self._dirty:   set = set()
+
+    def json(self, name: str, path: str) -> dict:
+        if name not in self._json:
+            data = {}
+            try:
+                if Path(path).exists():
+                    data = json.load(open(path, encoding="utf-8"))
+            except Exception as e:
+                log.warning(f"state {path}: {e}")
+            self._json[name] = data if isinstance(data, dict) else {}
+            self._writers[name] = lambda d=self._json[name], p=path: _atomic_write(
+                p, json.dumps(d, ensure_ascii=False).encode())
+        return self._json[name]
+
+    def register(self, name: str, writer):
+        self._writers[name] = writer
+
+    def mark_dirty(self, *names: str):
+        self._dirty.update(names)
+
+    def flush(self, *names: str) -> list:
+        """همه بخش‌های dirty — یا فقط names (مثلاً صف ارسال بلافاصله بعد از submit)"""
+        done = []
+        for name in sorted(self._dirty.intersection(names) if names else self._dirty):
+            writer = self._writers.get(name)
+            if not writer: continue
+            try:
+                writer(); done.append(name)
+            except Exception as e:
+                log.warning(f"state flush {name}: {e}")
+        self._dirty.difference_update(done)
+        return done
+
+STATE = StateManager()
+
+# ── cache اعتبارسنج HTTP (ETag/Last-Modified) — پایدار بین restart ها ────────
+# url → {"etag", "lm", "len"} ؛ len = حجم آخرین بدنه 200 برای محاسبه صرفه‌جویی 304
+_HTTP_STATS = {"n304": 0, "saved": 0}
+
+def _cond_headers(url: str) -> dict:
+    v = STATE.json("validators", HTTP_CACHE_FILE).get(url)
+    if not v: return {}
+    hdrs = {}
+    if v.get("etag"): hdrs["If-None-Match"]     = v["etag"]
+    if v.get("lm"):   hdrs["If-Modified-Since"] = v["lm"]
+    return hdrs
+
+def _remember_validators(url: str, r: httpx.Response):
+    """بعد از پاسخ 200 — فقط اگه سرور validator داده باشد"""
+    etag, lm = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    cache = STATE.json("validators", HTTP_CACHE_FILE)
+    if etag or lm:
+        cache[url] = {"etag": etag, "lm": lm, "len": len(r.content)}
+        STATE.mark_dirty("validators")
+    elif url in cache:
+        del cache[url]; STATE.mark_dirty("validators")
+
+def _count_304(url: str):
+    v = STATE.json("validators", HTTP_CACHE_FILE).get(url) or {}
+    _HTTP_STATS["n304"]  += 1
+    _HTTP_STATS["saved"] += v.get("len", 0)
+    METRICS.inc("http_304_saved_bytes_total", v.get("len", 0))
+
+def pop_http_stats() -> tuple[int, int]:
+    """(تعداد 304، بایت صرفه‌جویی‌شده) از آخرین فراخوانی"""
+    n, saved = _HTTP_STATS["n304"], _HTTP_STATS["saved"]
+    _HTTP_STATS["n304"] = _HTTP_STATS["saved"] = 0
+    return n, saved
+
 # ══════════════════════════════════════════════════════════════════════════
 # منابع RSS — Feb 27 2026 — مذاکرات ژنو دور سوم / آستانه جنگ
 # ══════════════════════════════════════════════════════════════════════════
@@ -472,8 +631,100 @@ EMBASSY_OVERRIDE = [
     "تخلیه","فوری ترک","هشدار سفارت","دیپلمات‌ها خارج",
 ]
 
+# ─── نام‌های ایران — برای منطق AND در RSS ──────────────────────────────────
+IRAN_NAME_KW = [
+    "iran","iranian","ایران","تهران","خامنه","پزشکیان","عراقچی",
+    "irgc","tehran","سپاه","نطنز","فردو",
+]
+
+# ─── فیلتر سبک Twitter/Telegram — حداقل یک کلمه مرتبط ─────────────────────
+LOOSE_KW = [
+    "iran","iranian","ایران","irgc","sepah","سپاه","tehran","تهران",
+    "israel","اسراییل","nuclear","هسته","missile","موشک",
+    "trump","ترامپ","netanyahu","نتانیاهو",
+    "war","attack","strike","حمله","جنگ",
+]
+
+# ══════════════════════════════════════════════════════════════════════════
+# matcher کامپایل‌شده — یک بار در import ساخته می‌شود
+# ══════════════════════════════════════════════════════════════════════════
+def _trie_regex(words) -> str:
+    """
+    الگوی regex درختی از کلیدواژه‌ها — پیشوندهای مشترک فقط یک بار بررسی می‌شوند.
+    optional گروه‌ها greedy هستند → در هر موقعیت طولانی‌ترین کلیدواژه match می‌شود.
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def _build(node) -> str:
+        keys = sorted(k for k in node if k)
+        if not keys:
+            return ""
+        alts = [re.escape(k) + _build(node[k]) for k in keys]
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            body = (body if len(alts) > 1 else f"(?:{body})") + "?"
+        return body
+
+    return _build(trie)
+
+class KeywordMatcher:
+    """
+    همه خانواده‌های کلیدواژه در یک regex — یک پاس روی متن، خروجی = خانواده‌های hit.
+
+    lookahead در هر موقعیت طولانی‌ترین کلیدواژه را برمی‌گرداند؛ خانواده‌های
+    کلیدواژه‌هایی که پیشوند آن هستند از قبل به آن اضافه شده‌اند. نتیجه دقیقاً
+    همان `any(k in txt for k in ...)` است (کلیدواژه‌های هم‌پوشان هم حساب می‌شوند).
+    """
+    def __init__(self, families: dict):
+        kw_fams: dict[str, set] = {}
+        for fam, kws in families.items():
+            for k in kws:
+                if k: kw_fams.setdefault(k, set()).add(fam)
+        # پیشوندهای هر کلیدواژه که خودشان کلیدواژه‌اند: [(طول، خانواده‌ها)]
+        self._prefixes = {
+            k: [(i, frozenset(kw_fams[k[:i]])) for i in range(1, len(k) + 1)
+                if k[:i] in kw_fams]
+            for k in kw_fams
+        }
+        self._fams = {k: frozenset().union(*(f for _, f in pre))
+                      for k, pre in self._prefixes.items()}
+        self._re = re.compile("(?=(" + _trie_regex(kw_fams) + "))")
+
+    def families(self, txt: str) -> set:
+        hits: set = set()
+        fams = self._fams
+        for m in self._re.finditer(txt):
+            hits |= fams[m.group(1)]
+        return hits
+
+    def scan(self, txt: str, split: int) -> tuple[set, set]:
+        """
+        یک پاس — (خانواده‌های کل متن، خانواده‌های txt[:split])
+        برای اینکه عنوان و «عنوان + خلاصه» با یک اسکن طبقه‌بندی شوند.
+        """
+        hits: set = set(); head: set = set()
+        fams = self._fams
+        for m in self._re.finditer(txt):
+            kw = m.group(1); f = fams[kw]
+            hits |= f
+            p = m.start()
+            if p + len(kw) <= split:
+                head |= f
+            elif p < split:
+                # کلیدواژه از مرز عنوان رد شده — فقط پیشوندهای داخل عنوان
+                for ln, pf in self._prefixes[kw]:
+                    if p + ln > split: break
+                    head |= pf
+        return hits, head
+
 # ─── فیلتر اصلی با منطق AND برای ایران ────────────────────────────────────
-def is_war_relevant(text: str, is_embassy=False, is_tg=False, is_tw=False) -> bool:
+def is_war_relevant(text: str, is_embassy=False, is_tg=False, is_tw=False,
+                    feats: "ItemFeatures | None" = None) -> bool:
     """
     فیلتر ۲۰۲۶ — آگاه به منبع:
 
@@ -483,57 +734,38 @@ def is_war_relevant(text: str, is_embassy=False, is_tg=False, is_tw=False) -> bo
     RSS = منابع عمومی (شامل اخبار داخلی ایران):
       → فیلتر AND: باید ایران + طرف مقابل/موضوع جنگی باشد
       → اخبار صرفاً داخلی ایران رد می‌شوند
+
+    feats: رکورد classify() اگه قبلاً برای همین متن ساخته شده (اسکن دوباره نمی‌شود)
     """
-    txt = text.lower()
+    # یک پاس روی متن — بقیه فقط روی مجموعه خانواده‌ها کار می‌کند
+    hits = (feats or classify(text)).families
 
     # ── حذف قطعی (همه منابع) ─────────────────────────────────────────────
-    if any(k in txt for k in HARD_EXCLUDE):
+    if "hard" in hits:
         return False
 
     # ── سفارت + هشدار فوری ───────────────────────────────────────────────
-    if is_embassy and any(k in txt for k in EMBASSY_OVERRIDE):
+    if is_embassy and "embassy" in hits:
         return True
 
     # ── Twitter/Telegram: منابع curated — فیلتر سبک ─────────────────────
     # این اکانت‌ها خودشان فقط اخبار جنگ پوست می‌دهند
     # فقط بررسی می‌کنیم که حداقل یک کلمه مرتبط داشته باشد
     if is_tw or is_tg:
-        has_any = (
-            any(k in txt for k in IRAN_MILITARY_KW) or
-            any(k in txt for k in USA_KW) or
-            any(k in txt for k in ISRAEL_KW) or
-            any(k in txt for k in PROXY_KW) or
-            any(k in txt for k in WAR_CONTEXT_KW) or
-            "iran" in txt or "iranian" in txt or "ایران" in txt or
-            "irgc" in txt or "sepah" in txt or "سپاه" in txt or
-            "tehran" in txt or "تهران" in txt or
-            "israel" in txt or "اسراییل" in txt or
-            "nuclear" in txt or "هسته" in txt or
-            "missile" in txt or "موشک" in txt or
-            "trump" in txt or "ترامپ" in txt or
-            "netanyahu" in txt or "نتانیاهو" in txt or
-            "war" in txt or "attack" in txt or "strike" in txt or
-            "حمله" in txt or "جنگ" in txt
-        )
-        return has_any
+        return not hits.isdisjoint(_LOOSE_FAMILIES)
 
     # ── RSS: فیلتر AND — جلوگیری از اخبار کاملاً داخلی ایران ─────────────
-    has_iran_mil  = any(k in txt for k in IRAN_MILITARY_KW)
-    has_iran_name = ("iran" in txt or "iranian" in txt or "ایران" in txt
-                     or "تهران" in txt or "خامنه" in txt or "پزشکیان" in txt
-                     or "عراقچی" in txt or "irgc" in txt or "tehran" in txt
-                     or "سپاه" in txt or "نطنز" in txt or "فردو" in txt)
-    has_usa       = any(k in txt for k in USA_KW)
-    has_israel    = any(k in txt for k in ISRAEL_KW)
-    has_war_ctx   = any(k in txt for k in WAR_CONTEXT_KW)
-    has_proxy     = any(k in txt for k in PROXY_KW)
+    has_iran_name = "iran"    in hits
+    has_usa       = "usa"     in hits
+    has_israel    = "israel"  in hits
+    has_war_ctx   = "war_ctx" in hits
 
     # موضوعات نظامی/هسته‌ای ایران → همیشه pass
-    if has_iran_mil:
+    if "iran_mil" in hits:
         return True
 
     # پروکسی → pass (حوثی/حماس/حزب‌الله)
-    if has_proxy:
+    if "proxy" in hits:
         return True
 
     # ایران + طرف مقابل یا موضوع جنگ → pass
@@ -593,44 +825,188 @@ _nitter_pool: list[str]  = []
 _rsshub_pool: list[str]  = []
 _TW_SEMA: asyncio.Semaphore | None = None
 
-def _load_nitter_cache() -> tuple[list, list, float]:
-    try:
-        if Path(NITTER_CACHE_FILE).exists():
-            d = json.load(open(NITTER_CACHE_FILE))
-            return d.get("nitter", []), d.get("rsshub", []), d.get("ts", 0.0)
-    except: pass
-    return [], [], 0.0
 
-def _save_nitter_cache(nitter, rsshub):
-    json.dump({"nitter": nitter, "rsshub": rsshub,
-               "ts": datetime.now(timezone.utc).timestamp()},
-              open(NITTER_CACHE_FILE, "w"))
+# ── سلامت instance ها: نرخ موفقیت، تأخیر، circuit breaker ────────────────
+class InstanceHealth:
+    """
+    آمار هر instance در nitter_cache.json["health"] (گرم در اجرای بعدی CI):
+      ok     EWMA نرخ موفقیت (۰..۱) — instance تازه با prior خنثی ۰٫۵
+      lat    آخرین HEALTH_LAT_N تأخیر موفق (ms) → p50/p95
+      fails  خطای پشت‌سرهم
+      state  closed | open | half
+      until  پایان cooldown در حالت open
+
+    closed ──(HEALTH_BREAK_FAILS خطا)──► open ──(cooldown)──► half
+    half: ترافیک واقعی نمی‌گیرد؛ probe پس‌زمینه (_probe_instance/_probe_rsshub)
+    موفق → closed، ناموفق → open با cooldown دو برابر (سقف HEALTH_COOLDOWN_MAX)
+    """
+    def __init__(self):
+        self._probing: dict[str, asyncio.Task] = {}
+
+    def _all(self) -> dict:
+        return STATE.json("nitter", NITTER_CACHE_FILE).setdefault("health", {})
+
+    def _get(self, inst: str) -> dict:
+        return self._all().setdefault(inst, {
+            "ok": 0.5, "lat": [], "fails": 0, "n": 0,
+            "state": "closed", "until": 0, "cool": HEALTH_COOLDOWN_SEC})
+
+    def record(self, inst: str, ok: bool, ms: float = 0.0):
+        h = self._get(inst)
+        h["n"] += 1
+        h["ok"] = (1 - HEALTH_ALPHA) * h["ok"] + HEALTH_ALPHA * (1.0 if ok else 0.0)
+        if ok:
+            h["lat"] = (h["lat"] + [round(ms)])[-HEALTH_LAT_N:]
+            h.update(fails=0, state="closed", cool=HEALTH_COOLDOWN_SEC)
+        else:
+            h["fails"] += 1
+            if h["state"] == "half" or h["fails"] >= HEALTH_BREAK_FAILS:
+                self._trip(inst, h)
+        STATE.mark_dirty("nitter")
+
+    def _trip(self, inst: str, h: dict):
+        if h["state"] == "half":
+            h["cool"] = min(h["cool"] * 2, HEALTH_COOLDOWN_MAX)
+        if h["state"] != "open":
+            log.debug(f"⚡ breaker open: {inst.split('//')[-1]} ({h['cool']}s)")
+        h["state"] = "open"
+        h["until"] = datetime.now(timezone.utc).timestamp() + h["cool"]
+
+    def usable(self, inst: str) -> bool:
+        h = self._all().get(inst)
+        return not h or h["state"] == "closed"
+
+    def pct(self, inst: str, q: float) -> float:
+        lat = sorted(self._all().get(inst, {}).get("lat") or [0])
+        return lat[min(len(lat) - 1, int(q * len(lat)))]
+
+    def score(self, inst: str) -> float:
+        """نرخ موفقیت ÷ (۱ + p50 به ثانیه) — سریع و پایدار بالاتر"""
+        h = self._all().get(inst)
+        if not h: return 0.5
+        return max(h["ok"], 0.01) / (1 + self.pct(inst, .5) / 1000)
+
+    def ranked(self, insts: list) -> list:
+        """
+        فقط breaker بسته؛ ترتیب تصادفی وزن‌دار با score (Efraimidis–Spirakis)
+        — بهترین معمولاً اول، ولی بار روی یک mirror متمرکز نمی‌شود.
+        اگه همه open باشند، لیست کامل (بهتر از هیچ).
+        """
+        live = [i for i in insts if self.usable(i)] or list(insts)
+        return sorted(live, key=lambda i: -random.random() ** (1 / self.score(i)))
+
+    def probe_due(self, client: httpx.AsyncClient):
+        """breaker هایی که cooldown شان تمام شده → half + probe پس‌زمینه"""
+        now = datetime.now(timezone.utc).timestamp()
+        for inst, h in self._all().items():
+            # half بدون probe در جریان = probe اجرای قبلی نیمه‌کاره ماند
+            if inst in self._probing: continue
+            if (h["state"] == "open" and h["until"] <= now) or h["state"] == "half":
+                h["state"] = "half"
+                t = asyncio.create_task(self._probe(client, inst))
+                self._probing[inst] = t
+                t.add_done_callback(lambda _t, i=inst: self._probing.pop(i, None))
+
+    async def _probe(self, client: httpx.AsyncClient, inst: str):
+        is_rsshub = inst in RSSHUB_INSTANCES
+        res = await (_probe_rsshub(client, inst) if is_rsshub
+                     else _probe_instance(client, inst))
+        self.record(inst, bool(res), res[1] if res else 0.0)
+        log.debug(f"⚡ probe {inst.split('//')[-1]}: {'✅' if res else '❌'}")
+
+    def prune(self, insts: list):
+        """
+        instance هایی که دیگر در pool نیستند از nitter_cache.json حذف شوند (وگرنه
+        probe_due تا ابد probe شان می‌کند) — کلیدهای فرمت قدیم فایل هم.
+        """
+        d, keep = STATE.json("nitter", NITTER_CACHE_FILE), set(insts)
+        stale = [k for k in d if k not in ("health", "batch")]
+        for k in stale: del d[k]
+        for tbl in ("health", "batch"):
+            t = d.get(tbl, {})
+            gone = [i for i in t if i not in keep]
+            for i in gone: del t[i]
+            stale += gone
+        if stale:
+            log.debug(f"⚡ nitter_cache: {len(stale)} کلید کهنه حذف شد")
+            STATE.mark_dirty("nitter")
+
+    def summary(self) -> str:
+        hs = self._all()
+        n_open = sum(h["state"] != "closed" for h in hs.values())
+        best = sorted(hs, key=self.score, reverse=True)[:3]
+        tops = "  ".join(f"{i.split('//')[-1]}(ok={hs[i]['ok']:.2f} p50={self.pct(i, .5):.0f}"
+                         f" p95={self.pct(i, .95):.0f}ms)" for i in best)
+        return f"breaker open:{n_open}/{len(hs)}  {tops}"
+
+HEALTH = InstanceHealth()
+
+def _parse_feed(body: str) -> list:
+    """feedparser — سطح ماژول تا در process pool اجرا شود"""
+    return feedparser.parse(body).entries or []
+
+def _parse_titled(body: str) -> list:
+    return [e for e in _parse_feed(body) if len((e.get("title") or "").strip()) > 3]
+
+# صفحه «این حساب نیست/معلق/خصوصی» Nitter/RSSHub — instance سالم است، handle مشکل دارد
+# (صفحه 404 عمومی nginx/CDN عمداً match نمی‌شود — آن خرابی instance است)
+_HANDLE_MISSING = re.compile(
+    r"user\W.{0,60}not found|not found.{0,20}\buser|does ?n[o']t exist|no such user"
+    r"|account (?:is |has been )?suspended|tweets are protected", re.I | re.S)
+_MISSING_LOGGED: set = set()
+
+def _handle_missing(url: str, inst: str, body: str) -> bool:
+    if not _HANDLE_MISSING.search(body[:4000]):
+        return False
+    parts  = urlparse(url).path.strip("/").split("/")
+    handle = parts[2] if parts[0] in ("twitter", "x") and len(parts) > 2 else parts[0]
+    METRICS.inc("tw_handle_missing_total")
+    if handle.lower() not in _MISSING_LOGGED:
+        _MISSING_LOGGED.add(handle.lower())
+        log.info(f"𝕏 {handle}: حساب پیدا نشد ({inst.split('//')[-1]}) — خطای instance حساب نشد")
+    return True
 
 def _is_rss(body: str, ct: str) -> bool:
     b = body[:600].lower()
     return ("xml" in ct) or ("<rss" in b) or ("<?xml" in b) or ("<feed" in b)
 
-async def _try_rss(client: httpx.AsyncClient, url: str, timeout: float = TW_TIMEOUT) -> list:
+async def _try_rss(client: httpx.AsyncClient, url: str, timeout: float = TW_TIMEOUT,
+                   inst: str = "", record=None) -> list | None:
     """
     RSS URL را fetch کرده entries برمی‌گرداند.
     follow_redirects=True مهم است (xcancel.com → rss.xcancel.com)
+    None = 304 (instance سالم است ولی از دفعه قبل چیز جدیدی نیست)
+    inst: اگه داده شود نتیجه با record(inst, ok, ms) ثبت می‌شود — پیش‌فرض HEALTH.record
+          (RSS معتبر = موفق، حتی خالی)
     """
+    t0 = asyncio.get_running_loop().time()
+    def _health(ok: bool):
+        if inst: (record or HEALTH.record)(inst, ok, (asyncio.get_running_loop().time() - t0) * 1000)
     try:
         r = await client.get(url,
-                             headers=NITTER_HDR,
+                             headers={**NITTER_HDR, **_cond_headers(url)},
                              follow_redirects=True,
                              timeout=httpx.Timeout(connect=5.0, read=timeout,
                                                    write=5.0, pool=5.0))
-        if r.status_code not in (200, 304):
+        if r.status_code == 304:
+            _count_304(url); _health(True)
+            return None
+        if r.status_code not in (200, 404):
+            _health(False)
             return []
         ct = r.headers.get("content-type", "")
         body = r.text or ""
-        if not _is_rss(body, ct):
+        if r.status_code == 404 or not _is_rss(body, ct):
+            # handle ناموجود: نه موفق نه خطا برای instance — یک handle مرده breaker
+            # mirror سالم را باز نکند؛ race به candidate بعدی می‌رود
+            if not _handle_missing(url, inst, body):
+                _health(False)
             return []
-        parsed = feedparser.parse(body)
-        entries = getattr(parsed, "entries", []) or []
-        return [e for e in entries if len((e.get("title") or "").strip()) > 3]
+        _health(True)
+        _remember_validators(url, r)
+        return await run_cpu(_parse_titled, body, kind="proc")
     except Exception:
+        _health(False)
         return []
 
 async def _probe_instance(client: httpx.AsyncClient, url: str,
@@ -675,94 +1051,666 @@ async def _probe_rsshub(client: httpx.AsyncClient, inst: str) -> tuple | None:
 
 async def build_twitter_pools(client: httpx.AsyncClient):
     """
-    در این نسخه: probe حذف شد.
-    همه fetch_twitter مستقیم RSSHub → Nitter را امتحان می‌کنند.
-    فقط cache را می‌خوانیم که آخرین instance موفق را بیاد داشته باشد.
+    pool ها = همه instance ها؛ ترتیب هر درخواست با HEALTH.ranked
+    (آمار سلامت از nitter_cache.json — اجرای تازه CI با رتبه‌بندی گرم شروع می‌کند).
+    هر چرخه breaker های منقضی‌شده در پس‌زمینه probe می‌شوند.
     """
     global _nitter_pool, _rsshub_pool
-    cached_n, cached_r, ts = _load_nitter_cache()
-    age = datetime.now(timezone.utc).timestamp() - ts
-    # اگه cache جدید است: آخرین instance موفق را اول بگذار
-    if age < NITTER_CACHE_TTL:
-        if cached_r: _rsshub_pool = cached_r + [i for i in RSSHUB_INSTANCES if i not in cached_r]
-        if cached_n: _nitter_pool = cached_n + [i for i in NITTER_INSTANCES if i not in cached_n]
     if not _rsshub_pool: _rsshub_pool = list(RSSHUB_INSTANCES)
     if not _nitter_pool: _nitter_pool = list(NITTER_INSTANCES)
-    log.info(f"𝕏 pools: RSSHub={len(_rsshub_pool)} Nitter={len(_nitter_pool)}")
+    HEALTH.prune(_rsshub_pool + _nitter_pool)
+    HEALTH.probe_due(client)
+    log.info(f"𝕏 pools: RSSHub={len(_rsshub_pool)} Nitter={len(_nitter_pool)}"
+             f"  {HEALTH.summary()}")
+
+# ── hedged request: چند instance با فاصله کوتاه، اولین RSS معتبر برنده ──────
+# TW_HEDGE_N=1 → همان fallback ترتیبی قدیمی
+_INST_SEMA: dict[str, asyncio.Semaphore] = {}
+_TW_STATS = {"req": 0}   # درخواست‌های فاز X در این چرخه
+
+def _inst_sema(inst: str) -> asyncio.Semaphore:
+    """بودجه همزمانی هر instance — mirror ها زیر بار hedge له نشوند"""
+    if inst not in _INST_SEMA:
+        _INST_SEMA[inst] = asyncio.Semaphore(TW_INST_CONC)
+    return _INST_SEMA[inst]
+
+def _tw_candidates(handle: str) -> list:
+    """(url, inst, is_rsshub, timeout) به ترتیب اولویت pool ها"""
+    cands = [(f"{inst}{path}", inst, True, 8.0)
+             for inst in HEALTH.ranked(_rsshub_pool or RSSHUB_INSTANCES)
+             for path in (f"/twitter/user/{handle}", f"/x/user/{handle}")]
+    cands += [(f"{inst}/{handle}/rss", inst, False, 6.0)
+              for inst in HEALTH.ranked(_nitter_pool or NITTER_INSTANCES)]
+    return cands
+
+async def _race_rss(client: httpx.AsyncClient, cands: list,
+                    hedge_n: int | None = None, stagger: float | None = None,
+                    record=None) -> tuple:
+    """
+    candidate بعدی بعد از `stagger` ثانیه (یا فوراً اگه قبلی fail شد) شروع می‌شود،
+    حداکثر hedge_n همزمان. اولین پاسخ معتبر (entries یا 304) برنده، بقیه cancel.
+    record: ثبت نتیجه هر تلاش به جای HEALTH.record (route غیرعادی مثل search —
+    شکستش به معنی خرابی instance نیست)
+    برمی‌گرداند: (candidate برنده | None، entries | None)
+    """
+    hedge_n = max(1, hedge_n or TW_HEDGE_N)
+    stagger = TW_HEDGE_STAGGER if stagger is None else stagger
+
+    # وضعیت breaker ها هنگام ساخت مسابقه — اگه ranked() همه open را برگرداند
+    # (fallback «بهتر از هیچ»)، نباید همه بی‌درخواست رد شوند
+    was_usable = {c[1]: HEALTH.usable(c[1]) for c in cands}
+
+    async def _attempt(c):
+        async with _inst_sema(c[1]):
+            if was_usable[c[1]] and not HEALTH.usable(c[1]):  # breaker وسط همین مسابقه باز شد
+                return []
+            _TW_STATS["req"] += 1
+            return await _try_rss(client, c[0], timeout=c[3], inst=c[1], record=record)
+
+    queue   = iter(cands)
+    pending = {}
+    def _launch() -> bool:
+        c = next(queue, None)
+        if c is None: return False
+        pending[asyncio.ensure_future(_attempt(c))] = c
+        return True
+
+    more = _launch()
+    try:
+        while pending:
+            wait = stagger if more and len(pending) < hedge_n else None
+            done, _ = await asyncio.wait(pending, timeout=wait,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:                 # stagger گذشت → hedge
+                more = _launch(); continue
+            for t in done:
+                c = pending.pop(t)
+                if t.result() is None or t.result():
+                    return c, t.result()
+            while more and len(pending) < hedge_n:
+                more = _launch()
+        return None, []
+    finally:
+        for t in pending: t.cancel()
 
 async def fetch_twitter(client: httpx.AsyncClient, label: str, handle: str) -> list:
     """
     دریافت توییت‌ها:
     1. RSSHub (پایدارتر در GitHub Actions CI)
     2. Nitter instances
-    اولین نتیجه موفق ذخیره می‌شود تا دفعه بعد اول امتحان شود.
+    candidate ها با _race_rss همزمان (hedge) امتحان می‌شوند؛ instance برنده
+    ذخیره می‌شود تا دفعه بعد اول امتحان شود.
     """
     sema = _TW_SEMA or asyncio.Semaphore(15)
     async with sema:
-        # ── RSSHub اول (در CI بهتر کار می‌کند) ─────────────────────────
-        for inst in (_rsshub_pool or RSSHUB_INSTANCES):
-            for path in (f"/twitter/user/{handle}", f"/x/user/{handle}"):
-                e = await _try_rss(client, f"{inst}{path}", timeout=8.0)
-                if e:
-                    log.debug(f"𝕏 {handle} ← RSSHub {inst.split('//')[-1]} ({len(e)})")
-                    # این instance را به اول cache بفرست
-                    _update_pool_cache(inst, is_rsshub=True)
-                    return [(x, f"𝕏 {label}", "tw", False) for x in e]
-
-        # ── Nitter ──────────────────────────────────────────────────────
-        for inst in (_nitter_pool or NITTER_INSTANCES):
-            e = await _try_rss(client, f"{inst}/{handle}/rss", timeout=6.0)
-            if e:
-                log.debug(f"𝕏 {handle} ← Nitter {inst.split('//')[-1]} ({len(e)})")
-                _update_pool_cache(inst, is_rsshub=False)
-                return [(x, f"𝕏 {label}", "tw", False) for x in e]
-
-    log.debug(f"𝕏 {handle}: همه fail")
-    return []
-
-def _update_pool_cache(working_inst: str, is_rsshub: bool):
-    """instance موفق را به اول لیست cache می‌برد"""
-    global _nitter_pool, _rsshub_pool
-    if is_rsshub:
-        pool = [working_inst] + [i for i in _rsshub_pool if i != working_inst]
-        _rsshub_pool = pool
-        json.dump({"nitter": _nitter_pool, "rsshub": pool,
-                   "ts": datetime.now(timezone.utc).timestamp()},
-                  open(NITTER_CACHE_FILE, "w"))
-    else:
-        pool = [working_inst] + [i for i in _nitter_pool if i != working_inst]
-        _nitter_pool = pool
-        json.dump({"nitter": pool, "rsshub": _rsshub_pool,
-                   "ts": datetime.now(timezone.utc).timestamp()},
-                  open(NITTER_CACHE_FILE, "w"))
+        # RSSHub اول (در CI بهتر کار می‌کند)، سپس Nitter — با hedge موازی
+        cand, e = await _race_rss(client, _tw_candidates(handle))
+
+    if cand is None:
+        log.debug(f"𝕏 {handle}: همه fail")
+        SCHED.record(_tw_key(handle), "fail")
+        return []
+    if e is None:  # 304 — چیز جدیدی نیست
+        SCHED.record(_tw_key(handle), "304")
+        return []
+    _, inst, is_rsshub, _ = cand
+    log.debug(f"𝕏 {handle} ← {'RSSHub' if is_rsshub else 'Nitter'}"
+              f" {inst.split('//')[-1]} ({len(e)})")
+    SCHED.record(_tw_key(handle), "ok", make_id(e[0]))
+    return [(x, f"𝕏 {label}", "tw", False) for x in e]
+
+
+# ── حالت batch: چند handle در یک درخواست Nitter search RSS ────────────────
+# /search/rss?f=tweets&q=from:a OR from:b … — خروجی ترکیبی با dc:creator/لینک
+# به handle ها برگردانده می‌شود. RSSHub route چندکاربره عمومی ندارد → فقط Nitter.
+# mirror ی که search RSS نمی‌دهد TW_BATCH_RETRY_H ساعت از batch کنار می‌رود.
+
+def _batch_ok(inst: str) -> bool:
+    b = STATE.json("nitter", NITTER_CACHE_FILE).get("batch", {}).get(inst)
+    return not b or b["fails"] < 2 or \
+        datetime.now(timezone.utc).timestamp() - b["ts"] > TW_BATCH_RETRY_H * 3600
+
+def _batch_mark(inst: str, ok: bool, ms: float = 0.0):
+    b = STATE.json("nitter", NITTER_CACHE_FILE).setdefault("batch", {}) \
+        .setdefault(inst, {"fails": 0, "ts": 0})
+    b["fails"] = 0 if ok else b["fails"] + 1
+    b["ts"] = datetime.now(timezone.utc).timestamp()
+    STATE.mark_dirty("nitter")
+
+def _entry_handle(e) -> str:
+    """handle نویسنده entry در search RSS — dc:creator (@x) یا اولین بخش مسیر لینک"""
+    a = (e.get("author") or "").strip().lstrip("@")
+    if a and " " not in a:
+        return a.lower()
+    path = (e.get("link") or "").split("//", 1)[-1].split("/")
+    return path[1].lower() if len(path) > 1 else ""
+
+async def fetch_twitter_batch(client: httpx.AsyncClient, group: list) -> list:
+    """
+    group: [(label, handle), ...] — یک درخواست search برای همه.
+    handle هایی که batch پوشش نداد (شکست، یا صفحه پر و بی‌خبر از آن handle)
+    جداگانه با fetch_twitter گرفته می‌شوند.
+    """
+    by_handle = {h.lower(): (l, h) for l, h in group}
+    q = " OR ".join(f"from:{h}" for _, h in group)
+    cands = [(f"{inst}/search/rss?f=tweets&q={quote(q)}", inst, False, 10.0)
+             for inst in HEALTH.ranked(_nitter_pool or NITTER_INSTANCES)
+             if _batch_ok(inst)]
+
+    sema = _TW_SEMA or asyncio.Semaphore(15)
+    async with sema:
+        cand, e = await _race_rss(client, cands, record=_batch_mark) if cands else (None, [])
+
+    out, got, rest = [], set(), []
+    if cand and e is None:          # 304 — هیچ‌کدام از اعضا خبر جدید ندارد
+        for _, h in group: SCHED.record(_tw_key(h), "304")
+        return []
+    for x in e or []:
+        h = _entry_handle(x)
+        if h in by_handle:
+            got.add(h)
+            out.append((x, f"𝕏 {by_handle[h][0]}", "tw", False))
+    full = len(e or []) >= TW_BATCH_PAGE
+    for hl, (l, h) in by_handle.items():
+        if hl in got:
+            top = next(x for x, *_ in out if _entry_handle(x) == hl)
+            SCHED.record(_tw_key(h), "ok", make_id(top))
+        elif cand and not full:     # search کامل بود — این handle فقط خبر تازه ندارد
+            SCHED.record(_tw_key(h), "ok")
+        else:
+            rest.append((l, h))
+
+    if rest:
+        log.debug(f"𝕏 batch: {len(rest)}/{len(group)} handle → تکی")
+        for res in await asyncio.gather(*[fetch_twitter(client, l, h) for l, h in rest]):
+            out.extend(res)
+    return out
+
+# ══════════════════════════════════════════════════════════════════════════
+# metrics — histogram/counter ساده؛ خروجی Prometheus text یا snapshot JSON
+# ══════════════════════════════════════════════════════════════════════════
+# METRICS_PORT=9108 → http://127.0.0.1:9108/metrics (و /metrics.json)
+# METRICS_JSON=metrics.json → snapshot در پایان هر چرخه
+_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+    def __init__(self):
+        self.help:  dict[str, str] = {}
+        self.hists: dict[str, dict] = {}   # name → {labels: [bucket counts…, sum, count]}
+        self.ctrs:  dict[str, dict] = {}   # name → {labels: value}
+
+    @staticmethod
+    def _key(labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        h = self.hists.setdefault(name, {}).setdefault(
+            self._key(labels), [0] * len(_BUCKETS) + [0.0, 0])
+        for i, b in enumerate(_BUCKETS):
+            if value <= b: h[i] += 1
+        h[-2] += value; h[-1] += 1
+
+    def inc(self, name: str, n: float = 1, **labels):
+        c = self.ctrs.setdefault(name, {})
+        k = self._key(labels)
+        c[k] = c.get(k, 0) + n
+
+    def timer(self, name: str, **labels):
+        """with METRICS.timer("x", stage="y"): … — زمان بلوک در histogram"""
+        return _MetricTimer(self, name, labels)
+
+    @staticmethod
+    def _quantile(h: list, q: float) -> float:
+        """کران بالای bucket ی که q در آن می‌افتد (تقریبی — مثل histogram_quantile)"""
+        rank = q * h[-1]
+        for i, b in enumerate(_BUCKETS):
+            if h[i] >= rank: return b
+        return float("inf")
+
+    def render_prom(self) -> str:
+        def lbl(k, extra=()):
+            kv = [f'{a}="{str(v)}"'.replace("\n", " ") for a, v in (*k, *extra)]
+            return "{" + ",".join(kv) + "}" if kv else ""
+        out = []
+        for name, series in sorted(self.hists.items()):
+            out += [f"# HELP warbot_{name} {self.help.get(name, name)}",
+                    f"# TYPE warbot_{name} histogram"]
+            for k, h in series.items():
+                out += [f"warbot_{name}_bucket{lbl(k, [('le', b)])} {h[i]}"
+                        for i, b in enumerate(_BUCKETS)]
+                out += [f"warbot_{name}_bucket{lbl(k, [('le', '+Inf')])} {h[-1]}",
+                        f"warbot_{name}_sum{lbl(k)} {h[-2]:.6f}",
+                        f"warbot_{name}_count{lbl(k)} {h[-1]}"]
+        for name, series in sorted(self.ctrs.items()):
+            out += [f"# HELP warbot_{name} {self.help.get(name, name)}",
+                    f"# TYPE warbot_{name} counter"]
+            out += [f"warbot_{name}{lbl(k)} {v}" for k, v in series.items()]
+        return "\n".join(out) + "\n"
+
+    def snapshot(self) -> dict:
+        lk = lambda k: ",".join(f"{a}={v}" for a, v in k) or "_"
+        return {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "histograms": {name: {lk(k): {"count": h[-1], "sum": round(h[-2], 4),
+                                          "p50": self._quantile(h, .5),
+                                          "p95": self._quantile(h, .95),
+                                          "p99": self._quantile(h, .99)}
+                                  for k, h in series.items()}
+                           for name, series in self.hists.items()},
+            "counters": {name: {lk(k): v for k, v in series.items()}
+                         for name, series in self.ctrs.items()},
+        }
+
+    def write_json(self, path: str):
+        try:
+            _atomic_write(path, json.dumps(self.snapshot(), ensure_ascii=False,
+                                           indent=1).encode())
+        except Exception as e:
+            log.debug(f"metrics json: {e}")
+
+class _MetricTimer:
+    __slots__ = ("m", "name", "labels", "t0")
+    def __init__(self, m, name, labels):
+        self.m, self.name, self.labels = m, name, labels
+    def __enter__(self):
+        self.t0 = time.perf_counter(); return self
+    def __exit__(self, *exc):
+        self.m.observe(self.name, time.perf_counter() - self.t0, **self.labels)
+
+METRICS = Metrics()
+METRICS.help.update({
+    "fetch_seconds":        "fetch یک منبع (شامل parse)",
+    "cpu_task_seconds":     "کار CPU-bound (parse/تصویر) به تفکیک تابع",
+    "stage_seconds":        "زمان هر مرحله pipeline در یک چرخه",
+    "filter_seconds":       "فیلتر/dedup نتیجه یک منبع",
+    "translate_seconds":    "ترجمه یک batch به تفکیک provider",
+    "gemini_call_seconds":  "یک درخواست chunk به Gemini به تفکیک مدل/کد",
+    "tg_send_seconds":      "ارسال به Telegram Bot API (text/photo/photo_id)",
+    "tg_429_total":         "پاسخ 429 از Telegram (مکث صف ارسال)",
+    "tg_upload_saved_bytes_total": "بایت عکس آپلودنشده (ارسال با file_id)",
+    "img_prefetch_total":   "تصویر prefetch شده هنگام ارسال (ready=آماده بود)",
+    "img_cache_total":      "cache تصویر به تفکیک page/img و hit/miss",
+    "img_cache_saved_bytes_total": "بایت HTML/تصویر دانلودنشده به لطف cache تصویر",
+    "tw_handle_missing_total": "پاسخ «حساب X پیدا نشد» از Nitter/RSSHub (خطای instance حساب نمی‌شود)",
+    "img_download_bytes_total": "بایت تصویر خوانده‌شده (probe-reject=رد از روی header، full=دانلود کامل)",
+    "item_latency_seconds": "fetch → ارسال هر خبر",
+    "loop_lag_seconds":     "تأخیر بیدار شدن event loop",
+    "cycle_seconds":        "کل چرخه",
+    "items_total":          "آیتم‌ها به تفکیک نتیجه (raw/old/dup/…/queued/sent)",
+    "http_bytes_total":     "بایت دریافتی (روی سیم)",
+    "http_responses_total": "پاسخ HTTP به تفکیک کد",
+    "http_304_saved_bytes_total": "بایت دانلودنشده به لطف 304",
+    "tr_cache_total":       "جستجوی cache ترجمه (hit/miss)",
+    "tr_tokens_saved_total": "token تخمینی Gemini صرفه‌جویی‌شده با cache",
+})
+
+def _meter(resp: httpx.Response, host: str):
+    METRICS.inc("http_responses_total", code=resp.status_code)
+    resp.stream = _CountingStream(resp.stream, host)
+
+async def meter_response(resp: httpx.Response):
+    """
+    event hook پاسخ (AsyncClient(event_hooks={"response": [meter_response]})) —
+    transport پیش‌فرض client دست نمی‌خورد، پس proxy محیط (HTTP(S)_PROXY/trust_env) می‌ماند.
+    """
+    _meter(resp, resp.request.url.host)
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """transport ی که بایت دریافتی و کد پاسخ هر host را می‌شمارد (replay.py — transport جعلی)"""
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        resp = await self.inner.handle_async_request(request)
+        _meter(resp, request.url.host)
+        return resp
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+class _CountingStream(httpx.AsyncByteStream):
+    def __init__(self, inner, host: str):
+        self.inner, self.host = inner, host
+
+    async def __aiter__(self):
+        async for chunk in self.inner:
+            METRICS.inc("http_bytes_total", len(chunk), host=self.host)
+            yield chunk
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+async def serve_metrics(port: int):
+    """endpoint محلی: GET /metrics (Prometheus text) و /metrics.json"""
+    async def handle(reader, writer):
+        try:
+            line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            path = line[1] if len(line) > 1 else "/"
+            if path.startswith("/metrics.json"):
+                body, ct = json.dumps(METRICS.snapshot(), ensure_ascii=False).encode(), "application/json"
+            elif path.startswith("/metrics"):
+                body, ct = METRICS.render_prom().encode(), "text/plain; version=0.0.4"
+            else:
+                body, ct = b"not found", "text/plain"
+            status = "200 OK" if body != b"not found" else "404 Not Found"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ct}; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception as e:
+            log.debug(f"metrics http: {e}")
+        finally:
+            writer.close()
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    log.info(f"📈 metrics: http://127.0.0.1:{port}/metrics")
+    return server
+
+# ══════════════════════════════════════════════════════════════════════════
+# کار CPU-bound خارج از event loop + اندازه‌گیری lag
+# ══════════════════════════════════════════════════════════════════════════
+# thread pool : Pillow / lxml — GIL را حین کار C آزاد می‌کنند
+# process pool: feedparser / BeautifulSoup — پایتون خالص، thread کمکی نمی‌کند
+# CPU_THREADS=0 → همه inline روی loop (رفتار قدیمی — برای مقایسه lag)
+# CPU_PROCS=0   → کارهای process هم در thread pool
+_POOLS: dict = {}
+
+def _pool(kind: str):
+    if kind not in _POOLS:
+        if kind == "proc":
+            # spawn: fork در پروسه چند-thread ی امن نیست
+            _POOLS[kind] = ProcessPoolExecutor(
+                CPU_PROCS, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            _POOLS[kind] = ThreadPoolExecutor(CPU_THREADS, thread_name_prefix="cpu")
+    return _POOLS[kind]
+
+async def run_cpu(fn, *args, kind: str = "thread"):
+    """fn(*args) در pool مناسب — fn برای kind=proc باید سطح ماژول و pickle‌پذیر باشد"""
+    if not CPU_THREADS:
+        kind = "inline"
+    elif kind == "proc" and not CPU_PROCS:
+        kind = "thread"
+    with METRICS.timer("cpu_task_seconds", fn=fn.__name__, pool=kind):
+        if kind == "inline":
+            return fn(*args)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_pool(kind), fn, *args)
+        except BrokenExecutor as e:   # worker مرده (OOM…) → pool بعدی تازه ساخته شود
+            log.warning(f"⚙️ {kind} pool خراب: {e} — این بار inline")
+            _POOLS.pop(kind, None)
+            return fn(*args)
+
+def shutdown_pools():
+    for p in _POOLS.values():
+        p.shutdown(wait=False, cancel_futures=True)
+    _POOLS.clear()
+
+class LoopLagMonitor:
+    """
+    هر LAG_TICK_SEC یک sleep کوتاه؛ دیر بیدار شدن = مدتی که loop درگیر کار sync بود
+    (همه درخواست‌های HTTP و ارسال‌ها همان مدت منتظر ماندند).
+    report() → (p50, p99, max) به ms از آخرین report
+    """
+    def __init__(self, tick: float = LAG_TICK_SEC):
+        self.tick    = tick
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel(); self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.tick)
+            lag = max(0.0, loop.time() - t0 - self.tick)
+            self.samples.append(lag * 1000)
+            METRICS.observe("loop_lag_seconds", lag)
+            if len(self.samples) > 20_000:
+                del self.samples[:10_000]
+
+    def report(self) -> tuple[float, float, float]:
+        xs, self.samples = self.samples, []
+        if not xs: return 0.0, 0.0, 0.0
+        return _pct(xs, .5), _pct(xs, .99), max(xs)
+
+LAG = LoopLagMonitor()
+
+# ══════════════════════════════════════════════════════════════════════════
+# زمان‌بندی تطبیقی هر منبع — منبع پرکار هر چرخه، منبع ساکت/خراب با backoff
+# ══════════════════════════════════════════════════════════════════════════
+class SourceScheduler:
+    """
+    آمار هر منبع (کلید: rss:<url> / tg:<handle> / tw:<handle>) در sched_state.json:
+      gap         EWMA فاصله بین دو تغییر (آیتم جدید) — نرخ انتشار مشاهده‌شده
+      last_change آخرین باری که آیتم جدید داشت
+      n304        تعداد 304 (RSS) — polls/changes/fails برای گزارش
+      next        deadline poll بعدی
+      last_ok     آخرین poll موفق (ok/304) — مبنای cutoff منبع (cutoff())
+
+    بازه poll = SCHED_GAP_FRAC × max(gap، مدت سکوت) محدود به [SCHED_MIN_SEC، سقف نوع منبع]
+    خطای پشت‌سرهم → backoff نمایی. منبع تازه (بدون آمار) هر چرخه poll می‌شود.
+    """
+    def _all(self) -> dict:
+        return STATE.json("sched", SCHED_STATE_FILE)
+
+    def _stats(self, key: str) -> dict:
+        return self._all().setdefault(key, {
+            "next": 0, "since": datetime.now(timezone.utc).timestamp(),
+            "last_change": 0, "gap": 0, "top": "",
+            "polls": 0, "changes": 0, "n304": 0, "fails": 0,
+        })
+
+    def due(self, key: str, now: float | None = None) -> bool:
+        st = self._all().get(key)
+        return not st or st.get("next", 0) <= (now or datetime.now(timezone.utc).timestamp())
+
+    def record(self, key: str, outcome: str, top: str = ""):
+        """outcome: ok (با top = شناسه جدیدترین آیتم) / 304 / fail"""
+        now = datetime.now(timezone.utc).timestamp()
+        st  = self._stats(key)
+        st["polls"] += 1
+        if outcome == "fail":
+            st["fails"] += 1
+        else:
+            st["fails"] = 0
+            st["last_ok"] = now
+            if outcome == "304":
+                st["n304"] += 1
+            elif top and top != st["top"]:
+                if st["top"] and st["last_change"]:
+                    gap = now - st["last_change"]
+                    st["gap"] = gap if not st["gap"] else 0.7 * st["gap"] + 0.3 * gap
+                st["top"] = top; st["last_change"] = now; st["changes"] += 1
+
+        hi = SCHED_MAX_SEC.get(key.split(":", 1)[0], 900)
+        if st["fails"]:
+            interval = SCHED_MIN_SEC * 2 ** min(st["fails"], 6)
+        else:
+            quiet = now - (st["last_change"] or st["since"])
+            interval = SCHED_GAP_FRAC * max(st["gap"], quiet)
+        interval = min(max(interval, SCHED_MIN_SEC), hi)
+        # jitter کوچک تا poll ها همه با هم در یک چرخه جمع نشوند
+        st["next"] = now + interval * random.uniform(0.9, 1.0) - 1
+        STATE.mark_dirty("sched")
+
+    def cutoff(self, key: str, cutoff: datetime) -> datetime:
+        """
+        cutoff این منبع: منبعی که چند چرخه رد شده (یا خطا داشته) از آخرین poll
+        موفقش - CUTOFF_BUFFER_MIN نگاه می‌کند، نه از شروع چرخه قبل — وگرنه خبرهای
+        بین دو poll «قدیمی» حساب و بی‌صدا حذف می‌شوند. کف: MAX_LOOKBACK_MIN.
+        """
+        last = self._all().get(key, {}).get("last_ok", 0)
+        if not last:
+            return cutoff
+        since = datetime.fromtimestamp(last, timezone.utc) - timedelta(minutes=CUTOFF_BUFFER_MIN)
+        floor = datetime.now(timezone.utc) - timedelta(minutes=MAX_LOOKBACK_MIN)
+        return min(cutoff, max(since, floor))
+
+    def top(self, key: str) -> str:
+        """شناسه جدیدترین آیتم دیده‌شده منبع ('' اگه هنوز نه)"""
+        return self._all().get(key, {}).get("top", "")
+
+    def split(self, keyed: list) -> tuple[list, int]:
+        """(آیتم‌های due، تعداد skip‌شده) — keyed: [(key, item), ...]"""
+        now = datetime.now(timezone.utc).timestamp()
+        due = [it for k, it in keyed if self.due(k, now)]
+        return due, len(keyed) - len(due)
+
+    def polls_per_hour(self) -> float:
+        """تخمین درخواست در ساعت با deadline های فعلی (برای مقایسه با poll ثابت)"""
+        now = datetime.now(timezone.utc).timestamp()
+        total = 0.0
+        for st in self._all().values():
+            total += 3600 / max(st.get("next", 0) - now, SCHED_MIN_SEC)
+        return total
+
+SCHED = SourceScheduler()
+
+def _rss_key(feed): return f"rss:{feed['u']}"
+def _tg_key(handle): return f"tg:{handle.lower()}"
+def _tw_key(handle): return f"tw:{handle.lower()}"
 
 # ══════════════════════════════════════════════════════════════════════════
 # RSS + Telegram fetch
 # ══════════════════════════════════════════════════════════════════════════
 async def fetch_rss(client: httpx.AsyncClient, feed: dict) -> list:
-    """RSS با conditional GET (ETag/If-Modified-Since)"""
+    """RSS با conditional GET (ETag/If-Modified-Since — از http_cache.json)"""
     try:
         hdrs = dict(COMMON_UA)
         hdrs["Accept"] = "application/rss+xml,application/xml,text/xml;q=0.9,*/*;q=0.8"
-        if feed.get("_etag"):      hdrs["If-None-Match"]     = feed["_etag"]
-        if feed.get("_last_mod"):  hdrs["If-Modified-Since"] = feed["_last_mod"]
+        hdrs.update(_cond_headers(feed["u"]))
         r = await client.get(feed["u"], timeout=httpx.Timeout(RSS_TIMEOUT), headers=hdrs)
-        if r.status_code == 304: return []
-        if r.status_code != 200: return []
-        if r.headers.get("ETag"):          feed["_etag"]     = r.headers["ETag"]
-        if r.headers.get("Last-Modified"): feed["_last_mod"] = r.headers["Last-Modified"]
-        entries = feedparser.parse(r.text).entries or []
+        if r.status_code == 304:
+            _count_304(feed["u"])
+            SCHED.record(_rss_key(feed), "304"); return []
+        if r.status_code != 200:
+            SCHED.record(_rss_key(feed), "fail"); return []
+        _remember_validators(feed["u"], r)
+        entries = await run_cpu(_parse_feed, r.text, kind="proc")
+        SCHED.record(_rss_key(feed), "ok", make_id(entries[0]) if entries else "")
         is_emb  = id(feed) in EMBASSY_SET
         return [(e, feed["n"], "rss", is_emb) for e in entries]
-    except: return []
+    except:
+        SCHED.record(_rss_key(feed), "fail"); return []
+
+# ── استخراج پیام از صفحه t.me/s با lxml (XPath کامپایل‌شده) ──────────────
+# فقط فیلدهای لازم؛ از آخر صفحه به عقب تا رسیدن به آخرین پیام دیده‌شده.
+def _cls(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+_TG_WRAPS = lxml_etree.XPath(f"//div[{_cls('tgme_widget_message_wrap')}]")
+_TG_MSGS  = lxml_etree.XPath(f"//div[{_cls('tgme_widget_message')}]")
+_TG_POST  = lxml_etree.XPath("descendant-or-self::*[@data-post][1]/@data-post")
+_TG_TEXT  = (lxml_etree.XPath(f".//*[{_cls('tgme_widget_message_text')}]"),
+             lxml_etree.XPath(f".//*[{_cls('tgme_widget_message_bubble')}]"
+                              f"//*[{_cls('js-message_text')}]"),
+             lxml_etree.XPath(".//*[@data-post]"))
+_TG_TIME  = lxml_etree.XPath(".//time[@datetime]/@datetime")
+_TG_LINK  = (lxml_etree.XPath(f".//a[{_cls('tgme_widget_message_date')}]/@href"),
+             lxml_etree.XPath(".//a[contains(@href, 't.me')]/@href"))
+
+def _tg_msg_id(link: str) -> int:
+    tail = (link or "").rstrip("/").rsplit("/", 1)[-1].split("?")[0]
+    return int(tail) if tail.isdigit() else 0
+
+def parse_tg_page(html: str, handle: str, cutoff: datetime,
+                  after_id: int = 0, limit: int = 40, meta: dict | None = None) -> list[dict]:
+    """
+    آخرین `limit` پیام صفحه → [{title, summary, link, _tg_dt}] به ترتیب صفحه.
+    پیام با id ≤ after_id (قبلاً دیده‌شده) و هرچه قبل از آن است پردازش نمی‌شود.
+    خروجی همان فیلدهای نسخه BeautifulSoup (benchmark.py legacy_tg_parse).
+    meta (اختیاری) پر می‌شود: n پیام صفحه، max/min id بررسی‌شده، known = به after_id رسید
+    """
+    doc  = lxml_html.fromstring(html)
+    msgs = (_TG_WRAPS(doc) or _TG_MSGS(doc))[-limit:]
+    out  = []
+    ids  = {"n": len(msgs), "max": 0, "min": 0, "known": False}
+    for msg in reversed(msgs):
+        post = _TG_POST(msg)
+        mid  = _tg_msg_id(post[0]) if post else 0
+        if mid:
+            ids["max"] = ids["max"] or mid
+            ids["min"] = mid
+        if after_id and mid and mid <= after_id:
+            ids["known"] = True
+            break
+
+        txt_el = next((r[0] for r in (xp(msg) for xp in _TG_TEXT) if r), None)
+        text = " ".join(t.strip() for t in txt_el.itertext() if t.strip()) if txt_el is not None else ""
+        text = re.sub(r'\s+', ' ', text).strip()
+        if not text or len(text) < 10:
+            continue
+
+        dt_str   = (_TG_TIME(msg) or [""])[0]
+        entry_dt = None
+        if dt_str:
+            try:
+                entry_dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
+            except Exception:
+                pass
+        if entry_dt and entry_dt < cutoff:
+            continue
+
+        link = next((r[0] for r in (xp(msg) for xp in _TG_LINK) if r), f"https://t.me/{handle}")
+        first_line = text.split('\n')[0][:300].strip()
+        out.append({
+            "title":   first_line if first_line else text[:200],
+            "summary": text[:1000],
+            "link":    link,
+            "_tg_dt":  entry_dt,
+        })
+    out.reverse()
+    if meta is not None:
+        meta.update(ids)
+    return out
+
+def _tg_cursor(handle: str) -> int:
+    """بالاترین message id پردازش‌شده کانال (migration: از top link زمان‌بند)"""
+    cur = STATE.json("tg_cursor", TG_CURSOR_FILE).get(handle.lower())
+    return cur if cur is not None else _tg_msg_id(SCHED.top(_tg_key(handle)))
+
+def _set_tg_cursor(handle: str, mid: int):
+    cursors = STATE.json("tg_cursor", TG_CURSOR_FILE)
+    if mid > cursors.get(handle.lower(), 0):
+        cursors[handle.lower()] = mid
+        STATE.mark_dirty("tg_cursor")
+
+# cursor پیشنهادی هر کانال از آخرین fetch — فقط بعد از عبور پیام‌ها از فیلتر
+# (commit_tg_cursor) ثبت می‌شود؛ چرخه‌ای که وسط کار شکست بخورد پیام را گم نمی‌کند
+_TG_PENDING: dict[str, int] = {}
+
+def commit_tg_cursor(handle: str, held: int = 0):
+    """
+    پیام‌های کانال به فیلتر رسیدند → cursor جلو برود.
+    held = کوچک‌ترین id ی که به صف نرسید (سقف MAX_NEW_PER_RUN) — cursor حداکثر
+    تا قبل از آن، تا چرخه بعد دوباره واکشی شود.
+    """
+    top = _TG_PENDING.pop(handle.lower(), 0)
+    _set_tg_cursor(handle, min(top, held - 1) if held else top)
 
 async def fetch_telegram_channel(client: httpx.AsyncClient, label: str,
                                   handle: str, cutoff: datetime) -> list:
     """
     scrape t.me/s/{handle} — واکشی پیام‌های کانال‌های عمومی تلگرام
     از چند User-Agent مختلف استفاده می‌کند تا احتمال موفقیت بالا برود
+
+    با cursor (بالاترین id دیده‌شده، tg_cursors.json) فقط ?after=cursor خواسته می‌شود.
+    صفحه پری که به cursor نرسید (کانال بیش از یک صفحه پست گذاشته) → ?before=min
+    تا رسیدن به cursor؛ صفحه پر از ?after → ?after=max — حداکثر TG_MAX_PAGES درخواست.
+    صفحه ناقص = چیزی قبل از آن نیست (فاصله id = پیام حذف‌شده، نه صفحه بعد).
+    cursor اینجا فقط پیشنهاد می‌شود؛ commit_tg_cursor بعد از فیلتر ثبتش می‌کند.
     """
-    url = f"https://t.me/s/{handle}"
+    base   = f"https://t.me/s/{handle}"
+    cursor = _tg_cursor(handle)
+    url    = f"{base}?after={cursor}" if cursor else base
     # user agents مختلف برای bypass rate limiting
     ua_list = [
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:124.0) Gecko/20100101 Firefox/124.0",
@@ -778,107 +1726,145 @@ async def fetch_telegram_channel(client: httpx.AsyncClient, label: str,
         "Pragma": "no-cache",
     }
     try:
-        r = await client.get(url, timeout=httpx.Timeout(TG_TIMEOUT),
-                             headers=hdrs, follow_redirects=True)
-        if r.status_code not in (200, 301, 302):
-            log.debug(f"TG {handle}: HTTP {r.status_code}")
-            return []
-
-        html = r.text
-        if not html or len(html) < 500:
-            log.debug(f"TG {handle}: empty response")
-            return []
-
-        soup = BeautifulSoup(html, "html.parser")
-
-        # selector اصلی Telegram web
-        msgs = soup.select(".tgme_widget_message_wrap")
-        if not msgs:
-            # fallback: selector قدیمی‌تر
-            msgs = soup.select(".tgme_widget_message")
-
-        if not msgs:
-            log.debug(f"TG {handle}: no messages found ({len(html)} bytes)")
-            return []
-
-        results = []
-        for msg in msgs[-40:]:  # آخرین ۴۰ پیام
-            # متن پیام — چند selector مختلف
-            txt_el = (msg.select_one(".tgme_widget_message_text")
-                      or msg.select_one(".tgme_widget_message_bubble .js-message_text")
-                      or msg.select_one("[data-post]"))
-            text = txt_el.get_text(" ", strip=True) if txt_el else ""
-
-            # پاکسازی whitespace زیاد
-            text = re.sub(r'\s+', ' ', text).strip()
-            if not text or len(text) < 10:
-                continue
-
-            # زمان پیام
-            time_el  = msg.select_one("time[datetime]")
-            dt_str   = time_el.get("datetime", "") if time_el else ""
-            entry_dt = None
-            if dt_str:
-                try:
-                    entry_dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
-                except Exception:
-                    pass
+        pages, top_id, direction = [], cursor, "after" if cursor else ""
+        for n_page in range(TG_MAX_PAGES):
+            first = n_page == 0
+            r = await client.get(url, timeout=httpx.Timeout(TG_TIMEOUT),
+                                 headers={**hdrs, **(_cond_headers(url) if first else {})},
+                                 follow_redirects=True)
+            if r.status_code == 304 and first:
+                _count_304(url)
+                SCHED.record(_tg_key(handle), "304")
+                return []
+            if r.status_code not in (200, 301, 302):
+                log.debug(f"TG {handle}: HTTP {r.status_code}")
+                if first:
+                    SCHED.record(_tg_key(handle), "fail")
+                    return []
+                break
 
-            # فیلتر زمانی
-            if entry_dt and entry_dt < cutoff:
-                continue
+            if first: _remember_validators(url, r)
+            html = r.text
+            if not html or len(html) < 500:
+                log.debug(f"TG {handle}: empty response")
+                if first:
+                    SCHED.record(_tg_key(handle), "fail")
+                    return []
+                break
 
-            # لینک پیام
-            link_el = (msg.select_one("a.tgme_widget_message_date")
-                       or msg.select_one("a[href*='t.me']"))
-            link = link_el.get("href", "") if link_el else f"https://t.me/{handle}"
+            meta = {}
+            try:
+                # ?after بعدی: فقط بالاتر از آنچه همین چرخه گرفتیم
+                after_id = top_id if direction == "after-only" else cursor
+                msgs = await run_cpu(parse_tg_page, html, handle, cutoff, after_id, 40, meta)
+            except (lxml_etree.ParserError, ValueError) as pe:
+                log.debug(f"TG {handle}: parse {pe}")
+                if first:
+                    SCHED.record(_tg_key(handle), "fail")
+                    return []
+                break
+            pages.append(msgs)
+            top_id = max(top_id, meta.get("max", 0))
 
-            # عنوان = اولین جمله متن
-            first_line = text.split('\n')[0][:300].strip()
-            title = first_line if first_line else text[:200]
+            # صفحه بعد؟ — فقط وقتی cursor داریم (اولین poll = همان صفحه آخر کافی است)
+            if not cursor or not meta.get("n"):
+                break
+            # صفحه پر و تماماً جدید → شاید بیشتر هم باشد (?after صفحه بعدی)
+            # known = سرور صفحه آخر را داد (یا ?after را نادیده گرفت) → جلوتر چیزی نیست
+            more = meta["n"] >= TG_PAGE_FULL and not meta["known"]
+            reached = meta["known"] or meta["min"] <= cursor + 1 or meta["n"] < TG_PAGE_FULL
+            if not reached and direction != "after-only":
+                direction, url = "before", f"{base}?before={meta['min']}"
+            elif direction in ("after", "after-only") and more:
+                direction, url = "after-only", f"{base}?after={meta['max']}"
+            else:
+                break
 
-            results.append(({
-                "title":   title,
-                "summary": text[:1000],
-                "link":    link,
-                "_tg_dt":  entry_dt,
-            }, label, "tg", False))
+        # ?before صفحه‌های قدیمی‌تر را بعداً آورد → ترتیب زمانی: قدیمی اول
+        if direction == "before":
+            pages.reverse()
+        links   = set()  # اگه t.me پارامتر صفحه را نادیده بگیرد، صفحه تکراری می‌آید
+        results = [(m, label, "tg", False) for page in pages for m in page
+                   if not (m["link"] in links or links.add(m["link"]))]
+        if results:
+            for m, *_ in results: m["_tg_handle"] = handle
+            _TG_PENDING[handle.lower()] = top_id
+        else:
+            _set_tg_cursor(handle, top_id)   # چیزی برای فیلتر نیست (همه قدیمی/تکراری)
 
-        log.debug(f"TG {handle}: {len(results)} messages")
+        log.debug(f"TG {handle}: {len(results)} messages ({len(pages)} page, cursor={top_id})")
+        SCHED.record(_tg_key(handle), "ok", results[-1][0]["link"] if results else "")
         return results
 
     except Exception as e:
         log.debug(f"TG {handle}: {e}")
+        SCHED.record(_tg_key(handle), "fail")
         return []
 
-async def fetch_all(client: httpx.AsyncClient, cutoff: datetime) -> list:
+async def fetch_all(client: httpx.AsyncClient, cutoff: datetime,
+                    on_result=None) -> list:
     """
     واکشی موازی همه منابع — ترتیب: Twitter اول، سپس Telegram، سپس RSS
     Twitter اول چون breaking news سریع‌تر در X منتشر می‌شود
+    on_result(items, cutoff): به محض تمام شدن هر منبع صدا زده می‌شود (pipeline
+    جریانی در _run_cycle) — منتظر کندترین fallback نمی‌ماند. cutoff = cutoff همان
+    منبع (SCHED.cutoff) که فیلتر تازگی باید با آن انجام شود.
     """
     await build_twitter_pools(client)
 
+    # فقط منابعی که deadline شان رسیده (SourceScheduler)
+    tw_due,  tw_skip  = SCHED.split([(_tw_key(h), (l, h)) for l, h in TWITTER_HANDLES])
+    rss_due, rss_skip = SCHED.split([(_rss_key(f), f) for f in ALL_RSS_FEEDS])
+    tg_due,  tg_skip  = SCHED.split([(_tg_key(h), (l, h)) for l, h in TELEGRAM_CHANNELS])
+
     # ترتیب ارسال: Twitter اول → RSS → Telegram
     # (همه موازی fetch می‌شوند ولی نتایج به این ترتیب پردازش می‌شوند)
-    tw_t  = [fetch_twitter(client, l, h) for l, h in TWITTER_HANDLES]
-    rss_t = [fetch_rss(client, f) for f in ALL_RSS_FEEDS]
-    tg_t  = [fetch_telegram_channel(client, l, h, cutoff) for l, h in TELEGRAM_CHANNELS]
+    async def _emit(coro, source: str, src_cutoff: datetime):
+        # فقط نوع منبع (rss/tg/tw) — label هر URL صدها سری Prometheus می‌ساخت
+        with METRICS.timer("fetch_seconds", kind=source.split(":", 1)[0]):
+            res = await coro
+        if on_result and res:
+            on_result(res, src_cutoff)
+        return res
+
+    # cutoff هر منبع قبل از fetch (record() مقدار last_ok را جلو می‌برد)
+    cut = {k: SCHED.cutoff(k, cutoff) for k in
+           [_tw_key(h) for _, h in tw_due] + [_rss_key(f) for f in rss_due]
+           + [_tg_key(h) for _, h in tg_due]}
+
+    _TW_STATS["req"] = 0
+    if TW_BATCH_SIZE > 1:
+        tw_t = [_emit(fetch_twitter_batch(client, tw_due[i:i + TW_BATCH_SIZE]),
+                      f"tw:batch{i // TW_BATCH_SIZE}",
+                      min(cut[_tw_key(h)] for _, h in tw_due[i:i + TW_BATCH_SIZE]))
+                for i in range(0, len(tw_due), TW_BATCH_SIZE)]
+    else:
+        tw_t = [_emit(fetch_twitter(client, l, h), _tw_key(h), cut[_tw_key(h)])
+                for l, h in tw_due]
+    rss_t = [_emit(fetch_rss(client, f), _rss_key(f), cut[_rss_key(f)]) for f in rss_due]
+    tg_t  = [_emit(fetch_telegram_channel(client, l, h, cut[_tg_key(h)]), _tg_key(h),
+                   cut[_tg_key(h)]) for l, h in tg_due]
 
     all_res = await asyncio.gather(*tw_t, *rss_t, *tg_t, return_exceptions=True)
 
     out = []; tw_ok = rss_ok = tg_ok = 0
-    n_tw  = len(TWITTER_HANDLES)
-    n_rss = len(ALL_RSS_FEEDS)
+    n_tw  = len(tw_t)
+    n_rss = len(rss_due)
     for i, res in enumerate(all_res):
         if not isinstance(res, list): continue
         out.extend(res)
-        if   i < n_tw:              tw_ok  += bool(res)
+        if   i < n_tw:              tw_ok  += len({x[1] for x in res})
         elif i < n_tw + n_rss:      rss_ok += bool(res)
         else:                        tg_ok  += bool(res)
 
-    log.info(f"  𝕏:{tw_ok}/{len(TWITTER_HANDLES)}"
-             f"  📡 RSS:{rss_ok}/{len(ALL_RSS_FEEDS)}"
-             f"  📢 TG:{tg_ok}/{len(TELEGRAM_CHANNELS)}")
+    log.info(f"  𝕏:{tw_ok}/{len(tw_due)} ({_TW_STATS['req']} req)"
+             f"  📡 RSS:{rss_ok}/{len(rss_due)}"
+             f"  📢 TG:{tg_ok}/{len(tg_due)}"
+             f"  ⏭ زمان‌بندی: {tw_skip + rss_skip + tg_skip} منبع رد شد"
+             f"  (~{SCHED.polls_per_hour():.0f} req/h)")
+    n304, saved = pop_http_stats()
+    if n304:
+        log.info(f"  ♻️ 304: {n304} پاسخ — {saved / 1024:.0f} KB دانلود نشد")
     return out
 
 # ══════════════════════════════════════════════════════════════════════════
@@ -930,131 +1916,527 @@ def _stem(word):
 def _bag(text):
     return {_stem(w) for w in re.findall(r"[\w\u0600-\u06FF]{3,}", text.lower())}
 
+ENTITY_ACTORS = (
+    ["iran","irgc","khamenei","سپاه","ایران"],
+    ["israel","idf","netanyahu","اسراییل"],
+    ["us ","usa","centcom","pentagon","آمریکا"],
+    ["hamas","حماس"], ["hezbollah","حزب‌الله"], ["houthi","حوثی"],
+)
+ENTITY_ACTIONS = {
+    "MSL": ["missile","rocket","ballistic","موشک","پهپاد"],
+    "AIR": ["airstrike","bombing","بمباران"],
+    "ATK": ["attack","strike","حمله"],
+    "KIA": ["killed","dead","casualties","کشته","شهید"],
+    "DEF": ["intercept","iron dome","رهگیری"],
+    "EXP": ["explosion","blast","انفجار"],
+    "THR": ["threat","warn","تهدید"],
+    "SAN": ["sanction","تحریم"],
+    "NUC": ["nuclear","uranium","هسته‌ای"],
+}
+
 def _entity_triple(title):
-    txt = title.lower()
-    actors = (
-        ["iran","irgc","khamenei","سپاه","ایران"],
-        ["israel","idf","netanyahu","اسراییل"],
-        ["us ","usa","centcom","pentagon","آمریکا"],
-        ["hamas","حماس"], ["hezbollah","حزب‌الله"], ["houthi","حوثی"],
-    )
-    action_cats = {
-        "MSL": ["missile","rocket","ballistic","موشک","پهپاد"],
-        "AIR": ["airstrike","bombing","بمباران"],
-        "ATK": ["attack","strike","حمله"],
-        "KIA": ["killed","dead","casualties","کشته","شهید"],
-        "DEF": ["intercept","iron dome","رهگیری"],
-        "EXP": ["explosion","blast","انفجار"],
-        "THR": ["threat","warn","تهدید"],
-        "SAN": ["sanction","تحریم"],
-        "NUC": ["nuclear","uranium","هسته‌ای"],
-    }
-    actor1, actor2, act = "", "", ""
-    for i, grp in enumerate(actors):
-        if any(a in txt for a in grp):
-            if not actor1: actor1 = str(i)
-            elif not actor2: actor2 = str(i)
-    for code, kws in action_cats.items():
-        if any(k in txt for k in kws): act = code; break
-    return actor1, actor2, act
-
-def is_story_dup(title: str, stories: list) -> bool:
-    bag1 = _bag(title)
-    if not bag1: return False
-    a1, a2, act1 = _entity_triple(title)
-    for item in stories:
-        if not (isinstance(item, (list, tuple)) and len(item) == 3):
-            continue
-        _, prev_bag_raw, prev_triple = item
-        prev_bag = set(prev_bag_raw) if isinstance(prev_bag_raw, list) else prev_bag_raw
-        pa, pb, pact = prev_triple
-        if act1 and pact and act1 in _VIOLENCE_CODES and pact in _VIOLENCE_CODES:
-            if a1 == pa and a2 == pb: return True
-        if act1 and pact and act1 in _POLITICAL_CODES and pact in _POLITICAL_CODES:
-            if a1 == pa: return True
-        union = bag1 | prev_bag
-        if union and len(bag1 & prev_bag) / len(union) >= JACCARD_THRESHOLD:
+    return classify(title).triple
+
+class StoryIndex:
+    """
+    حافظه story ها با index معکوس — به‌جای مقایسه خطی با همه story ها:
+      token → id ها (posting list)       ← فقط story های با token مشترک Jaccard می‌خورند
+      (actor1, actor2) → id ها            ← قانون خشونت (MSL/AIR/ATK/...)
+      actor1 → id ها                      ← قانون سیاسی (THR/DIP/SAN/...)
+    تصمیم‌ها دقیقاً همان مقایسه خطی قدیمی است؛ هزینه با تعداد story ها خطی رشد نمی‌کند.
+    """
+    def __init__(self, maxlen: int = MAX_STORIES):
+        self.maxlen = maxlen
+        self._items: dict[int, tuple] = {}          # id → (title, bag, triple) — ترتیب درج
+        self._next  = 0
+        self._postings: dict[str, set] = {}
+        self._viol: dict[tuple, set] = {}
+        self._pol:  dict[str, set]   = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _bucket(triple):
+        a1, a2, act = triple
+        if act in _VIOLENCE_CODES:  return "viol", (a1, a2)
+        if act in _POLITICAL_CODES: return "pol", a1
+        return None, None
+
+    def add(self, title: str, bag=None, triple=None):
+        bag    = frozenset(_bag(title) if bag is None else bag)
+        triple = tuple(triple or _entity_triple(title))
+        sid = self._next; self._next += 1
+        self._items[sid] = (title, bag, triple)
+        for tok in bag:
+            self._postings.setdefault(tok, set()).add(sid)
+        kind, key = self._bucket(triple)
+        if kind:
+            (self._viol if kind == "viol" else self._pol).setdefault(key, set()).add(sid)
+        while len(self._items) > self.maxlen:
+            self._evict(next(iter(self._items)))
+
+    def _evict(self, sid: int):
+        _, bag, triple = self._items.pop(sid)
+        for tok in bag:
+            ids = self._postings[tok]; ids.discard(sid)
+            if not ids: del self._postings[tok]
+        kind, key = self._bucket(triple)
+        if kind:
+            bucket = self._viol if kind == "viol" else self._pol
+            bucket[key].discard(sid)
+            if not bucket[key]: del bucket[key]
+
+    def is_dup(self, title: str, triple=None) -> bool:
+        bag1 = _bag(title)
+        if not bag1: return False
+        a1, a2, act1 = triple or _entity_triple(title)
+        # قانون‌های actor/action — فقط وجود یک story در bucket کافی است
+        if act1 in _VIOLENCE_CODES and self._viol.get((a1, a2)):
             return True
-    return False
+        if act1 in _POLITICAL_CODES and self._pol.get(a1):
+            return True
+        if JACCARD_THRESHOLD <= 0:
+            return bool(self._items)
+        # Jaccard ≥ θ یعنی حداقل k=⌈θ·|bag1|⌉ token مشترک → هر story کاندیدا
+        # حتماً یکی از (|bag1|-k+1) token کمیاب‌تر bag1 را دارد (pigeonhole)
+        # — posting list های پرتکرار (مثل iran) اصلاً پیمایش نمی‌شوند
+        n1 = len(bag1)
+        k  = max(1, math.ceil(JACCARD_THRESHOLD * n1 - 1e-9))
+        postings = self._postings
+        probe = sorted(bag1, key=lambda tok: len(postings.get(tok, ())))[:n1 - k + 1]
+        checked: set = set(); items = self._items
+        for tok in probe:
+            for sid in postings.get(tok, ()):
+                if sid in checked: continue
+                checked.add(sid)
+                prev_bag = items[sid][1]
+                if len(bag1 & prev_bag) / len(bag1 | prev_bag) >= JACCARD_THRESHOLD:
+                    return True
+        return False
+
+    def items(self):
+        """(title, bag, triple) به ترتیب درج"""
+        return self._items.values()
+
+    def to_list(self) -> list:
+        """فرمت stories.json: [title, bag, triple]"""
+        return [[t, list(b), list(tr)] for t, b, tr in self._items.values()]
 
-def register_story(title: str, stories: list) -> list:
-    stories.append([title, list(_bag(title)), list(_entity_triple(title))])
-    return stories[-MAX_STORIES:]
+def is_story_dup(title: str, stories: StoryIndex, triple: tuple | None = None) -> bool:
+    return stories.is_dup(title, triple)
+
+def register_story(title: str, stories: StoryIndex, triple: tuple | None = None) -> StoryIndex:
+    stories.add(title, triple=triple)
+    return stories
 
 # ══════════════════════════════════════════════════════════════════════════
-# seen.json — با TTL — فقط ارسال‌شده‌ها
+# MinHash/LSH — near-duplicate بین RSS/Telegram/X (پنجره ۲۴ ساعته)
 # ══════════════════════════════════════════════════════════════════════════
-def load_seen() -> set:
-    cutoff_ts = datetime.now(timezone.utc).timestamp() - SEEN_TTL_HOURS * 3600
+_NEARDUP_NOISE = re.compile(
+    r"\b(?:breaking|just in|urgent|update|developing|exclusive)\b|خبر فوری|فوری|🔴|⚡️?|🚨")
+_NEARDUP_STOP = frozenset(
+    "a an the of in on at to for from by with near over as and or is are was were be "
+    "it its it's this that says said say reports reported report amid after new "
+    "و در به از که را با این آن برای تا بر شد گزارش".split())
+_NEARDUP_ALEF = str.maketrans("أإآ", "ااا")
+_MERSENNE31 = (1 << 31) - 1
+
+def _lsh_bands(perm: int, threshold: float) -> tuple[int, int]:
+    """(bands, rows) با bands×rows=perm — آستانه S-curve (1/b)^(1/r) نزدیک threshold"""
+    opts = [(b, perm // b) for b in range(1, perm + 1) if perm % b == 0]
+    return min(opts, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+class NearDupIndex:
+    """
+    امضای MinHash هر عنوان (shingle های ۳ حرفی متن نرمال‌شده — مستقل از زبان)
+    + LSH با band ها در حافظه → جستجوی near-duplicate تقریباً O(1)
+    به‌جای مقایسه با همه خبرهای ۲۴ ساعت گذشته.
+
+    کاندیداهای LSH با شباهت تخمینی امضا (درصد مؤلفه‌های برابر) تأیید می‌شوند؛
+    سپس _distinct: اگه هر دو عنوان کلمه محتوایی مخصوص خودشان دارند (US/UK،
+    Beirut/Damascus، seizes/releases) دو رویداد متفاوت‌اند — shingle حرفی یک کلمه
+    متفاوت در عنوان کوتاه را نمی‌بیند.
+    dup_by_source: چند near-duplicate از هر منبع آمده (تجمعی + این چرخه)
+    """
+    MAGIC = b"WBLSH1"
+
+    def __init__(self, threshold: float = NEARDUP_THRESHOLD,
+                 perm: int = MINHASH_PERM, window_h: float = NEARDUP_WINDOW_H):
+        self.threshold = threshold
+        self.perm      = perm
+        self.window_s  = window_h * 3600
+        self.bands, self.rows = _lsh_bands(perm, threshold)
+        rnd = random.Random(0x5EED)
+        self._ab = [(rnd.randrange(1, _MERSENNE31), rnd.randrange(0, _MERSENNE31))
+                    for _ in range(perm)]
+        self._items: dict[int, tuple] = {}          # id → (ts, source, sig, title) — ترتیب زمانی
+        self._buckets = [dict() for _ in range(self.bands)]
+        self._next = 0
+        self.dup_by_source: dict[str, int] = {}
+        self.cycle_dups:    dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    # ── امضا ─────────────────────────────────────────────────────────────
+    @staticmethod
+    def _shingles(title: str) -> set:
+        t = _NEARDUP_NOISE.sub(" ", nfa(title).lower())
+        t = " ".join(re.findall(r"[\w\u0600-\u06FF]+", t))
+        if len(t) < 3: return set()
+        # crc32 — پایدار بین پروسه‌ها (برخلاف hash()) تا امضای ذخیره‌شده معتبر بماند
+        return {zlib.crc32(t[i:i + 3].encode()) for i in range(len(t) - 2)}
+
+    @staticmethod
+    def _words(title: str) -> set:
+        t = _NEARDUP_NOISE.sub(" ", nfa(title).lower()).translate(_NEARDUP_ALEF)
+        return {w for w in re.findall(r"[\w\u0600-\u06FF]+", t)
+                if len(w) > 1 and w not in _NEARDUP_STOP}
+
+    @classmethod
+    def _distinct(cls, t1: str, t2: str) -> bool:
+        """هر دو طرف کلمه‌ای دارند که در دیگری نیست (پیشوند مشترک = یکی: send/sends)"""
+        if not t1 or not t2: return False   # عنوان نداریم (فایل قدیمی) → فقط MinHash
+        w1, w2 = cls._words(t1), cls._words(t2)
+        only = lambda a, b: any(not any(x.startswith(y) or y.startswith(x) for y in b) for x in a)
+        return only(w1, w2) and only(w2, w1)
+
+    def signature(self, title: str) -> tuple | None:
+        sh = self._shingles(title)
+        if not sh: return None
+        P = _MERSENNE31
+        return tuple(min((a * x + b) % P for x in sh) for a, b in self._ab)
+
+    def _band_keys(self, sig):
+        r = self.rows
+        return [sig[i * r:(i + 1) * r] for i in range(self.bands)]
+
+    # ── جستجو / درج ──────────────────────────────────────────────────────
+    def similarity(self, s1, s2) -> float:
+        return sum(x == y for x, y in zip(s1, s2)) / self.perm
+
+    def match(self, sig, title: str = "") -> tuple | None:
+        """(شباهت، منبع، عنوان) اولین خبر مشابه در پنجره — None اگه نیست"""
+        if sig is None: return None
+        seen_ids: set = set()
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            for sid in bucket.get(key, ()):
+                if sid in seen_ids: continue
+                seen_ids.add(sid)
+                _, src, prev, prev_t = self._items[sid]
+                sim = self.similarity(sig, prev)
+                if sim >= self.threshold and not self._distinct(title, prev_t):
+                    return sim, src, prev_t
+        return None
+
+    def query(self, sig, title: str = "") -> bool:
+        return self.match(sig, title) is not None
+
+    def add(self, sig, source: str, ts: float | None = None, title: str = ""):
+        if sig is None: return
+        ts = ts or datetime.now(timezone.utc).timestamp()
+        sid = self._next; self._next += 1
+        self._items[sid] = (ts, source, sig, title)
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            bucket.setdefault(key, []).append(sid)
+        self.expire(ts)
+
+    def count_dup(self, source: str):
+        self.dup_by_source[source] = self.dup_by_source.get(source, 0) + 1
+        self.cycle_dups[source]    = self.cycle_dups.get(source, 0) + 1
+
+    def expire(self, now: float | None = None):
+        """حذف تدریجی از ابتدای صف — درج‌ها به ترتیب زمان‌اند"""
+        cutoff = (now or datetime.now(timezone.utc).timestamp()) - self.window_s
+        while self._items:
+            sid = next(iter(self._items))
+            ts, _, sig, _ = self._items[sid]
+            if ts >= cutoff: break
+            del self._items[sid]
+            for bucket, key in zip(self._buckets, self._band_keys(sig)):
+                ids = bucket.get(key)
+                if ids:
+                    ids.remove(sid)
+                    if not ids: del bucket[key]
+
+    def pop_cycle_report(self) -> str:
+        rep = "  ".join(f"{s}:{n}" for s, n in
+                        sorted(self.cycle_dups.items(), key=lambda x: -x[1])[:8])
+        self.cycle_dups = {}
+        return rep
+
+    # ── ذخیره — رکوردهای باینری با طول ثابت ─────────────────────────────
+    def to_bytes(self) -> bytes:
+        sources = sorted({src for _, src, _, _ in self._items.values()})
+        src_idx = {s: i for i, s in enumerate(sources)}
+        # titles هم‌ترتیب رکوردها — برای _distinct و log جفت‌های حذف‌شده
+        meta = json.dumps({"perm": self.perm, "sources": sources,
+                           "dup_by_source": self.dup_by_source,
+                           "titles": [t for *_, t in self._items.values()]},
+                          ensure_ascii=False).encode()
+        rec = struct.Struct(f"<dH{self.perm}I")
+        out = [self.MAGIC, struct.pack("<I", len(meta)), meta]
+        out += [rec.pack(ts, src_idx[src], *sig) for ts, src, sig, _ in self._items.values()]
+        return b"".join(out)
+
+    def load_bytes(self, raw: bytes):
+        if not raw.startswith(self.MAGIC): return
+        off = len(self.MAGIC)
+        (n_meta,) = struct.unpack_from("<I", raw, off); off += 4
+        meta = json.loads(raw[off:off + n_meta]); off += n_meta
+        if meta.get("perm") != self.perm: return  # پارامتر عوض شده — امضاها نامعتبر
+        self.dup_by_source = meta.get("dup_by_source", {})
+        sources = meta.get("sources", [])
+        titles  = meta.get("titles", [])
+        rec = struct.Struct(f"<dH{self.perm}I")
+        recs = rec.iter_unpack(raw[off:off + (len(raw) - off) // rec.size * rec.size])
+        for i, vals in enumerate(recs):
+            self.add(tuple(vals[2:]), sources[vals[1]], ts=vals[0],
+                     title=titles[i] if i < len(titles) else "")
+        self.expire()
+
+_near_dups = NearDupIndex()  # در main از NEARDUP_FILE بارگذاری می‌شود
+
+def load_near_dups() -> NearDupIndex:
+    index = NearDupIndex()
     try:
-        if Path(SEEN_FILE).exists():
+        if Path(NEARDUP_FILE).exists():
+            index.load_bytes(Path(NEARDUP_FILE).read_bytes())
+    except Exception as e:
+        log.warning(f"{NEARDUP_FILE}: {e}")
+    return index
+
+def save_near_dups(index: NearDupIndex):
+    _atomic_write(NEARDUP_FILE, index.to_bytes())
+
+# ══════════════════════════════════════════════════════════════════════════
+# seen.log — با TTL — فقط ارسال‌شده‌ها
+# ══════════════════════════════════════════════════════════════════════════
+class SeenStore:
+    """
+    id های ارسال‌شده با TTL — log فقط-افزودنی به‌جای بازنویسی کامل seen.json:
+      add      → O(1) در حافظه؛ در flush فقط خطوط جدید append می‌شوند
+      expire   → از ابتدای dict (ترتیب درج = ترتیب زمان) — فقط موارد منقضی لمس می‌شوند
+      compact  → وقتی خطوط مرده log از زنده‌ها بیشتر شد، یک بار بازنویسی
+    خط log:  "<ts> <id>"
+    """
+    def __init__(self, path: str = SEEN_LOG_FILE,
+                 ttl_s: float = SEEN_TTL_HOURS * 3600, cap: int = SEEN_MAX):
+        self.path  = path
+        self.ttl_s = ttl_s
+        self.cap   = cap
+        self._ts: dict[str, float] = {}
+        self._pending: list[str]   = []
+        self._log_lines = 0
+
+    def __contains__(self, eid) -> bool:
+        return eid in self._ts
+
+    def __len__(self):
+        return len(self._ts)
+
+    def add(self, eid: str, ts: float | None = None):
+        if eid in self._ts: return
+        ts = ts or datetime.now(timezone.utc).timestamp()
+        self._ts[eid] = ts
+        self._pending.append(f"{ts:.0f} {eid}\n")
+        if len(self._ts) > self.cap:
+            del self._ts[next(iter(self._ts))]
+
+    def expire(self, now: float | None = None) -> int:
+        cutoff = (now or datetime.now(timezone.utc).timestamp()) - self.ttl_s
+        n = 0
+        while self._ts:
+            eid = next(iter(self._ts))
+            if self._ts[eid] > cutoff: break
+            del self._ts[eid]; n += 1
+        return n
+
+    def load(self) -> "SeenStore":
+        now = datetime.now(timezone.utc).timestamp()
+        if Path(self.path).exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    self._log_lines += 1
+                    ts, _, eid = line.rstrip("\n").partition(" ")
+                    try: ts = float(ts)
+                    except ValueError: continue
+                    if eid:
+                        self._ts.pop(eid, None); self._ts[eid] = ts
+        elif Path(SEEN_FILE).exists():
+            # migrate از seen.json — dict {id: ts} یا لیست خیلی قدیمی (بدون ts → الان)
             raw = json.load(open(SEEN_FILE))
             if isinstance(raw, dict):
-                return {k for k, v in raw.items() if v > cutoff_ts}
+                items = sorted(raw.items(), key=lambda x: x[1])
             elif isinstance(raw, list):
-                # migrate از فرمت قدیم — فقط ۵۰۰ تا آخر
-                return set(raw[-500:])
-    except: pass
-    return set()
+                items = [(k, now) for k in raw[-500:]]
+            else:
+                items = []
+            for eid, ts in items:
+                self._ts[eid] = float(ts)
+            self.expire(now)
+            self.compact()
+        self.expire(now)
+        return self
+
+    def flush(self):
+        """expire تدریجی + append خطوط جدید؛ compact فقط اگه log خیلی بزرگ شده"""
+        self.expire()
+        if self._pending:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(self._pending)
+            self._log_lines += len(self._pending)
+            self._pending = []
+        if self._log_lines > 2 * len(self._ts) + 1000:
+            self.compact()
+
+    def compact(self):
+        _atomic_write(self.path, "".join(
+            f"{ts:.0f} {eid}\n" for eid, ts in self._ts.items()).encode())
+        self._log_lines = len(self._ts)
+        self._pending = []
+
+def load_seen() -> SeenStore:
+    store = SeenStore()
+    try:
+        store.load()
+    except Exception as e:
+        log.warning(f"seen load: {e}")
+    return store
 
-def save_seen(seen: set):
-    now_ts    = datetime.now(timezone.utc).timestamp()
-    cutoff_ts = now_ts - SEEN_TTL_HOURS * 3600
+def save_seen(seen: SeenStore):
     try:
-        existing = {}
-        if Path(SEEN_FILE).exists():
-            raw = json.load(open(SEEN_FILE))
-            if isinstance(raw, dict):
-                existing = {k: v for k, v in raw.items() if v > cutoff_ts}
-    except: existing = {}
-    for eid in seen:
-        if eid not in existing: existing[eid] = now_ts
-    if len(existing) > 5000:
-        existing = dict(sorted(existing.items(), key=lambda x: x[1], reverse=True)[:5000])
-    json.dump(existing, open(SEEN_FILE, "w"))
+        seen.flush()
+    except Exception as e:
+        log.warning(f"seen save: {e}")
 
 # ══════════════════════════════════════════════════════════════════════════
 # run_state — last_run برای cutoff هوشمند
 # ══════════════════════════════════════════════════════════════════════════
 def load_run_state() -> datetime:
     """آخرین زمان اجرا — برای محاسبه cutoff"""
-    try:
-        if Path(RUN_STATE_FILE).exists():
-            d   = json.load(open(RUN_STATE_FILE))
-            ts  = d.get("last_run", 0)
-            if ts:
-                return datetime.fromtimestamp(ts, tz=timezone.utc)
-    except: pass
+    ts = STATE.json("run", RUN_STATE_FILE).get("last_run", 0)
+    if ts:
+        return datetime.fromtimestamp(ts, tz=timezone.utc)
     # اولین اجرا: MAX_LOOKBACK_MIN به عقب
     return datetime.now(timezone.utc) - timedelta(minutes=MAX_LOOKBACK_MIN)
 
 def save_run_state():
-    existing = {}
-    try:
-        if Path(RUN_STATE_FILE).exists():
-            existing = json.load(open(RUN_STATE_FILE))
-    except: pass
-    existing["last_run"] = datetime.now(timezone.utc).timestamp()
-    json.dump(existing, open(RUN_STATE_FILE, "w"))
+    STATE.json("run", RUN_STATE_FILE)["last_run"] = datetime.now(timezone.utc).timestamp()
+    STATE.mark_dirty("run")
 
-def load_stories() -> list:
+# ══════════════════════════════════════════════════════════════════════════
+# stories.bin — فرمت باینری ستونی (token ها intern شده، آرایه‌های offset)
+# ══════════════════════════════════════════════════════════════════════════
+# layout (little-endian) — هر ستون یک بلوک پیوسته؛ load = چند frombytes + split:
+#   MAGIC | u32 n_rec | u32 tok_len | u32 title_len | u32 n_ids | u32 crc32(بقیه فایل)
+#   token ها (utf8, جداکننده \n) | عنوان‌ها (utf8, جداکننده \0)
+#   u32 ids_off[n_rec+1]          ← بازه token id های هر رکورد در ids
+#   u8 actor1[n_rec] | u8 actor2[n_rec] | 3s action[n_rec] | u32 ids[n_ids]
+# طول دقیق + CRC بررسی می‌شود: فایل ناقص/خراب به‌جای index نیمه‌کاره رد می‌شود.
+# WBSTO2 (بدون CRC، با ستون title_off) فقط برای migration خوانده می‌شود.
+_STORIES_MAGIC = b"WBSTO3"
+_STORIES_V2    = b"WBSTO2"
+_STORIES_HDR   = struct.Struct("<IIIII")
+_STORIES_HDR2  = struct.Struct("<IIII")
+_NO_ACTOR      = 0xFF
+_ACTOR_STR     = ["" if i == _NO_ACTOR else str(i) for i in range(256)]
+
+def encode_stories(stories: StoryIndex) -> bytes:
+    tok_ids: dict[str, int] = {}
+    titles, ids, a1s, a2s, acts = [], array("I"), bytearray(), bytearray(), []
+    ids_off = array("I", [0])
+    for title, bag, (a1, a2, act) in stories.items():
+        titles.append(title.replace("\0", " ").encode())
+        ids.extend(tok_ids.setdefault(tok, len(tok_ids)) for tok in bag)
+        ids_off.append(len(ids))
+        a1s.append(int(a1) if a1 else _NO_ACTOR)
+        a2s.append(int(a2) if a2 else _NO_ACTOR)
+        acts.append(act.encode().ljust(3, b"\0")[:3])
+    tok_blob   = "\n".join(tok_ids).encode()
+    title_blob = b"\0".join(titles) + b"\0"
+    body = b"".join((tok_blob, title_blob, ids_off.tobytes(),
+                     bytes(a1s), bytes(a2s), b"".join(acts), ids.tobytes()))
+    return b"".join((
+        _STORIES_MAGIC,
+        _STORIES_HDR.pack(len(titles), len(tok_blob), len(title_blob), len(ids),
+                          zlib.crc32(body)),
+        body,
+    ))
+
+def _stories_columns(buf) -> tuple:
+    """(n_rec، {ستون: (offset, size)}) — ValueError اگه magic/طول/CRC نادرست"""
+    magic = bytes(buf[:len(_STORIES_MAGIC)])
+    off   = len(_STORIES_MAGIC)
+    if magic == _STORIES_MAGIC:
+        n, tok_len, title_len, n_ids, crc = _STORIES_HDR.unpack_from(buf, off)
+        off += _STORIES_HDR.size
+        extra = ()
+    elif magic == _STORIES_V2:
+        n, tok_len, title_len, n_ids = _STORIES_HDR2.unpack_from(buf, off)
+        off += _STORIES_HDR2.size
+        crc, extra = None, (("title_off", 4 * (n + 1)),)
+    else:
+        raise ValueError("stories.bin: magic نامعتبر")
+    body, cols = off, {}
+    for name, size in (("tok", tok_len), ("title", title_len), *extra,
+                       ("ids_off", 4 * (n + 1)),
+                       ("a1", n), ("a2", n), ("act", 3 * n), ("ids", 4 * n_ids)):
+        cols[name] = (off, size); off += size
+    if off != len(buf):
+        raise ValueError(f"stories.bin: طول {len(buf)} ≠ {off} (ناقص؟)")
+    if crc is not None and zlib.crc32(buf[body:]) != crc:
+        raise ValueError("stories.bin: CRC نادرست")
+    return n, cols
+
+def _col_array(buf, span) -> array:
+    a = array("I"); a.frombytes(buf[span[0]:span[0] + span[1]]); return a
+
+def decode_stories(buf):
+    """buf: bytes یا mmap — رکوردها را به ترتیب yield می‌کند (اعتبارسنجی قبل از اولین رکورد)"""
+    n, cols = _stories_columns(buf)
+    if not n: return
+    col = lambda name: buf[cols[name][0]:sum(cols[name])]
+    tokens  = [sys.intern(t) for t in bytes(col("tok")).decode().split("\n")]
+    titles  = bytes(col("title")).decode().split("\0")
+    ids_off = _col_array(buf, cols["ids_off"])
+    ids     = _col_array(buf, cols["ids"])
+    a1s, a2s, acts = bytes(col("a1")), bytes(col("a2")), bytes(col("act"))
+    for i in range(n):
+        yield (titles[i], [tokens[j] for j in ids[ids_off[i]:ids_off[i + 1]]],
+               (_ACTOR_STR[a1s[i]], _ACTOR_STR[a2s[i]],
+                acts[3 * i:3 * i + 3].rstrip(b"\0").decode()))
+
+def load_stories() -> StoryIndex:
+    index = StoryIndex()
+    if Path(STORIES_BIN_FILE).exists() and Path(STORIES_BIN_FILE).stat().st_size:
+        try:
+            with open(STORIES_BIN_FILE, "rb") as f, \
+                 mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for title, bag, triple in decode_stories(mm):
+                    index.add(title, bag, triple)
+            return index
+        except Exception as e:
+            # index نیمه‌کاره نه — از stories.json (اگه هست) یا خالی
+            log.warning(f"stories.bin رد شد ({e}) — fallback به {STORIES_FILE}")
+            index = StoryIndex()
     try:
         if Path(STORIES_FILE).exists():
+            # migrate از stories.json — دفعه بعد stories.bin نوشته می‌شود
             raw = json.load(open(STORIES_FILE))
             # migrate فرمت قدیم (2-tuple) به جدید (3-tuple)
-            result = []
             for item in raw:
                 if isinstance(item, (list, tuple)) and len(item) == 2:
-                    title = item[0]
-                    result.append([title, list(_bag(title)), list(_entity_triple(title))])
+                    index.add(item[0])
                 elif isinstance(item, (list, tuple)) and len(item) == 3:
-                    result.append(item)
-            return result
-    except: pass
-    return []
+                    index.add(item[0], item[1], item[2])
+    except Exception as e:
+        log.warning(f"stories load: {e}")
+    return index
 
-def save_stories(stories):
-    json.dump(stories[-MAX_STORIES:], open(STORIES_FILE, "w"))
+def save_stories(stories: StoryIndex):
+    _atomic_write(STORIES_BIN_FILE, encode_stories(stories))
 
 # ══════════════════════════════════════════════════════════════════════════
 # ترجمه — Gemini اول، MyMemory رایگان fallback
@@ -1064,6 +2446,19 @@ GEMINI_MODELS = [
     "gemini-1.5-flash",
     "gemini-1.5-flash-8b",
 ]
+# سقف درخواست در دقیقه هر مدل (free tier) — شمارش در gemini_state.json
+GEMINI_RPM = {
+    "gemini-2.0-flash":    15,
+    "gemini-1.5-flash":    15,
+    "gemini-1.5-flash-8b": 15,
+}
+GEMINI_CHUNK_TOK   = 1200   # بودجه token ورودی هر chunk (بدون prompt ثابت)
+GEMINI_CHUNK_ITEMS = 10     # حداکثر خبر در یک chunk
+GEMINI_CHUNK_MIN   = 3      # chunk کوچک‌تر نه — prompt ثابت ~۲۵۰ token هزینه دارد
+GEMINI_MODEL_CONC  = 2      # درخواست هم‌زمان هر مدل
+GEMINI_TIMEOUT     = 25.0   # هر chunk — قبلاً یک درخواست ۴۰ ثانیه‌ای برای همه
+GEMINI_TRIES       = 3      # تلاش هر خبر (فقط خبرهای parse نشده دوباره می‌روند)
+GEMINI_DEADLINE    = 60.0   # سقف کل؛ باقی‌مانده → MyMemory
 
 # تشخیص متن فارسی
 def _is_farsi(text: str) -> bool:
@@ -1108,89 +2503,294 @@ B: [متن فارسی]
 ===خبرها===
 {items}"""
 
-async def _translate_gemini(client: httpx.AsyncClient, articles: list) -> list | None:
-    """ترجمه با Gemini — None اگه fail شد"""
-    if not GEMINI_API_KEY:
-        return None
+def _est_tok(text: str) -> int:
+    """تخمین token (~۴ نویسه/token) — فقط برای بودجه‌بندی و گزارش"""
+    return len(text) // 4 + 1
+
+def _gemini_chunks(idx: list, articles: list) -> list[list]:
+    """
+    تقسیم اندیس‌ها به chunk با بودجه token ورودی؛ تعداد chunk حداقل به اندازه
+    ظرفیت هم‌زمان مدل‌هاست تا burst بزرگ موازی ترجمه شود (ولی chunk زیر
+    GEMINI_CHUNK_MIN آیتم نه — هزینه prompt ثابت و RPM).
+    """
+    toks  = [_est_tok(articles[i][0][:300]) + _est_tok(articles[i][1][:400]) for i in idx]
+    total = sum(toks)
+    slots = len(GEMINI_MODELS) * GEMINI_MODEL_CONC
+    k = max(math.ceil(total / GEMINI_CHUNK_TOK), math.ceil(len(idx) / GEMINI_CHUNK_ITEMS),
+            min(slots, math.ceil(len(idx) / GEMINI_CHUNK_MIN)), 1)
+    target = total / k
+    chunks, cur, tok = [], [], 0
+    for i, n in zip(idx, toks):
+        if cur and (tok + n > GEMINI_CHUNK_TOK or len(cur) >= GEMINI_CHUNK_ITEMS
+                    or (tok >= target and len(chunks) < k - 1)):
+            chunks.append(cur); cur, tok = [], 0
+        cur.append(i); tok += n
+    if cur: chunks.append(cur)
+    return chunks
+
+def _parse_gemini(text_out: str, n: int) -> list:
+    """بلوک‌های ###ITEM_i### → (fa_t, fa_b) یا None برای آیتمی که parse نشد"""
+    out = [None] * n
+    for i in range(n):
+        blk = re.search(rf"###ITEM_{i}###\s*(.*?)(?=###ITEM_\d+###|\Z)", text_out, re.DOTALL)
+        if not blk: continue
+        block   = blk.group(1)
+        t_match = re.search(r"^T:\s*(.+)$", block, re.MULTILINE)
+        b_match = re.search(r"^B:\s*([\s\S]+?)$", block, re.MULTILINE)
+        fa_t = t_match.group(1).strip() if t_match else ""
+        fa_b = b_match.group(1).strip() if b_match else ""
+        # fallback: همه block را عنوان بگیر
+        if not fa_t:
+            fa_t = block.strip().split('\n')[0]
+        if len(fa_t) > 5:
+            out[i] = (fa_t, fa_b)
+    return out
+
+# ── محدودیت نرخ هر مدل — پنجره ۶۰ ثانیه + cooldown بعد از 429، در gemini_state ─
+def _gm_rl(model: str) -> dict:
+    rl = STATE.json("gemini", GEMINI_STATE_FILE).setdefault("rl", {})
+    return rl.setdefault(model, {"ts": [], "until": 0})
+
+def _gm_wait(model: str, now: float) -> float:
+    """ثانیه تا آزاد شدن ظرفیت مدل (0 = الان)"""
+    rl  = _gm_rl(model)
+    rl["ts"] = [t for t in rl["ts"] if now - t < 60]
+    rpm = GEMINI_RPM.get(model, 10)
+    w   = max(0.0, rl["until"] - now)
+    if len(rl["ts"]) >= rpm:
+        w = max(w, rl["ts"][-rpm] + 60 - now)
+    return w
+
+def _gm_retry_delay(r: httpx.Response) -> float:
+    """RetryInfo.retryDelay در بدنه 429 (مثلاً "17s")، وگرنه Retry-After"""
+    m = re.search(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"', r.text)
+    if m: return float(m.group(1))
+    try:    return float(r.headers.get("Retry-After", 60))
+    except ValueError: return 60.0
+
+async def _gemini_call(client: httpx.AsyncClient, model: str, arts: list) -> tuple:
+    """یک chunk → (status، نتایج یا None، تأخیر 429) — هرگز raise نمی‌کند"""
     items_txt = "".join(
         f"###ITEM_{i}###\nEN_TITLE: {t[:300]}\nEN_BODY: {s[:400]}\n\n"
-        for i, (t, s) in enumerate(articles)
+        for i, (t, s) in enumerate(arts)
     )
-    state = {}
+    t0 = time.perf_counter()
+    status, out, delay = 0, None, 0.0
     try:
-        if Path(GEMINI_STATE_FILE).exists():
-            state = json.load(open(GEMINI_STATE_FILE))
-    except: pass
-    models = state.get("models_order", GEMINI_MODELS)
-    base   = "https://generativelanguage.googleapis.com/v1beta/models"
+        r = await client.post(
+            f"https://generativelanguage.googleapis.com/v1beta/models/{model}"
+            f":generateContent?key={GEMINI_API_KEY}",
+            json={
+                "contents": [{"parts": [{"text": GEMINI_PROMPT.format(items=items_txt)}]}],
+                "generationConfig": {"temperature": 0.1, "maxOutputTokens": 8192}
+            },
+            timeout=httpx.Timeout(GEMINI_TIMEOUT)
+        )
+        status = r.status_code
+        if status == 429:
+            delay = _gm_retry_delay(r)
+            log.warning(f"Gemini {model}: rate-limit ({delay:.0f}s)")
+        elif status != 200:
+            log.warning(f"Gemini {model}: HTTP {status} — {r.text[:200]}")
+        else:
+            out = _parse_gemini(r.json()["candidates"][0]["content"]["parts"][0]["text"], len(arts))
+    except Exception as e:
+        log.warning(f"Gemini {model}: {e}")
+        status = status or 0
+    METRICS.observe("gemini_call_seconds", time.perf_counter() - t0,
+                    model=model, status=str(status))
+    return status, out, delay
 
-    for model in models:
-        try:
-            r = await client.post(
-                f"{base}/{model}:generateContent?key={GEMINI_API_KEY}",
-                json={
-                    "contents": [{"parts": [{"text": GEMINI_PROMPT.format(items=items_txt)}]}],
-                    "generationConfig": {"temperature": 0.1, "maxOutputTokens": 8192}
-                },
-                timeout=httpx.Timeout(40.0)
-            )
-            if r.status_code == 429:
-                log.warning(f"Gemini {model}: rate-limit"); continue
-            if r.status_code != 200:
-                log.warning(f"Gemini {model}: HTTP {r.status_code} — {r.text[:200]}"); continue
-
-            text_out = r.json()["candidates"][0]["content"]["parts"][0]["text"]
-            log.info(f"🌐 Gemini {model} OK")
-
-            results = list(articles)
-            ok_count = 0
-            for i, (orig_t, orig_s) in enumerate(articles):
-                blk = re.search(rf"###ITEM_{i}###\s*(.*?)(?=###ITEM_\d+###|\Z)", text_out, re.DOTALL)
-                if not blk: continue
-                block   = blk.group(1)
-                t_match = re.search(r"^T:\s*(.+)$", block, re.MULTILINE)
-                b_match = re.search(r"^B:\s*([\s\S]+?)$", block, re.MULTILINE)
-                fa_t = t_match.group(1).strip() if t_match else ""
-                fa_b = b_match.group(1).strip() if b_match else ""
-                # fallback: همه block را عنوان بگیر
-                if not fa_t:
-                    fa_t = block.strip().split('\n')[0]
-                if len(fa_t) > 5:
-                    results[i] = (fa_t, fa_b or orig_s)
-                    ok_count += 1
-            log.info(f"🌐 ترجمه: {ok_count}/{len(articles)} خبر")
-            # مدل کارآمد را اول بگذار
-            state["models_order"] = [model] + [m for m in models if m != model]
-            json.dump(state, open(GEMINI_STATE_FILE, "w"))
-            return results
-        except Exception as e:
-            log.warning(f"Gemini {model}: {e}"); continue
-    return None
+async def _translate_gemini(client: httpx.AsyncClient, articles: list) -> list:
+    """
+    ترجمه با Gemini — برای هر آیتم (fa_t, fa_b) یا None (ترجمه نشد).
+    chunk های با بودجه token هم‌زمان بین مدل‌های models_order پخش می‌شوند:
+      • هر مدل حداکثر GEMINI_MODEL_CONC درخواست هم‌زمان و GEMINI_RPM در دقیقه
+      • 429 → cooldown همان مدل (retryDelay)، chunk بدون مصرف تلاش دوباره صف می‌شود
+      • خطای HTTP/شبکه → همه آیتم‌های chunk، پاسخ ناقص → فقط آیتم‌های parse نشده
+        دوباره (حداکثر GEMINI_TRIES) — مدل خطادار کمی کنار می‌رود
+      • بعد از GEMINI_DEADLINE ثانیه باقی‌مانده None می‌ماند (→ MyMemory)
+    """
+    n = len(articles)
+    if not GEMINI_API_KEY or not n:
+        return [None] * n
+    state   = STATE.json("gemini", GEMINI_STATE_FILE)
+    models  = [m for m in state.get("models_order", GEMINI_MODELS) if m in GEMINI_MODELS] \
+              or list(GEMINI_MODELS)
+    results = [None] * n
+    tries   = [0] * n
+    pending = _gemini_chunks(list(range(n)), articles)
+    n_chunks, n_calls = len(pending), 0
+    busy    = {m: 0 for m in models}
+    tasks: dict = {}
+    loop     = asyncio.get_running_loop()
+    deadline = loop.time() + GEMINI_DEADLINE
+
+    while pending or tasks:
+        # ── dispatch: هر chunk به اولین مدل آزاد (به ترتیب models_order) ──
+        wait = GEMINI_DEADLINE
+        while pending:
+            now, pick = time.time(), None
+            for m in models:
+                if busy[m] >= GEMINI_MODEL_CONC: continue
+                w = _gm_wait(m, now)
+                if not w: pick = m; break
+                wait = min(wait, w)
+            if not pick: break
+            idx = pending.pop(0)
+            busy[pick] += 1; n_calls += 1
+            _gm_rl(pick)["ts"].append(now)
+            t = asyncio.create_task(_gemini_call(client, pick, [articles[i] for i in idx]))
+            tasks[t] = (pick, idx)
+        STATE.mark_dirty("gemini")
+        left = deadline - loop.time()
+        if left <= 0 or (not tasks and wait > left):
+            break
+        if not tasks:
+            await asyncio.sleep(wait); continue
+        done, _ = await asyncio.wait(tasks, timeout=min(wait, left) if pending else left,
+                                     return_when=asyncio.FIRST_COMPLETED)
+
+        # ── نتیجه‌ها ──
+        for t in done:
+            model, idx = tasks.pop(t)
+            busy[model] -= 1
+            status, out, delay = t.result()
+            if status == 429:
+                _gm_rl(model)["until"] = time.time() + delay
+                pending.insert(0, idx); continue
+            retry = []
+            if out is None:
+                # مدل خطادار کمی کنار برود تا تلاش دوباره به مدل دیگر برسد
+                _gm_rl(model)["until"] = time.time() + 5 * (1 + sum(tries[i] for i in idx))
+                retry = idx
+            else:
+                for i, r in zip(idx, out):
+                    if r: results[i] = r
+                    else: retry.append(i)
+                # مدل کارآمد را اول بگذار
+                models.remove(model); models.insert(0, model)
+                state["models_order"] = models + [m for m in GEMINI_MODELS if m not in models]
+            for i in retry: tries[i] += 1
+            retry = [i for i in retry if tries[i] < GEMINI_TRIES]
+            if retry:
+                pending.extend(_gemini_chunks(retry, articles))
+
+    for t in tasks: t.cancel()
+    ok = sum(1 for r in results if r)
+    log.info(f"🌐 Gemini: {ok}/{n} خبر — {n_chunks} chunk، {n_calls} درخواست")
+    return results
+
+# ── cache ترجمه — یک خبر از چند feed / تلاش دوباره بعد از خطای ارسال ─────────
+# key = sha1 عنوان+متن نرمال‌شده (همان ۳۰۰/۴۰۰ نویسه‌ای که به Gemini می‌رود)
+# مقدار = [fa_title, fa_body, ts, tok] ؛ ترتیب dict = ترتیب LRU (آخر = تازه‌ترین)
+# فقط خروجی Gemini cache می‌شود — ترجمه عنوان MyMemory جای Gemini را نگیرد
+_TR_STATS = {"hit": 0, "miss": 0, "tok": 0}
+
+def _tr_norm(t: str) -> str:
+    t = unicodedata.normalize("NFKC", t).casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", t).split())
+
+def _tr_key(title: str, body: str) -> str:
+    raw = f"{_tr_norm(title[:300])}\x00{_tr_norm(body[:400])}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+def _tr_cache() -> dict:
+    return STATE.json("tr_cache", TR_CACHE_FILE)
+
+def _tr_cache_get(key: str) -> tuple | None:
+    cache = _tr_cache()
+    e = cache.pop(key, None)
+    if e is None: return None
+    if time.time() - e[2] > TR_CACHE_TTL_H * 3600:
+        STATE.mark_dirty("tr_cache"); return None
+    cache[key] = e   # → انتهای LRU
+    STATE.mark_dirty("tr_cache")
+    return e
+
+def _tr_cache_put(key: str, art: tuple, tr: tuple):
+    cache = _tr_cache()
+    # تخمین token صرفه‌جویی‌شده در hit بعدی: ورودی + خروجی، ~۴ نویسه/token
+    tok = _est_tok(art[0][:300]) + _est_tok(art[1][:400]) + _est_tok(tr[0]) + _est_tok(tr[1])
+    cache.pop(key, None)
+    cache[key] = [tr[0], tr[1], int(time.time()), tok]
+    while len(cache) > TR_CACHE_MAX:
+        del cache[next(iter(cache))]
+    STATE.mark_dirty("tr_cache")
+
+def pop_tr_stats() -> tuple[int, int, int]:
+    """(hit، miss، token صرفه‌جویی‌شده) از آخرین فراخوانی"""
+    st = _TR_STATS
+    out = (st["hit"], st["miss"], st["tok"])
+    st["hit"] = st["miss"] = st["tok"] = 0
+    return out
 
 async def translate_batch(client: httpx.AsyncClient, articles: list) -> list:
     """
-    ترجمه با اولویت:
-    1. Gemini (اگه API key داریم)
-    2. MyMemory رایگان (فقط عنوان)
-    3. متن اصلی (بدون ترجمه)
+    ترجمه با cache: hit ها بدون فراخوانی API، بقیه (یکتا) → _translate_fresh
+    خبر تکراری داخل همان batch هم فقط یک بار ترجمه می‌شود.
     """
     if not articles:
         return []
+    results: list = [None] * len(articles)
+    todo: dict[str, list] = {}        # key → اندیس‌های همان متن
+    for i, (t, s) in enumerate(articles):
+        k = _tr_key(t, s)
+        if k in todo:
+            todo[k].append(i); continue
+        e = _tr_cache_get(k)
+        if e:
+            results[i] = (e[0], e[1])
+            _TR_STATS["hit"] += 1; _TR_STATS["tok"] += e[3]
+            METRICS.inc("tr_cache_total", outcome="hit")
+            METRICS.inc("tr_tokens_saved_total", e[3])
+        else:
+            todo[k] = [i]
+    _TR_STATS["miss"] += len(todo)
+    METRICS.inc("tr_cache_total", len(todo), outcome="miss")
+    if not todo:
+        log.info(f"🌐 cache: هر {len(articles)} خبر از قبل ترجمه شده بود")
+        return results
+
+    fresh = [articles[ix[0]] for ix in todo.values()]
+    trs, providers = await _translate_fresh(client, fresh)
+    for (k, ix), art, tr, prov in zip(todo.items(), fresh, trs, providers):
+        if prov == "gemini":
+            _tr_cache_put(k, art, tr)
+        for i in ix:
+            results[i] = tr
+    return results
 
-    results = list(articles)
+async def _translate_fresh(client: httpx.AsyncClient, articles: list) -> tuple[list, list]:
+    """
+    ترجمه با اولویت (برای هر خبر جدا):
+    1. Gemini (اگه API key داریم)
+    2. MyMemory رایگان (فقط عنوان) — برای خبرهایی که Gemini ترجمه نکرد
+    3. متن اصلی (بدون ترجمه)
+    برمی‌گرداند: (نتایج، provider هر خبر)
+    """
+    results   = list(articles)
+    providers = ["orig"] * len(articles)
+    rest      = list(range(len(articles)))
 
     # ── مرحله ۱: Gemini ───────────────────────────────────────────────
     if GEMINI_API_KEY:
         log.info(f"🌐 Gemini: ترجمه {len(articles)} خبر...")
+        t0 = time.perf_counter()
         gemini_res = await _translate_gemini(client, articles)
-        if gemini_res:
-            return gemini_res
-        log.warning("🌐 Gemini fail — fallback به MyMemory")
+        rest = [i for i, r in enumerate(gemini_res) if not r]
+        METRICS.observe("translate_seconds", time.perf_counter() - t0,
+                        provider="gemini", ok=not rest)
+        for i, r in enumerate(gemini_res):
+            if r: results[i], providers[i] = r, "gemini"
+        if not rest:
+            return results, providers
+        log.warning(f"🌐 Gemini: {len(rest)} خبر ترجمه نشد — fallback به MyMemory")
     else:
         log.info("🌐 GEMINI_API_KEY تنظیم نشده — استفاده از MyMemory رایگان")
 
     # ── مرحله ۲: MyMemory — عنوان را ترجمه می‌کند ───────────────────
-    log.info(f"🌐 MyMemory: ترجمه {len(articles)} عنوان...")
+    log.info(f"🌐 MyMemory: ترجمه {len(rest)} عنوان...")
     sema = asyncio.Semaphore(5)
 
     async def _tr(orig_t, orig_s):
@@ -1200,10 +2800,14 @@ async def translate_batch(client: httpx.AsyncClient, articles: list) -> list:
             fa_t = await _translate_mymemory(client, orig_t)
             return (fa_t, orig_s)
 
-    translated = await asyncio.gather(*[_tr(t, s) for t, s in articles])
-    ok = sum(1 for i, (fa, _) in enumerate(translated) if fa != articles[i][0])
-    log.info(f"🌐 MyMemory: {ok}/{len(articles)} ترجمه شد")
-    return list(translated)
+    with METRICS.timer("translate_seconds", provider="mymemory", ok=True):
+        translated = await asyncio.gather(*[_tr(*articles[i]) for i in rest])
+    ok = 0
+    for i, tr in zip(rest, translated):
+        results[i] = tr
+        if tr != articles[i]: providers[i] = "mymemory"; ok += 1
+    log.info(f"🌐 MyMemory: {ok}/{len(rest)} ترجمه شد")
+    return results, providers
 
 # ══════════════════════════════════════════════════════════════════════════
 # Sentiment
@@ -1251,21 +2855,73 @@ SENTIMENT_RULES = [
 ]
 
 def analyze_sentiment(text: str) -> list:
-    txt = text.lower()
-    found = []
-    for icon, en_kws, fa_kws in SENTIMENT_RULES:
-        if any(kw in txt for kw in en_kws) or any(kw in txt for kw in fa_kws):
-            found.append(icon)
-        if len(found) >= 3: break
-    return found or ["📰"]
+    return list(classify(text).icons)
 
 def calc_importance(title: str, body: str, icons: list, stype: str) -> int:
-    txt = (title + " " + body).lower()
     score = sum(IMPORTANCE_BOOST.get(ic, 0) for ic in icons)
-    if any(k in txt for k in BREAKING_KEYWORDS): score += 2
+    if classify(title, body).breaking: score += 2
     if stype == "tw" and score > 0: score += 1
     return min(score, 10)
 
+# ══════════════════════════════════════════════════════════════════════════
+# طبقه‌بندی یک‌پاسه — همه کلیدواژه‌ها (فیلتر/sentiment/فوری/actor-action)
+# کلیدواژه جدید فقط به لیست مربوطه اضافه شود — اینجا خودکار جمع می‌شود
+# ══════════════════════════════════════════════════════════════════════════
+class ItemFeatures(NamedTuple):
+    families: frozenset   # خانواده‌های فیلتر جنگ (hard/iran/usa/...)
+    icons:    tuple       # sentiment — حداکثر ۳ آیکون به ترتیب SENTIMENT_RULES
+    breaking: bool        # BREAKING_KEYWORDS
+    triple:   tuple       # (actor1, actor2, action) — فقط از عنوان
+
+_RELEVANCE_FAMILIES = {
+    "hard":     HARD_EXCLUDE,
+    "embassy":  EMBASSY_OVERRIDE,
+    "iran_mil": IRAN_MILITARY_KW,
+    "iran":     IRAN_NAME_KW,
+    "usa":      USA_KW,
+    "israel":   ISRAEL_KW,
+    "proxy":    PROXY_KW,
+    "war_ctx":  WAR_CONTEXT_KW,
+    "loose":    LOOSE_KW,
+}
+_LOOSE_FAMILIES = {"iran_mil", "usa", "israel", "proxy", "war_ctx", "loose"}
+
+_CLASSIFIER = KeywordMatcher({
+    **_RELEVANCE_FAMILIES,
+    **{("icon", icon): en_kws + fa_kws for icon, en_kws, fa_kws in SENTIMENT_RULES},
+    "breaking": BREAKING_KEYWORDS,
+    **{("actor", i): grp for i, grp in enumerate(ENTITY_ACTORS)},
+    **{("act", code): kws for code, kws in ENTITY_ACTIONS.items()},
+})
+
+@functools.lru_cache(maxsize=8192)
+def classify(title: str, body: str = "") -> ItemFeatures:
+    """
+    یک اسکن روی «عنوان + خلاصه» (lowercase) → رکورد ویژگی‌ها.
+    triple فقط از بخش عنوان ساخته می‌شود (مثل قبل). نتیجه cache می‌شود تا
+    is_war_relevant / is_story_dup / register_story روی یک خبر دوباره اسکن نکنند.
+    """
+    t_low = title.lower()
+    txt   = f"{t_low} {body.lower()}" if body else t_low
+    hits, head = _CLASSIFIER.scan(txt, len(t_low))
+
+    icons = tuple(ic for ic, _, _ in SENTIMENT_RULES if ("icon", ic) in hits)[:3]
+
+    actor1, actor2, act = "", "", ""
+    for i in range(len(ENTITY_ACTORS)):
+        if ("actor", i) in head:
+            if not actor1: actor1 = str(i)
+            elif not actor2: actor2 = str(i)
+    for code in ENTITY_ACTIONS:
+        if ("act", code) in head: act = code; break
+
+    return ItemFeatures(
+        families = frozenset(f for f in hits if f in _RELEVANCE_FAMILIES),
+        icons    = icons or ("📰",),
+        breaking = "breaking" in hits,
+        triple   = (actor1, actor2, act),
+    )
+
 def sentiment_bar(icons): return "  ".join(icons)
 
 # ══════════════════════════════════════════════════════════════════════════
@@ -1274,38 +2930,272 @@ def sentiment_bar(icons): return "  ".join(icons)
 def _tgapi(path: str) -> str:
     return f"https://api.telegram.org/bot{BOT_TOKEN}/{path}"
 
-async def tg_send_text(client: httpx.AsyncClient, text: str) -> bool:
-    text = text[:MAX_MSG_LEN]
-    for attempt in range(3):
-        try:
-            r = await client.post(_tgapi("sendMessage"),
-                json={"chat_id": CHANNEL_ID, "text": text,
-                      "parse_mode": "HTML", "disable_web_page_preview": False},
-                timeout=httpx.Timeout(15.0))
-            d = r.json()
-            if r.status_code == 200 and d.get("ok"): return True
-            if d.get("error_code") == 429:
-                wait = d.get("parameters", {}).get("retry_after", 20)
-                await asyncio.sleep(wait)
-            elif attempt < 2:
-                await asyncio.sleep(3)
-        except Exception as e:
-            log.warning(f"TG send: {e}")
-            if attempt < 2: await asyncio.sleep(5)
-    return False
+async def _tg_post(client: httpx.AsyncClient, method: str, timeout: float,
+                   **kw) -> tuple[bool, float, dict]:
+    """یک درخواست Bot API → (ok، retry_after، پاسخ) ؛ retry_after > 0 فقط برای 429"""
+    try:
+        r = await client.post(_tgapi(method), timeout=httpx.Timeout(timeout), **kw)
+        d = r.json()
+    except Exception as e:
+        log.warning(f"TG {method}: {e}"); return False, 0.0, {}
+    if r.status_code == 200 and d.get("ok"):
+        return True, 0.0, d
+    if r.status_code == 429 or d.get("error_code") == 429:
+        return False, float(d.get("parameters", {}).get("retry_after", 20)), d
+    log.warning(f"TG {method}: HTTP {r.status_code} — {str(d.get('description', ''))[:120]}")
+    return False, 0.0, d
+
+async def tg_send_text(client: httpx.AsyncClient, text: str) -> tuple[bool, float]:
+    t0 = time.perf_counter()
+    ok, retry, _ = await _tg_post(client, "sendMessage", 15.0,
+        json={"chat_id": CHANNEL_ID, "text": text[:MAX_MSG_LEN],
+              "parse_mode": "HTML", "disable_web_page_preview": False})
+    METRICS.observe("tg_send_seconds", time.perf_counter() - t0, method="text", ok=ok)
+    return ok, retry
+
+# ── file_id عکس‌های آپلودشده — همان تصویر دوباره آپلود نمی‌شود ────────────────
+# key = sha1 محتوای JPEG ؛ مقدار = [file_id، ts] ؛ ترتیب dict = LRU
+_TG_UPLOADING: dict = {}   # key → Future — کارگر دیگر منتظر file_id همان آپلود می‌ماند
+
+def _tg_file_ids() -> dict:
+    return STATE.json("tg_files", TG_FILE_ID_FILE)
 
 async def tg_send_photo(client: httpx.AsyncClient, buf: io.BytesIO,
-                         caption: str) -> bool:
-    caption = caption[:1024]
+                         caption: str) -> tuple[bool, float]:
+    """
+    عکسی که قبلاً (همین اجرا یا اجرای قبل) آپلود شده با file_id ارسال می‌شود؛
+    file_id نامعتبر → حذف و آپلود عادی.
+    """
+    data  = buf.getvalue()
+    key   = hashlib.sha1(data).hexdigest()[:20]
+    ids   = _tg_file_ids()
+    base  = {"chat_id": CHANNEL_ID, "caption": caption[:1024], "parse_mode": "HTML"}
+
+    if key not in ids and key in _TG_UPLOADING:
+        await asyncio.shield(_TG_UPLOADING[key])
+    if key in ids:
+        ids[key] = ids.pop(key)   # → انتهای LRU
+        t0 = time.perf_counter()
+        ok, retry, _ = await _tg_post(client, "sendPhoto", 15.0,
+                                      json={**base, "photo": ids[key][0]})
+        METRICS.observe("tg_send_seconds", time.perf_counter() - t0, method="photo_id", ok=ok)
+        if ok:
+            METRICS.inc("tg_upload_saved_bytes_total", len(data))
+        if ok or retry:
+            return ok, retry
+        del ids[key]; STATE.mark_dirty("tg_files")
+
+    t0 = time.perf_counter()
+    buf.seek(0)
+    uploading = _TG_UPLOADING.setdefault(key, asyncio.get_running_loop().create_future())
     try:
-        buf.seek(0)
-        r = await client.post(_tgapi("sendPhoto"),
-            data={"chat_id": CHANNEL_ID, "caption": caption, "parse_mode": "HTML"},
-            files={"photo": ("card.jpg", buf, "image/jpeg")},
-            timeout=httpx.Timeout(20.0))
-        return r.status_code == 200 and r.json().get("ok", False)
-    except Exception as e:
-        log.warning(f"TG photo: {e}"); return False
+        ok, retry, d = await _tg_post(client, "sendPhoto", 20.0,
+            data=base, files={"photo": ("card.jpg", buf, "image/jpeg")})
+    finally:
+        if _TG_UPLOADING.get(key) is uploading:
+            del _TG_UPLOADING[key]
+        if not uploading.done(): uploading.set_result(None)
+    METRICS.observe("tg_send_seconds", time.perf_counter() - t0, method="photo", ok=ok)
+    sizes = ((d.get("result") or {}).get("photo") or []) if ok else []
+    if sizes:
+        # بزرگ‌ترین PhotoSize آخر لیست است
+        ids[key] = [sizes[-1]["file_id"], int(time.time())]
+        while len(ids) > TG_FILE_ID_MAX:
+            del ids[next(iter(ids))]
+        STATE.mark_dirty("tg_files")
+    return ok, retry
+
+# ══════════════════════════════════════════════════════════════════════════
+# صف ارسال — اولویت + token bucket + retry_after، پایدار بین restart ها
+# ══════════════════════════════════════════════════════════════════════════
+class TokenBucket:
+    """rate توکن در ثانیه، حداکثر burst توکن ذخیره"""
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.t = float(burst), time.monotonic()
+
+    def wait(self) -> float:
+        """ثانیه تا آزاد شدن یک توکن (0 = الان)"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+        self.t = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class TelegramSender:
+    """
+    ارسال مستقل از چرخه — _run_cycle فقط submit می‌کند و چرخه بعدی
+    (fetch/ترجمه) منتظر ارسال نمی‌ماند.
+      • صف اولویت: importance بالاتر (خبر فوری) جلو، هم‌اولویت به ترتیب ورود
+      • TG_SEND_CONC کارگر: تصویر مقاله موازی و قبل از گرفتن توکن دریافت می‌شود
+      • prefetch: تصویر خبر RSS از همان لحظه قبول در فیلتر (هم‌زمان با ترجمه)
+        با حداکثر IMG_PREFETCH_CONC دانلود هم‌زمان گرفته می‌شود
+      • token bucket کانال (TG_CHAT_RATE/BURST) + سراسری (TG_GLOBAL_RATE)
+      • 429 → همه کارگرها تا retry_after مکث، خبر بدون مصرف تلاش به صف برمی‌گردد
+      • صف در send_queue.json؛ job تا تأیید Telegram در صف می‌ماند
+        (crash وسط ارسال = در بدترین حالت یک پیام تکراری، نه خبر گم‌شده)
+      • job قدیمی‌تر از SEND_MAX_AGE_MIN (هنگام بارگذاری یا رسیدن نوبت) ارسال
+        نمی‌شود و به seen می‌رود — خبر چندساعته در صف شلوغ بی‌فایده است
+    """
+    def __init__(self):
+        self.chat  = TokenBucket(TG_CHAT_RATE, TG_CHAT_BURST)
+        self.glob  = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        self.q: asyncio.PriorityQueue | None = None
+        self.pause_until = 0.0
+        self.seq     = 0
+        self.workers: list = []
+        self.imgs:   dict = {}   # eid → Task تصویر (prefetch یا هنگام ارسال؛ برای تلاش بعد از 429 هم)
+        self.client: httpx.AsyncClient | None = None
+        self.img_sema = asyncio.Semaphore(IMG_PREFETCH_CONC or TG_SEND_CONC)
+        self.stats   = {"sent": 0, "fail": 0, "429": 0, "expired": 0, "lat": []}
+
+    @property
+    def jobs(self) -> dict:
+        return STATE.json("sendq", SEND_QUEUE_FILE).setdefault("jobs", {})
+
+    def __contains__(self, eid: str) -> bool:
+        return eid in self.jobs
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def start(self, client: httpx.AsyncClient, seen: "SeenStore"):
+        """صف ذخیره‌شده را بار کن (job کهنه حذف) و کارگرها را راه بینداز"""
+        self.q, self.client = asyncio.PriorityQueue(), client
+        jobs = self.jobs
+        for eid in [e for e, j in jobs.items() if self._expired(j)]:
+            self._expire(seen, eid)
+        for eid, job in sorted(jobs.items(), key=lambda kv: kv[1]["seq"]):
+            self.seq += 1; job["seq"] = self.seq
+            self.q.put_nowait((-job["prio"], job["seq"], eid))
+        if jobs:
+            log.info(f"📤 صف ارسال ذخیره‌شده: {len(jobs)} خبر")
+        self.workers = [asyncio.create_task(self._worker(client, seen))
+                        for _ in range(TG_SEND_CONC)]
+
+    async def _fetch_img(self, link: str) -> "io.BytesIO | None":
+        async with self.img_sema:
+            return await fetch_article_image(self.client, link)
+
+    def prefetch(self, eid: str, link: str):
+        """دریافت تصویر از همین حالا — job بعداً با همان eid نتیجه را برمی‌دارد"""
+        if IMG_PREFETCH_CONC and link and eid not in self.imgs:
+            self.imgs[eid] = asyncio.create_task(self._fetch_img(link))
+
+    def forget(self, eid: str):
+        """خبری که به صف نرسید (مثلاً بدون متن فارسی) — prefetch لغو"""
+        t = self.imgs.pop(eid, None)
+        if t: t.cancel()
+
+    def submit(self, eid: str, caption: str, link: str, prio: int, t_fetch: float):
+        if eid in self.jobs: return
+        self.seq += 1
+        self.jobs[eid] = {"cap": caption, "link": link, "prio": prio,
+                          "t": t_fetch, "seq": self.seq, "tries": 0}
+        self.q.put_nowait((-prio, self.seq, eid))
+        STATE.mark_dirty("sendq")
+
+    async def drain(self, timeout: float) -> bool:
+        """صبر تا خالی شدن صف — False اگه timeout شد (باقی در فایل می‌ماند)"""
+        try:
+            await asyncio.wait_for(self.q.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stop(self):
+        for t in self.workers: t.cancel()
+        for t in self.imgs.values(): t.cancel()
+        self.workers, self.imgs = [], {}
+
+    def pop_stats(self) -> dict:
+        st, self.stats = self.stats, {"sent": 0, "fail": 0, "429": 0, "expired": 0, "lat": []}
+        return st
+
+    @staticmethod
+    def _expired(job: dict) -> bool:
+        return time.time() - job["t"] > SEND_MAX_AGE_MIN * 60
+
+    def _expire(self, seen: "SeenStore", eid: str):
+        """job کهنه: حذف از صف + seen (تا چرخه بعد دوباره صفش نکند)"""
+        self.jobs.pop(eid, None); self.forget(eid)
+        seen.add(eid)
+        self.stats["expired"] += 1
+        METRICS.inc("items_total", outcome="expired")
+        STATE.mark_dirty("sendq", "seen")
+
+    async def _acquire(self):
+        while True:
+            w = max(self.pause_until - time.monotonic(), self.chat.wait(), self.glob.wait())
+            if w <= 0:
+                self.chat.take(); self.glob.take(); return
+            await asyncio.sleep(w)
+
+    async def _worker(self, client: httpx.AsyncClient, seen: "SeenStore"):
+        while True:
+            _, _, eid = await self.q.get()
+            try:
+                job = self.jobs.get(eid)
+                if job is not None and self._expired(job):
+                    log.info(f"  ⌛ بیش از {SEND_MAX_AGE_MIN} دقیقه در صف — ارسال نشد: {job['cap'][:60]}")
+                    self._expire(seen, eid)
+                elif job is not None:
+                    await self._deliver(client, seen, eid, job)
+            except Exception as e:
+                log.warning(f"  ❌ ارسال: {e}")
+            finally:
+                self.q.task_done()
+
+    async def _deliver(self, client: httpx.AsyncClient, seen: "SeenStore", eid: str, job: dict):
+        img, task = None, self.imgs.get(eid)
+        if task is None and job["link"]:
+            task = self.imgs[eid] = asyncio.create_task(self._fetch_img(job["link"]))
+        elif task is not None:
+            METRICS.inc("img_prefetch_total", ready=task.done())
+        if task is not None:
+            try:
+                img = await task
+            except Exception as e:
+                log.debug(f"🖼 {e}")
+        ok, retry = False, 0.0
+        if img:
+            await self._acquire()
+            ok, retry = await tg_send_photo(client, img, job["cap"])
+            if ok: log.info("    📸 تصویر+فارسی")
+        if not ok and not retry:
+            await self._acquire()
+            ok, retry = await tg_send_text(client, job["cap"])
+            if ok: log.info("    ✉️ متن فارسی")
+
+        if ok:
+            del self.jobs[eid]; self.imgs.pop(eid, None)
+            seen.add(eid)
+            # seen همراه sendq — ارسال بعد از آخرین چرخه (drain پایانی / SIGTERM) هم ثبت شود
+            STATE.mark_dirty("seen")
+            lat = time.time() - job["t"]
+            self.stats["sent"] += 1; self.stats["lat"].append(lat)
+            METRICS.inc("items_total", outcome="sent")
+            METRICS.observe("item_latency_seconds", lat)
+        elif retry:
+            self.pause_until = max(self.pause_until, time.monotonic() + retry)
+            self.stats["429"] += 1
+            METRICS.inc("tg_429_total")
+            log.warning(f"  ⏸ Telegram 429 — مکث {retry:.0f}s")
+            self.q.put_nowait((-job["prio"], job["seq"], eid))
+        else:
+            job["tries"] += 1
+            if job["tries"] >= TG_SEND_TRIES:
+                del self.jobs[eid]; self.imgs.pop(eid, None)
+                self.stats["fail"] += 1
+                log.warning(f"  ❌ ارسال ناموفق بعد از {TG_SEND_TRIES} تلاش: {job['cap'][:60]}")
+            else:
+                await asyncio.sleep(3 * job["tries"])
+                self.q.put_nowait((-job["prio"], job["seq"], eid))
+        STATE.mark_dirty("sendq")
+
+SENDER = TelegramSender()
 
 # ══════════════════════════════════════════════════════════════════════════
 # PIL کارت خبری
@@ -1433,12 +3323,302 @@ _IMG_SELECTORS = [
     "article img",
 ]
 
+def _img_candidates(html: str) -> list[tuple[str, int]]:
+    """HTML مقاله → [(url تصویر، اولویت)] — سطح ماژول برای process pool (BS4 کند است)"""
+    soup = BeautifulSoup(html, "html.parser")
+
+    # ── ساخت لیست کاندیدا ───────────────────────────────────────
+    candidates: list[tuple[str, int]] = []  # (url, priority)
+
+    # Priority 1: CSS selector های article/news
+    for sel in _IMG_SELECTORS:
+        for el in soup.select(sel)[:3]:
+            src = None
+            if el.name == "source":
+                src = el.get("srcset", "").split(" ")[0]
+            else:
+                # srcset → بزرگ‌ترین
+                ss = el.get("srcset", "")
+                if ss:
+                    parts = [p.strip().split(" ") for p in ss.split(",") if p.strip()]
+                    best = sorted(parts, key=lambda x: int(x[1].rstrip("w")) if len(x)>1 and x[1].rstrip("w").isdigit() else 0, reverse=True)
+                    if best: src = best[0][0]
+                if not src:
+                    src = el.get("src") or el.get("data-src") or el.get("data-lazy-src")
+            if src and not src.startswith("data:"):
+                candidates.append((src, 10))
+
+    # Priority 2: og:image
+    og = soup.find("meta", property="og:image")
+    if og and og.get("content"):
+        candidates.append((og["content"], 5))
+
+    # og:image:width بررسی
+    og_w = soup.find("meta", property="og:image:width")
+    if og_w:
+        try:
+            w = int(og_w.get("content", 0))
+            if w < 500 and candidates:
+                # og:image کوچک است → اولویت پایین‌تر
+                candidates = [(u, p-3 if u == og.get("content") else p) for u, p in candidates]
+        except: pass
+
+    # Priority 3: twitter:image
+    for name in ("twitter:image", "twitter:image:src"):
+        tw = soup.find("meta", attrs={"name": name})
+        if tw and tw.get("content"):
+            candidates.append((tw["content"], 4)); break
+    return candidates
+
+def _img_dims(head: bytes) -> tuple[int, int] | None:
+    """
+    (عرض، ارتفاع) از چند KB اول فایل — PNG / GIF / WebP / JPEG (اولین SOF).
+    None = هنوز بایت کافی نیست یا فرمت ناشناخته.
+    """
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack(">II", head[16:24]) if len(head) >= 24 else None
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack("<HH", head[6:10]) if len(head) >= 10 else None
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        if len(head) < 30: return None
+        fmt = head[12:16]
+        if fmt == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+            w, h = struct.unpack("<HH", head[26:30])
+            return w & 0x3fff, h & 0x3fff
+        if fmt == b'VP8L' and head[20] == 0x2f:
+            b = int.from_bytes(head[21:25], "little")
+            return (b & 0x3fff) + 1, ((b >> 14) & 0x3fff) + 1
+        if fmt == b'VP8X':
+            return (int.from_bytes(head[24:27], "little") + 1,
+                    int.from_bytes(head[27:30], "little") + 1)
+        return None
+    if head[:2] == b'\xff\xd8':
+        i = 2
+        while i + 9 <= len(head):
+            if head[i] != 0xFF:
+                return None                       # ساختار خراب
+            m = head[i + 1]
+            if m == 0xFF:
+                i += 1; continue                  # fill byte
+            if m == 0x01 or 0xD0 <= m <= 0xD8:
+                i += 2; continue                  # marker بدون طول
+            if 0xC0 <= m <= 0xCF and m not in (0xC4, 0xC8, 0xCC):
+                h, w = struct.unpack(">HH", head[i + 5:i + 9])
+                return w, h
+            i += 2 + struct.unpack(">H", head[i + 2:i + 4])[0]
+    return None
+
+def _img_reject(w: int, h: int) -> str | None:
+    """دلیل رد بر اساس ابعاد (لوگو/بنر) — None = قابل قبول"""
+    # عرض < ۵۰۰ یا ارتفاع < ۲۸۰ → لوگو/بنر
+    if w < 500 or h < 280:
+        return f"skip-dim: {w}×{h}"
+    # نسبت < 1.3 → احتمالاً مربع یا عمودی = لوگو
+    ratio = w / max(h, 1)
+    if ratio < 1.3:
+        return f"skip-ratio: {ratio:.2f} ({w}×{h})"
+    return None
+
+def _prep_image(raw: bytes) -> tuple[bytes | None, str, tuple]:
+    """
+    فیلتر ابعاد + resize + JPEG — (bytes، توضیح، ابعاد خروجی) یا (None، دلیل رد، ()).
+    Pillow حین decode/encode GIL را آزاد می‌کند → thread pool.
+    """
+    try:
+        tmp = Image.open(io.BytesIO(raw))
+        w, h = tmp.size
+        why = _img_reject(w, h)
+        if why:
+            return None, why, ()
+        ratio = w / max(h, 1)
+        img_rgb = tmp.convert("RGB")
+        if w > 1600 or h > 1000:
+            img_rgb.thumbnail((1600, 1000), Image.LANCZOS)
+        out = io.BytesIO()
+        img_rgb.save(out, "JPEG", quality=88, optimize=True)
+        return out.getvalue(), f"{w}×{h} r={ratio:.1f}", img_rgb.size
+    except Exception as pe:
+        return None, f"PIL-err: {pe}", ()
+
+# ── cache تصویر — مقاله → تصویر انتخاب‌شده، تصویر → JPEG آماده + ابعاد ──────
+# index در img_cache.json (ترتیب dict = LRU، آخر = تازه‌ترین):
+#   pages[article_url] = [img_url | "" (منفی), ts, طول HTML]
+#   imgs[img_url]      = [file | "" (منفی: کوچک/لوگو/غیرتصویر), w, h, طول خام, طول JPEG, ts]
+# JPEG ها در IMG_CACHE_DIR/<sha1>.jpg — حذف LRU وقتی مجموع > IMG_CACHE_MAX_MB
+_IMG_STATS    = {"hit": 0, "miss": 0, "saved": 0}
+_IMG_INFLIGHT: dict = {}   # img_url → Task — دو خبر با یک تصویر، یک دانلود
+_img_swept    = False
+
+def _img_idx() -> dict:
+    global _img_swept
+    d = STATE.json("img_cache", IMG_CACHE_FILE)
+    d.setdefault("pages", {}); d.setdefault("imgs", {})
+    if not _img_swept:
+        # فایل بدون مدخل (kill بعد از نوشتن JPEG و قبل از flush index) یا برعکس
+        _img_swept = True
+        files = {e[0] for e in d["imgs"].values() if e[0]}
+        try:
+            for f in Path(IMG_CACHE_DIR).glob("*.jpg"):
+                if f.name not in files: f.unlink()
+        except OSError as e:
+            log.debug(f"img cache sweep: {e}")
+        for u in [u for u, e in d["imgs"].items()
+                  if e[0] and not (Path(IMG_CACHE_DIR) / e[0]).exists()]:
+            del d["imgs"][u]
+    return d
+
+def _img_hit(kind: str, saved: int):
+    _IMG_STATS["hit"] += 1; _IMG_STATS["saved"] += saved
+    METRICS.inc("img_cache_total", kind=kind, outcome="hit")
+    METRICS.inc("img_cache_saved_bytes_total", saved)
+
+def _img_miss(kind: str):
+    _IMG_STATS["miss"] += 1
+    METRICS.inc("img_cache_total", kind=kind, outcome="miss")
+
+def _img_lookup(table: str, key: str, ttl_h: float | None) -> list | None:
+    """مدخل تازه → انتهای LRU ؛ کهنه → حذف و None. ttl_h=None: منفی‌ها IMG_NEG_TTL_H"""
+    d = _img_idx()[table]
+    e = d.pop(key, None)
+    if e is None: return None
+    neg = not e[0]
+    ttl = IMG_NEG_TTL_H if neg else (ttl_h or 1e9)
+    STATE.mark_dirty("img_cache")
+    if time.time() - e[-1 if table == "imgs" else 1] > ttl * 3600:
+        if table == "imgs" and e[0]:
+            (Path(IMG_CACHE_DIR) / e[0]).unlink(missing_ok=True)
+        return None
+    d[key] = e
+    return e
+
+def _img_evict():
+    idx = _img_idx()
+    imgs, pages = idx["imgs"], idx["pages"]
+    total = sum(e[4] for e in imgs.values() if e[0])
+    for u in list(imgs):
+        if total <= IMG_CACHE_MAX_MB * 2**20 and len(imgs) + len(pages) <= IMG_CACHE_MAX_N:
+            break
+        e = imgs.pop(u)
+        if e[0]:
+            total -= e[4]
+            (Path(IMG_CACHE_DIR) / e[0]).unlink(missing_ok=True)
+    while len(imgs) + len(pages) > IMG_CACHE_MAX_N and pages:
+        del pages[next(iter(pages))]
+
+async def _img_store(img_url: str, jpeg: bytes | None, size: tuple, raw_len: int):
+    name = ""
+    if jpeg:
+        name = hashlib.sha1(img_url.encode()).hexdigest()[:20] + ".jpg"
+        try:
+            Path(IMG_CACHE_DIR).mkdir(exist_ok=True)
+            await run_cpu(_atomic_write, str(Path(IMG_CACHE_DIR) / name), jpeg)
+        except OSError as e:
+            log.debug(f"img cache write: {e}"); return
+    w, h = size or (0, 0)
+    _img_idx()["imgs"][img_url] = [name, w, h, raw_len, len(jpeg or b""), int(time.time())]
+    _img_evict()
+    STATE.mark_dirty("img_cache")
+
+def pop_img_stats() -> tuple[int, int, int]:
+    """(hit، miss، بایت دانلودنشده) از آخرین فراخوانی"""
+    st = _IMG_STATS
+    out = (st["hit"], st["miss"], st["saved"])
+    st["hit"] = st["miss"] = st["saved"] = 0
+    return out
+
+async def _fetch_image(client: httpx.AsyncClient, img_url: str) -> bytes | None:
+    """یک تصویر کاندید → JPEG آماده یا None — با cache (مثبت و منفی)"""
+    e = _img_lookup("imgs", img_url, None)
+    if e is not None:
+        if not e[0]:
+            _img_hit("img", e[3]); return None
+        try:
+            data = (Path(IMG_CACHE_DIR) / e[0]).read_bytes()
+            _img_hit("img", e[3]); return data
+        except OSError:
+            del _img_idx()["imgs"][img_url]
+    _img_miss("img")
+    t = _IMG_INFLIGHT.get(img_url)
+    if t is None:
+        t = _IMG_INFLIGHT[img_url] = asyncio.create_task(_download_image(client, img_url))
+        t.add_done_callback(lambda _: _IMG_INFLIGHT.pop(img_url, None))
+    return await asyncio.shield(t)
+
+_IMG_MAGIC = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'RIFF', b'WEBP')
+
+async def _download_image(client: httpx.AsyncClient, img_url: str) -> bytes | None:
+    """
+    دانلود جریانی با probe: ابعاد از header چند KB اول خوانده می‌شود و
+    لوگو/بنر قبل از دانلود کامل رها می‌شود؛ فقط برنده تا IMG_MAX_BYTES ادامه می‌دهد.
+    """
+    raw, verdict = bytearray(), None
+    try:
+        async with client.stream("GET", img_url,
+                timeout=httpx.Timeout(12.0),
+                headers={**COMMON_UA, "Accept": "image/*,*/*;q=0.5"},
+                follow_redirects=True) as ir:
+            if 400 <= ir.status_code < 500:
+                await _img_store(img_url, None, (), 0); return None   # 404/403 — منفی
+            if ir.status_code != 200:
+                return None
+            ctype = ir.headers.get("content-type", "")
+            try:    clen = int(ir.headers.get("content-length") or 0)
+            except ValueError: clen = 0
+
+            # حجم کم → لوگو (از header، بدون خواندن بدنه)
+            if 0 < clen < 15_000:
+                verdict = f"skip-small: {clen}B"
+            elif clen > IMG_MAX_BYTES:
+                verdict = f"skip-big: {clen}B"
+            else:
+                dims = None
+                async for chunk in ir.aiter_bytes():
+                    raw += chunk
+                    if len(raw) > IMG_MAX_BYTES:
+                        verdict = f"skip-big: >{IMG_MAX_BYTES}B"; break
+                    if dims is not None or len(raw) - len(chunk) >= IMG_PROBE_BYTES:
+                        continue
+                    # چک نوع تصویر — به محض ۱۲ بایت اول
+                    if len(raw) >= 12 and not (ctype.startswith("image/") or
+                                               bytes(raw[:8]).startswith(_IMG_MAGIC)):
+                        verdict = "skip-type"; break
+                    dims = _img_dims(bytes(raw[:IMG_PROBE_BYTES]))
+                    if dims and (why := _img_reject(*dims)):
+                        verdict = why; break
+                else:
+                    if len(raw) < 15_000:
+                        verdict = f"skip-small: {len(raw)}B"
+                    elif len(raw) < 12 or not (ctype.startswith("image/") or
+                                               bytes(raw[:8]).startswith(_IMG_MAGIC)):
+                        verdict = "skip-type"
+    except Exception as de:
+        log.debug(f"🖼 dl-err: {de}"); return None
+
+    METRICS.inc("img_download_bytes_total", len(raw),
+                outcome="probe-reject" if verdict else "full")
+    if verdict:
+        log.debug(f"🖼 {verdict}  ({len(raw)//1024}KB خوانده شد)")
+        # raw_len = حجمی که بدون probe دانلود می‌شد — برای آمار صرفه‌جویی cache
+        await _img_store(img_url, None, (), clen or len(raw)); return None
+
+    raw = bytes(raw)
+    # PIL: بررسی نهایی ابعاد و resize — در thread pool (decode/resize/JPEG)
+    if not PIL_OK:
+        return raw
+    jpeg, info, size = await run_cpu(_prep_image, raw)
+    await _img_store(img_url, jpeg, size, len(raw))
+    if jpeg is None:
+        log.debug(f"🖼 {info}"); return None
+    log.info(f"🖼 ✅ {info}  {img_url[:55]}")
+    return jpeg
+
 async def fetch_article_image(client: httpx.AsyncClient, url: str) -> "io.BytesIO | None":
     """
     تصویر اصلی مقاله:
     ۱. CSS selectors برای یافتن تصویر خبر در متن مقاله
     ۲. og:image / twitter:image فقط اگه عرض ≥ ۶۰۰ باشد
     ۳. فیلتر لوگو: حجم < ۱۵KB یا ابعاد < ۵۰۰×۲۸۰ یا ratio < 1.3 → رد
+    نتیجه (حتی «تصویر ندارد») در cache تصویر می‌ماند — صفحه دوباره scrape نمی‌شود.
     """
     if not url or len(url) < 10:
         return None
@@ -1447,6 +3627,16 @@ async def fetch_article_image(client: httpx.AsyncClient, url: str) -> "io.BytesI
     if any(d in url for d in skip_domains):
         return None
 
+    page = _img_lookup("pages", url, IMG_PAGE_TTL_H)
+    if page is not None:
+        if not page[0]:
+            _img_hit("page", page[2]); return None
+        jpeg = await _fetch_image(client, page[0])
+        if jpeg:
+            _img_hit("page", page[2]); return io.BytesIO(jpeg)
+        # تصویر انتخاب‌شده دیگر قابل استفاده نیست → صفحه دوباره
+    _img_miss("page")
+
     try:
         r = await client.get(url,
             timeout=httpx.Timeout(10.0),
@@ -1456,61 +3646,18 @@ async def fetch_article_image(client: httpx.AsyncClient, url: str) -> "io.BytesI
             follow_redirects=True)
         if r.status_code != 200:
             return None
+        html = r.text
 
-        soup = BeautifulSoup(r.text, "html.parser")
-
-        # ── ساخت لیست کاندیدا ───────────────────────────────────────
-        candidates: list[tuple[str, int]] = []  # (url, priority)
-
-        # Priority 1: CSS selector های article/news
-        for sel in _IMG_SELECTORS:
-            for el in soup.select(sel)[:3]:
-                src = None
-                if el.name == "source":
-                    src = el.get("srcset", "").split(" ")[0]
-                else:
-                    # srcset → بزرگ‌ترین
-                    ss = el.get("srcset", "")
-                    if ss:
-                        parts = [p.strip().split(" ") for p in ss.split(",") if p.strip()]
-                        best = sorted(parts, key=lambda x: int(x[1].rstrip("w")) if len(x)>1 and x[1].rstrip("w").isdigit() else 0, reverse=True)
-                        if best: src = best[0][0]
-                    if not src:
-                        src = el.get("src") or el.get("data-src") or el.get("data-lazy-src")
-                if src and not src.startswith("data:"):
-                    candidates.append((src, 10))
-
-        # Priority 2: og:image
-        og = soup.find("meta", property="og:image")
-        if og and og.get("content"):
-            candidates.append((og["content"], 5))
-
-        # og:image:width بررسی
-        og_w = soup.find("meta", property="og:image:width")
-        if og_w:
-            try:
-                w = int(og_w.get("content", 0))
-                if w < 500 and candidates:
-                    # og:image کوچک است → اولویت پایین‌تر
-                    candidates = [(u, p-3 if u == og.get("content") else p) for u, p in candidates]
-            except: pass
-
-        # Priority 3: twitter:image
-        for name in ("twitter:image", "twitter:image:src"):
-            tw = soup.find("meta", attrs={"name": name})
-            if tw and tw.get("content"):
-                candidates.append((tw["content"], 4)); break
-
-        if not candidates:
-            return None
+        candidates = await run_cpu(_img_candidates, html, kind="proc")
 
         # ── فیلتر و دانلود ──────────────────────────────────────────
         from urllib.parse import urlparse
-        base_p = urlparse(r.url)  # URL نهایی (بعد از redirect)
+        base_p = urlparse(str(r.url))  # URL نهایی (بعد از redirect)
 
         # مرتب از اولویت بالا
         candidates.sort(key=lambda x: -x[1])
         tried_urls = set()
+        transient  = False   # کاندیدی که فقط موقتاً شکست خورد (timeout/5xx/اتصال)
 
         for img_url, _ in candidates[:8]:
             # نرمال‌سازی URL
@@ -1533,65 +3680,21 @@ async def fetch_article_image(client: httpx.AsyncClient, url: str) -> "io.BytesI
                 continue
             tried_urls.add(img_url)
 
-            # دانلود
-            try:
-                ir = await client.get(img_url,
-                    timeout=httpx.Timeout(12.0),
-                    headers={**COMMON_UA, "Accept": "image/*,*/*;q=0.5"},
-                    follow_redirects=True)
-                if ir.status_code != 200:
-                    continue
-            except Exception as de:
-                log.debug(f"🖼 dl-err: {de}"); continue
-
-            raw   = ir.content
-            ctype = ir.headers.get("content-type", "")
-
-            # حجم کم → لوگو
-            if len(raw) < 15_000:
-                log.debug(f"🖼 skip-small: {len(raw)}B")
-                continue
-
-            # چک نوع تصویر
-            is_img = (
-                ctype.startswith("image/") or
-                raw[:3]  == b'\xff\xd8\xff' or
-                raw[:8]  == b'\x89PNG\r\n\x1a\n' or
-                raw[:6]  in (b'GIF87a', b'GIF89a') or
-                raw[:4]  == b'RIFF' or
-                raw[:4]  == b'WEBP'
-            )
-            if not is_img:
-                continue
-
-            # PIL: بررسی ابعاد و resize
-            if PIL_OK:
-                try:
-                    tmp = Image.open(io.BytesIO(raw))
-                    w, h = tmp.size
-                    # عرض < ۵۰۰ یا ارتفاع < ۲۸۰ → لوگو/بنر
-                    if w < 500 or h < 280:
-                        log.debug(f"🖼 skip-dim: {w}×{h}")
-                        continue
-                    # نسبت < 1.3 → احتمالاً مربع یا عمودی = لوگو
-                    ratio = w / max(h, 1)
-                    if ratio < 1.3:
-                        log.debug(f"🖼 skip-ratio: {ratio:.2f} ({w}×{h})")
-                        continue
-                    img_rgb = tmp.convert("RGB")
-                    if w > 1600 or h > 1000:
-                        img_rgb.thumbnail((1600, 1000), Image.LANCZOS)
-                    out = io.BytesIO()
-                    img_rgb.save(out, "JPEG", quality=88, optimize=True)
-                    out.seek(0)
-                    log.info(f"🖼 ✅ {w}×{h} r={ratio:.1f}  {img_url[:55]}")
-                    return out
-                except Exception as pe:
-                    log.debug(f"🖼 PIL-err: {pe}"); continue
-            else:
-                buf = io.BytesIO(raw); buf.seek(0)
-                return buf
-
+            jpeg = await _fetch_image(client, img_url)
+            if jpeg:
+                _img_idx()["pages"][url] = [img_url, int(time.time()), len(r.content)]
+                STATE.mark_dirty("img_cache")
+                return io.BytesIO(jpeg)
+            # رد قطعی (کوچک/ابعاد/نوع/4xx) در cache تصویر منفی ثبت شده؛ وگرنه موقتی بود
+            if img_url not in _img_idx()["imgs"]:
+                transient = True
+
+        if transient:
+            # «تصویر ندارد» فقط با دلیل قطعی — خطای موقت CDN نباید ۱۲ ساعت مقاله را بی‌تصویر کند
+            return None
+        _img_idx()["pages"][url] = ["", int(time.time()), len(r.content)]
+        _img_evict()
+        STATE.mark_dirty("img_cache")
         return None
 
     except Exception as e:
@@ -1600,10 +3703,45 @@ async def fetch_article_image(client: httpx.AsyncClient, url: str) -> "io.BytesI
 
 
 # ══════════════════════════════════════════════════════════════════════════
-# یک چرخه fetch → filter → send
+# یک چرخه fetch → filter → send — pipeline جریانی
 # ══════════════════════════════════════════════════════════════════════════
+#   fetch_all ──q_raw──► فیلتر/dedup ──q_tr──► ترجمه ──q_send──► caption ──► SENDER
+# هر مرحله یک task مستقل است؛ خبر فوری از منبع سریع چند ثانیه بعد از fetch
+# ارسال می‌شود، بدون انتظار برای timeout کندترین Nitter/RSSHub.
+# None در هر صف = پایان مرحله قبل. SENDER (TelegramSender) بین چرخه‌ها ادامه دارد.
+
+def _build_caption(item: tuple, tr: tuple) -> tuple[str, int] | None:
+    """caption فارسی + اولویت صف ارسال — None اگه متن فارسی نداریم"""
+    eid, entry, src_name, stype, is_emb, art = item
+    fa_title, fa_body = tr
+    en_title = art[0]
+    dt_str   = format_dt(entry)
+
+    title_is_fa = _is_farsi(fa_title) if fa_title else False
+    orig_is_fa  = _is_farsi(en_title)
+    if not title_is_fa and not orig_is_fa:
+        log.info(f"  ⏭ skip(noFA): {en_title[:50]}"); return None
+
+    display = fa_title.strip() if title_is_fa else en_title.strip()
+    body_fa = ""
+    if fa_body and _is_farsi(fa_body) and len(fa_body) > 15:
+        body_fa = fa_body.strip()
+    elif _is_farsi(art[1]):
+        body_fa = art[1].strip()
+
+    icons = analyze_sentiment(f"{fa_title} {fa_body} {en_title}")
+    cap   = [sentiment_bar(icons), f"<b>{esc(display)}</b>"]
+    if body_fa and body_fa[:50] not in display[:50]:
+        cap += ["", esc(trim(body_fa, 800))]
+    if dt_str: cap.append(f"\n🕐 {dt_str}")
+    return "\n".join(cap), calc_importance(en_title, art[1], icons, stype)
+
+def _pct(xs: list, q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
 async def _run_cycle(client: httpx.AsyncClient,
-                     seen: set, stories: list,
+                     seen: SeenStore, stories: StoryIndex,
                      cutoff: datetime) -> tuple:
     """
     یک چرخه کامل.
@@ -1611,90 +3749,154 @@ async def _run_cycle(client: httpx.AsyncClient,
     """
     cycle_start = datetime.now(timezone.utc)
     save_run_state()
+    loop = asyncio.get_running_loop()
 
-    # ── fetch موازی ──────────────────────────────────────────────────────
-    raw = await fetch_all(client, cutoff)
-    log.info(f"  📥 {len(raw)} آیتم خام")
+    q_raw, q_tr, q_send = asyncio.Queue(), asyncio.Queue(), asyncio.Queue()
+    cnt = {"raw": 0, "old": 0, "irrel": 0, "dup": 0, "story": 0, "near": 0,
+           "ok": 0, "cap": 0, "queued": 0}
+    busy = {"fetch": 0.0, "filter": 0.0, "translate": 0.0, "send": 0.0}  # زمان کار هر مرحله
 
-    # ── پردازش ───────────────────────────────────────────────────────────
-    collected = []
-    cnt_old = cnt_irrel = cnt_dup = cnt_story = 0
-
-    for entry, src_name, src_type, is_emb in raw:
-        eid = make_id(entry)
-        if eid in seen:                         cnt_dup   += 1; continue
-        if not is_fresh(entry, cutoff):         cnt_old   += 1; continue
-        t   = clean_html(entry.get("title",""))
-        s   = clean_html(entry.get("summary") or entry.get("description") or "")
-        if not is_war_relevant(f"{t} {s}", is_embassy=is_emb,
-                               is_tg=(src_type=="tg"), is_tw=(src_type=="tw")):
-            cnt_irrel += 1; continue
-        if is_story_dup(t, stories):            cnt_story += 1; continue
-        collected.append((eid, entry, src_name, src_type, is_emb))
-        stories = register_story(t, stories)
-
-    log.info(f"  📊 قدیمی:{cnt_old} نامرتبط:{cnt_irrel} dup:{cnt_dup} story:{cnt_story} ✅{len(collected)}")
-
-    collected = list(reversed(collected))[:MAX_NEW_PER_RUN]
-
-    if not collected:
+    # ── مرحله ۰: fetch — هر منبع به محض تمام شدن در q_raw ─────────────────
+    async def _produce():
+        t0 = time.perf_counter()
+        try:
+            await fetch_all(client, cutoff,
+                            on_result=lambda res, cut: q_raw.put_nowait((time.time(), res, cut)))
+        finally:
+            busy["fetch"] = time.perf_counter() - t0
+            q_raw.put_nowait(None)
+
+    # ── مرحله ۱: فیلتر + dedup ───────────────────────────────────────────
+    async def _filter():
+        nonlocal stories
+        try:
+            while (batch := await q_raw.get()) is not None:
+                t_fetch, res, src_cutoff = batch
+                cnt["raw"] += len(res)
+                t0 = time.perf_counter()
+                held = 0   # کوچک‌ترین id پیام تلگرام که به سقف خورد
+                # feed ها جدید→قدیم هستند؛ قدیمی‌تر اول ارسال شود
+                for entry, src_name, src_type, is_emb in reversed(res):
+                    eid = make_id(entry)
+                    if eid in seen or eid in SENDER: cnt["dup"] += 1; continue
+                    if not is_fresh(entry, src_cutoff): cnt["old"] += 1; continue
+                    t   = clean_html(entry.get("title",""))
+                    s   = clean_html(entry.get("summary") or entry.get("description") or "")
+                    feats = classify(t, s)  # یک اسکن — فیلتر + triple عنوان
+                    if not is_war_relevant(f"{t} {s}", is_embassy=is_emb,
+                                           is_tg=(src_type=="tg"), is_tw=(src_type=="tw"),
+                                           feats=feats):
+                        cnt["irrel"] += 1; continue
+                    if is_story_dup(t, stories, feats.triple): cnt["story"] += 1; continue
+                    sig = _near_dups.signature(t)
+                    if (m := _near_dups.match(sig, t)):
+                        # INFO تا آستانه با جفت‌های واقعی production تنظیم شود
+                        log.info(f"  🧬 near-dup {m[0]:.2f}: «{t[:70]}» ≈ «{m[2][:70]}» ({m[1]})")
+                        _near_dups.count_dup(src_name); cnt["near"] += 1; continue
+                    if cnt["ok"] >= MAX_NEW_PER_RUN:
+                        cnt["cap"] += 1
+                        if src_type == "tg":
+                            mid  = _tg_msg_id(entry.get("link", ""))
+                            held = min(held, mid) if held and mid else (held or mid)
+                        continue
+                    cnt["ok"] += 1
+                    stories = register_story(t, stories, feats.triple)
+                    _near_dups.add(sig, src_name, title=t)
+                    art = (trim(t, 400), trim(s, 600))
+                    if src_type == "rss":
+                        SENDER.prefetch(eid, entry.get("link", ""))   # هم‌زمان با ترجمه
+                    q_tr.put_nowait((t_fetch, (eid, entry, src_name, src_type, is_emb, art)))
+                if res[0][0].get("_tg_handle"):
+                    commit_tg_cursor(res[0][0]["_tg_handle"], held)
+                took = time.perf_counter() - t0
+                busy["filter"] += took
+                METRICS.observe("filter_seconds", took)
+        finally:
+            q_tr.put_nowait(None)
+
+    # ── مرحله ۲: ترجمه — micro-batch (اولین خبر + هرچه در TR_LINGER_SEC برسد) ─
+    async def _translate():
+        done = False
+        try:
+            while not done:
+                first = await q_tr.get()
+                if first is None: break
+                batch    = [first]
+                deadline = loop.time() + TR_LINGER_SEC
+                while len(batch) < TR_BATCH_MAX:
+                    try:
+                        nxt = await asyncio.wait_for(q_tr.get(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        break
+                    if nxt is None: done = True; break
+                    batch.append(nxt)
+                log.info(f"  🌐 ترجمه {len(batch)} خبر...")
+                t0  = time.perf_counter()
+                trs = await translate_batch(client, [it[5] for _, it in batch])
+                busy["translate"] += time.perf_counter() - t0
+                for (t_fetch, it), tr in zip(batch, trs):
+                    q_send.put_nowait((t_fetch, it, tr))
+        finally:
+            q_send.put_nowait(None)
+
+    # ── مرحله ۳: caption + صف ارسال (TelegramSender — مستقل از چرخه) ───────
+    async def _send():
+        while (job := await q_send.get()) is not None:
+            t_fetch, item, tr = job
+            t0  = time.perf_counter()
+            out = _build_caption(item, tr)
+            if out:
+                caption, prio = out
+                link = item[1].get("link", "") if item[3] == "rss" else ""
+                SENDER.submit(item[0], caption, link, prio, t_fetch)
+                cnt["queued"] += 1
+            else:
+                SENDER.forget(item[0])
+            if q_send.empty():
+                STATE.flush("sendq")   # صف روی دیسک قبل از ارسال — crash خبر را گم نکند
+            busy["send"] += time.perf_counter() - t0
+
+    stages = ("fetch", "filter", "translate", "send")
+    res = await asyncio.gather(_produce(), _filter(), _translate(), _send(),
+                               return_exceptions=True)
+    for name, r in zip(stages, res):
+        if isinstance(r, BaseException):
+            log.error(f"  ❌ pipeline/{name}: {r}")
+
+    STATE.mark_dirty("seen", "stories", "near_dups")
+    for stage, sec in busy.items():
+        METRICS.observe("stage_seconds", sec, stage=stage)
+    for outcome, n in cnt.items():
+        METRICS.inc("items_total", n, outcome=outcome)
+    log.info(f"  📥 {cnt['raw']} آیتم خام")
+    log.info("  📈 مراحل: " + "  ".join(f"{k} {v:.1f}s" for k, v in busy.items()))
+    log.info(f"  📊 قدیمی:{cnt['old']} نامرتبط:{cnt['irrel']} dup:{cnt['dup']}"
+             f" story:{cnt['story']} near:{cnt['near']} ✅{cnt['ok']}"
+             + (f" (سقف: {cnt['cap']} رد)" if cnt["cap"] else ""))
+    if cnt["near"]:
+        log.info(f"  🧬 near-dup از: {_near_dups.pop_cycle_report()}")
+    # ارسال‌ها از صف (شامل خبرهای چرخه قبل) — از آخرین گزارش
+    st  = SENDER.pop_stats()
+    lat = st["lat"]
+    if lat:
+        log.info(f"  ⚡ fetch→sent: p50={_pct(lat, .5):.1f}s"
+                 f"  p90={_pct(lat, .9):.1f}s  max={max(lat):.1f}s")
+    if st["sent"] or st["fail"] or st["429"] or st["expired"] or len(SENDER):
+        log.info(f"  📤 ارسال: {st['sent']} ✅  {st['fail']} ❌  429×{st['429']}"
+                 + (f"  ⌛{st['expired']}" if st["expired"] else "")
+                 + f"  در صف: {len(SENDER)}")
+    if not cnt["ok"]:
         log.info("  💤 خبر جدیدی نیست")
-        save_seen(seen); save_stories(stories)
         return seen, stories, cycle_start
-
-    # ── ترجمه ────────────────────────────────────────────────────────────
-    arts_in = [
-        (trim(clean_html(e.get("title","")), 400),
-         trim(clean_html(e.get("summary") or e.get("description") or ""), 600))
-        for _, e, _, _, _ in collected
-    ]
-    log.info(f"  🌐 ترجمه {len(arts_in)} خبر...")
-    translations = await translate_batch(client, arts_in)
-
-    # ── ارسال ────────────────────────────────────────────────────────────
-    sent = 0
-    for i, (eid, entry, src_name, stype, is_emb) in enumerate(collected):
-        fa_title, fa_body = translations[i]
-        en_title = arts_in[i][0]
-        link     = entry.get("link","")
-        dt_str   = format_dt(entry)
-
-        title_is_fa = _is_farsi(fa_title) if fa_title else False
-        orig_is_fa  = _is_farsi(en_title)
-        if not title_is_fa and not orig_is_fa:
-            log.info(f"  ⏭ skip(noFA): {en_title[:50]}"); continue
-
-        display = fa_title.strip() if title_is_fa else en_title.strip()
-        body_fa = ""
-        if fa_body and _is_farsi(fa_body) and len(fa_body) > 15:
-            body_fa = fa_body.strip()
-        elif _is_farsi(arts_in[i][1]):
-            body_fa = arts_in[i][1].strip()
-
-        s_bar = sentiment_bar(analyze_sentiment(f"{fa_title} {fa_body} {en_title}"))
-        cap   = [s_bar, f"<b>{esc(display)}</b>"]
-        if body_fa and body_fa[:50] not in display[:50]:
-            cap += ["", esc(trim(body_fa, 800))]
-        if dt_str: cap.append(f"\n🕐 {dt_str}")
-        caption = "\n".join(cap)
-
-        done = False
-        if link and stype == "rss":
-            img = await fetch_article_image(client, link)
-            if img:
-                ok = await tg_send_photo(client, img, caption[:1024])
-                if ok: done = True; log.info("    📸 تصویر+فارسی")
-
-        if not done:
-            ok = await tg_send_text(client, caption)
-            if ok: done = True; log.info("    ✉️ متن فارسی")
-
-        if done:
-            seen.add(eid); sent += 1
-        await asyncio.sleep(SEND_DELAY)
-
-    save_seen(seen); save_stories(stories)
-    log.info(f"  🏁 {sent}/{len(collected)} ارسال  seen:{len(seen)}")
+    hit, miss, tok = pop_tr_stats()
+    if hit + miss:
+        log.info(f"  🗂 cache ترجمه: {hit}/{hit + miss} hit ({hit / (hit + miss):.0%})"
+                 f"  ~{tok} token صرفه‌جویی")
+    hit, miss, saved = pop_img_stats()
+    if hit + miss:
+        log.info(f"  🖼 cache تصویر: {hit}/{hit + miss} hit ({hit / (hit + miss):.0%})"
+                 f"  {saved / 1024:.0f} KB دانلود نشد")
+    log.info(f"  🏁 {cnt['queued']}/{cnt['ok']} به صف ارسال  seen:{len(seen)}")
     return seen, stories, cycle_start
 
 
@@ -1702,7 +3904,7 @@ async def _run_cycle(client: httpx.AsyncClient,
 # main — حلقه دائمی
 # ══════════════════════════════════════════════════════════════════════════
 async def main():
-    global _TW_SEMA
+    global _TW_SEMA, _near_dups
     if not BOT_TOKEN or not CHANNEL_ID:
         log.error("❌ BOT_TOKEN یا CHANNEL_ID تنظیم نشده!"); return
 
@@ -1717,52 +3919,91 @@ async def main():
 
     seen    = load_seen()
     stories = load_stories()
+    _near_dups = load_near_dups()
+    STATE.register("seen",      seen.flush)
+    STATE.register("stories",   lambda: save_stories(stories))
+    STATE.register("near_dups", lambda: save_near_dups(_near_dups))
+
+    # SIGTERM (kill شدن job در Actions) → cancel → finally پایین state را flush می‌کند
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, RuntimeError):
+        pass
 
     mode = "GitHub CI" if _CI else "محلی — بی‌نهایت"
     log.info("=" * 70)
     log.info(f"🚀 WarBot v20 | {datetime.now(TEHRAN_TZ).strftime('%H:%M تهران %Y/%m/%d')}")
     log.info(f"   mode={mode}  max={BOT_MAX_RUNTIME_MIN}min  interval={LOOP_INTERVAL_SEC}s")
     log.info(f"   📡 {len(ALL_RSS_FEEDS)} RSS  📢 {len(TELEGRAM_CHANNELS)} TG  𝕏 {len(TWITTER_HANDLES)} TW")
-    log.info(f"   seen:{len(seen)}  stories:{len(stories)}  PIL:{'✅' if PIL_OK else '❌'}")
+    log.info(f"   seen:{len(seen)}  stories:{len(stories)}  near-dup:{len(_near_dups)}"
+             f"  PIL:{'✅' if PIL_OK else '❌'}")
     log.info("=" * 70)
 
     wall_start = datetime.now(timezone.utc)
     loop_n     = 0
     limits     = httpx.Limits(max_connections=100, max_keepalive_connections=30)
+    metrics_srv = None
 
-    async with httpx.AsyncClient(follow_redirects=True, limits=limits) as client:
-        await build_twitter_pools(client)
-
-        while True:
-            loop_n += 1
-            elapsed_min = (datetime.now(timezone.utc) - wall_start).total_seconds() / 60
-            log.info(f"\n{'━'*55}")
-            log.info(f"  ⟳ Loop #{loop_n}  elapsed={elapsed_min:.1f}min"
-                     f"  {datetime.now(TEHRAN_TZ).strftime('%H:%M تهران')}")
-
-            t0 = datetime.now(timezone.utc)
-            try:
-                seen, stories, next_cutoff = await _run_cycle(
-                    client, seen, stories, cutoff)
-                # cutoff بعدی = شروع این cycle - buffer
-                cutoff = next_cutoff - timedelta(minutes=CUTOFF_BUFFER_MIN)
-            except Exception as e:
-                log.error(f"  ❌ cycle error: {e}")
-                import traceback; log.debug(traceback.format_exc())
-
-            took = (datetime.now(timezone.utc) - t0).total_seconds()
-            log.info(f"  ⏱ cycle took {took:.0f}s")
-
-            # بررسی exit برای CI
-            elapsed_min = (datetime.now(timezone.utc) - wall_start).total_seconds() / 60
-            if elapsed_min >= BOT_MAX_RUNTIME_MIN:
-                log.info(f"  ⏹ CI timeout ({BOT_MAX_RUNTIME_MIN}min) — خروج سالم")
-                break
-
-            # صبر تا cycle بعدی
-            wait = max(5.0, LOOP_INTERVAL_SEC - took)
-            log.info(f"  💤 {wait:.0f}s تا چرخه بعدی...")
-            await asyncio.sleep(wait)
+    try:
+        # transport سفارشی نه — httpx با transport= متغیرهای proxy محیط را نادیده می‌گیرد
+        async with httpx.AsyncClient(follow_redirects=True, limits=limits,
+                                     event_hooks={"response": [meter_response]}) as client:
+            await build_twitter_pools(client)
+            LAG.start()
+            SENDER.start(client, seen)
+            if METRICS_PORT:
+                try:
+                    metrics_srv = await serve_metrics(METRICS_PORT)
+                except OSError as e:
+                    log.warning(f"📈 metrics port {METRICS_PORT}: {e}")
+
+            while True:
+                loop_n += 1
+                elapsed_min = (datetime.now(timezone.utc) - wall_start).total_seconds() / 60
+                log.info(f"\n{'━'*55}")
+                log.info(f"  ⟳ Loop #{loop_n}  elapsed={elapsed_min:.1f}min"
+                         f"  {datetime.now(TEHRAN_TZ).strftime('%H:%M تهران')}")
+
+                t0 = datetime.now(timezone.utc)
+                try:
+                    seen, stories, next_cutoff = await _run_cycle(
+                        client, seen, stories, cutoff)
+                    # cutoff بعدی = شروع این cycle - buffer
+                    cutoff = next_cutoff - timedelta(minutes=CUTOFF_BUFFER_MIN)
+                except Exception as e:
+                    log.error(f"  ❌ cycle error: {e}")
+                    import traceback; log.debug(traceback.format_exc())
+
+                STATE.flush()
+                took = (datetime.now(timezone.utc) - t0).total_seconds()
+                METRICS.observe("cycle_seconds", took)
+                if METRICS_JSON:
+                    METRICS.write_json(METRICS_JSON)
+                lag50, lag99, lag_max = LAG.report()
+                log.info(f"  ⏱ cycle took {took:.0f}s  loop lag p50={lag50:.0f}ms"
+                         f" p99={lag99:.0f}ms max={lag_max:.0f}ms")
+
+                # بررسی exit برای CI
+                elapsed_min = (datetime.now(timezone.utc) - wall_start).total_seconds() / 60
+                if elapsed_min >= BOT_MAX_RUNTIME_MIN:
+                    log.info(f"  ⏹ CI timeout ({BOT_MAX_RUNTIME_MIN}min) — خروج سالم")
+                    if len(SENDER) and not await SENDER.drain(SEND_DRAIN_SEC):
+                        log.info(f"  📤 {len(SENDER)} خبر در صف ماند — اجرای بعدی ارسال می‌کند")
+                    break
+
+                # صبر تا cycle بعدی
+                wait = max(5.0, LOOP_INTERVAL_SEC - took)
+                log.info(f"  💤 {wait:.0f}s تا چرخه بعدی...")
+                await asyncio.sleep(wait)
+    finally:
+        if metrics_srv:
+            metrics_srv.close()
+        SENDER.stop()
+        LAG.stop()
+        shutdown_pools()
+        flushed = STATE.flush()
+        log.info(f"  💾 state: {', '.join(flushed) or '—'}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+replay.py — ضبط و پخش مجدد یک چرخه کامل bot.py بدون شبکه
+  python3 replay.py record DIR          یک چرخه زنده؛ پاسخ‌های HTTP منابع در DIR ذخیره می‌شود
+                                        (Telegram Bot API و Gemini جعلی هستند — چیزی ارسال نمی‌شود)
+  python3 replay.py synth  DIR          ضبط مصنوعی از همه منابع فعلی (بدون شبکه)
+  python3 replay.py run    DIR [...]    پخش با transport جعلی + بنچمارک:
+                                        items/sec، زمان چرخه، حافظه اوج، زمان/CPU هر مرحله
+                                        پیش‌فرض سریع (چک regression): ۱ اجرا، شبکه ×0.1،
+                                        صف ارسال بی‌محدودیت — --real: تأخیر ضبط‌شده، نرخ
+                                        واقعی ۲۰/دقیقه و ۳ اجرا (چند دقیقه)
+
+هر اجرا در یک پوشه موقت با state خالی انجام می‌شود (seen/stories/cursor ها دست نمی‌خورند).
+URL ضبط‌نشده → ConnectError (مثل mirror مرده). برای mirror های X، مسیر بدون host هم
+جستجو می‌شود تا hedge/رتبه‌بندی تصادفی به instance دیگری برسد هم پاسخ پیدا شود.
+"""
+
+import argparse, asyncio, hashlib, json, os, random, re, statistics, tempfile, time, tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+import httpx
+
+import bot
+
+TG_HOST     = "api.telegram.org"
+RUN_FAST_TG_RATE = 6000   # پیام/دقیقه — run بدون --real: ارسال زمان چرخه را تعیین نکند
+GEMINI_HOST = "generativelanguage.googleapis.com"
+
+# ══════════════════════════════════════════════════════════════════════════
+# فایل ضبط: DIR/index.json + DIR/bodies/<sha1>
+# ══════════════════════════════════════════════════════════════════════════
+class Recording:
+    """
+    index.json = {"recorded_at": iso, "entries": {"GET <url>": [پاسخ, ...]}}
+    پاسخ = {"status", "headers", "body": sha1, "elapsed"} — چند پاسخ برای یک URL
+    به همان ترتیب پخش می‌شوند (آخری تکرار می‌شود).
+    """
+    def __init__(self, root: str, recorded_at: datetime | None = None):
+        self.root    = Path(root).resolve()
+        self.entries: dict[str, list] = {}
+        self.recorded_at = recorded_at or datetime.now(timezone.utc)
+        self._by_path: dict[str, list] = {}
+        self._cursor:  dict[str, int]  = {}
+
+    @staticmethod
+    def key(method: str, url: httpx.URL) -> str:
+        return f"{method} {url}"
+
+    @staticmethod
+    def path_key(method: str, url: httpx.URL) -> str:
+        return f"{method} {url.raw_path.decode()}"
+
+    def add(self, method: str, url: httpx.URL, status: int, headers: dict,
+            body: bytes, elapsed: float):
+        sha = hashlib.sha1(body).hexdigest()
+        (self.root / "bodies").mkdir(parents=True, exist_ok=True)
+        fp = self.root / "bodies" / sha
+        if not fp.exists():
+            fp.write_bytes(body)
+        # بدنه ذخیره‌شده decode شده است — header های encoding دیگر معتبر نیستند
+        hdrs = {k: v for k, v in headers.items()
+                if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        self.entries.setdefault(self.key(method, url), []).append(
+            {"status": status, "headers": hdrs, "body": sha, "elapsed": round(elapsed, 4)})
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / "index.json").write_text(json.dumps(
+            {"recorded_at": self.recorded_at.isoformat(), "entries": self.entries},
+            ensure_ascii=False, indent=1), "utf-8")
+
+    @classmethod
+    def load(cls, root: str) -> "Recording":
+        d   = json.loads((Path(root) / "index.json").read_text("utf-8"))
+        rec = cls(root, datetime.fromisoformat(d["recorded_at"]))
+        rec.entries = d["entries"]
+        for k, v in rec.entries.items():
+            method, url = k.split(" ", 1)
+            rec._by_path.setdefault(cls.path_key(method, httpx.URL(url)), []).extend(v)
+        return rec
+
+    def rewind(self):
+        self._cursor.clear()
+
+    def next(self, method: str, url: httpx.URL) -> tuple[dict, bytes] | None:
+        k = self.key(method, url)
+        resps = self.entries.get(k)
+        if not resps:
+            k = self.path_key(method, url)
+            resps = self._by_path.get(k)
+        if not resps:
+            return None
+        i = self._cursor.get(k, 0)
+        self._cursor[k] = i + 1
+        e = resps[min(i, len(resps) - 1)]
+        return e, (self.root / "bodies" / e["body"]).read_bytes()
+
+# ══════════════════════════════════════════════════════════════════════════
+# Telegram Bot API و Gemini جعلی — تأخیر، 429 و خطای قابل تنظیم
+# ══════════════════════════════════════════════════════════════════════════
+class FakeTelegram:
+    """
+    per_min > 0 → محدودیت واقعی کانال شبیه‌سازی می‌شود: بیش از per_min پیام
+    در ۶۰ ثانیه اخیر = 429 با retry_after تا آزاد شدن پنجره
+    """
+    UP_BPS = 2e6   # آپلود runner → Telegram (بایت/ثانیه) — عکس multipart کندتر از file_id
+
+    def __init__(self, latency=0.15, p429=0.0, pfail=0.0, retry_after=1, per_min=0, seed=0):
+        self.latency, self.p429, self.pfail, self.retry_after = latency, p429, pfail, retry_after
+        self.per_min = per_min
+        self.window: list = []
+        self.rng   = random.Random(seed)
+        self.stats = {"sent": 0, "429": 0, "fail": 0}
+
+    def _too_many(self, retry_after: float) -> httpx.Response:
+        self.stats["429"] += 1
+        return httpx.Response(429, json={"ok": False, "error_code": 429,
+                                         "description": "Too Many Requests",
+                                         "parameters": {"retry_after": retry_after}})
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        upload = request.headers.get("content-type", "").startswith("multipart/")
+        await asyncio.sleep(self.latency + (len(body) / self.UP_BPS if upload else 0))
+        now = time.monotonic()
+        self.window = [t for t in self.window if now - t < 60]
+        if self.per_min and len(self.window) >= self.per_min:
+            return self._too_many(max(1, int(self.window[0] + 60 - now) + 1))
+        r = self.rng.random()
+        if r < self.p429:
+            return self._too_many(self.retry_after)
+        if r < self.p429 + self.pfail:
+            self.stats["fail"] += 1
+            return httpx.Response(400, json={"ok": False, "error_code": 400,
+                                             "description": "Bad Request: fake failure"})
+        self.stats["sent"] += 1
+        self.window.append(now)
+        result = {"message_id": self.stats["sent"]}
+        if upload:
+            fid = "F" + hashlib.sha1(body).hexdigest()[:16]
+            result["photo"] = [{"file_id": fid + "s", "width": 320}, {"file_id": fid, "width": 1280}]
+        return httpx.Response(200, json={"ok": True, "result": result})
+
+class FakeGemini:
+    """پاسخ با همان قالب ###ITEM_i### / T: / B: که _translate_gemini می‌خواند"""
+    def __init__(self, latency=1.5, p429=0.0, pfail=0.0, drop=0.0, retry_delay=5, seed=0):
+        self.latency, self.p429, self.pfail, self.drop = latency, p429, pfail, drop
+        self.retry_delay = retry_delay
+        self.rng   = random.Random(seed)
+        self.stats = {"ok": 0, "429": 0, "fail": 0, "items": 0}
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(await request.aread())
+        await asyncio.sleep(self.latency)
+        r = self.rng.random()
+        if r < self.p429:
+            self.stats["429"] += 1
+            return httpx.Response(429, json={"error": {
+                "code": 429, "status": "RESOURCE_EXHAUSTED",
+                "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                             "retryDelay": f"{self.retry_delay}s"}]}})
+        if r < self.p429 + self.pfail:
+            self.stats["fail"] += 1
+            return httpx.Response(500, json={"error": {"code": 500, "status": "INTERNAL"}})
+        prompt = body["contents"][0]["parts"][0]["text"]
+        items  = re.findall(r"###ITEM_(\d+)###\nEN_TITLE: (.*)", prompt)
+        # فقط فارسی — _is_farsi نسبت حروف فارسی را می‌سنجد
+        out = "".join(f"###ITEM_{i}###\nT: خبر ترجمه‌شده شماره {i} با طول {len(t)} نویسه\n"
+                      f"B: متن ترجمه‌شده خبر {i} برای آزمایش بازپخش\n\n" for i, t in items
+                      if self.rng.random() >= self.drop)
+        self.stats["ok"] += 1; self.stats["items"] += len(items)
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": out}]}}]})
+
+def _fake_for(request: httpx.Request, fakes: dict):
+    return fakes.get(request.url.host)
+
+# ══════════════════════════════════════════════════════════════════════════
+# transport ها
+# ══════════════════════════════════════════════════════════════════════════
+class RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, rec: Recording, fakes: dict):
+        self.inner, self.rec, self.fakes = inner, rec, fakes
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        fake = _fake_for(request, self.fakes)
+        if fake:
+            return await fake(request)
+        t0   = time.perf_counter()
+        resp = await self.inner.handle_async_request(request)
+        body = b"".join([c async for c in resp.stream])
+        await resp.aclose()
+        # بدنه خام (شاید gzip) — decode با یک Response موقت
+        tmp  = httpx.Response(resp.status_code, headers=resp.headers, content=body)
+        data = tmp.content
+        self.rec.add(request.method, request.url, resp.status_code,
+                     dict(tmp.headers), data, time.perf_counter() - t0)
+        hdrs = {k: v for k, v in tmp.headers.items()
+                if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        return httpx.Response(resp.status_code, headers=hdrs,
+                              stream=httpx.ByteStream(data), request=request)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, rec: Recording, fakes: dict, net_scale: float = 1.0):
+        self.rec, self.fakes, self.net_scale = rec, fakes, net_scale
+        self.stats = {"hit": 0, "miss": 0}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        fake = _fake_for(request, self.fakes)
+        if fake:
+            return await fake(request)
+        got = self.rec.next(request.method, request.url)
+        if got is None:
+            self.stats["miss"] += 1
+            await asyncio.sleep(0.01 * self.net_scale)
+            raise httpx.ConnectError("not recorded", request=request)
+        e, body = got
+        self.stats["hit"] += 1
+        await asyncio.sleep(e["elapsed"] * self.net_scale)
+        # stream (نه content) تا MeteredTransport بایت‌ها را بشمارد
+        return httpx.Response(e["status"], headers=e["headers"],
+                              stream=httpx.ByteStream(body), request=request)
+
+# ══════════════════════════════════════════════════════════════════════════
+# اجرای یک چرخه با state تازه
+# ══════════════════════════════════════════════════════════════════════════
+def _fresh_bot_state(seed: int):
+    """state سراسری bot را خالی می‌کند — cwd باید پوشه موقت باشد"""
+    helps = bot.METRICS.help
+    bot.STATE   = bot.StateManager()
+    bot.METRICS = bot.Metrics(); bot.METRICS.help.update(helps)
+    bot.HEALTH  = bot.InstanceHealth()
+    bot.LAG     = bot.LoopLagMonitor()
+    bot.SENDER  = bot.TelegramSender()
+    bot._near_dups = bot.NearDupIndex()
+    bot._nitter_pool, bot._rsshub_pool = [], []
+    bot._INST_SEMA.clear()
+    bot.classify.cache_clear()
+    random.seed(seed)
+    for k in ("BOT_TOKEN", "CHANNEL_ID"):
+        if not getattr(bot, k): setattr(bot, k, "replay")
+
+async def run_cycle(transport: httpx.AsyncBaseTransport, cutoff: datetime) -> dict:
+    bot._TW_SEMA = asyncio.Semaphore(20)
+    seen, stories = bot.load_seen(), bot.load_stories()
+    async with httpx.AsyncClient(follow_redirects=True,
+                                 transport=bot.MeteredTransport(transport)) as client:
+        bot.LAG.start()
+        t0, c0 = time.perf_counter(), time.process_time()
+        await bot.build_twitter_pools(client)
+        bot.SENDER.start(client, seen)
+        await bot._run_cycle(client, seen, stories, cutoff)
+        # ارسال مستقل از چرخه است — زمان چرخه تا خالی شدن صف
+        await bot.SENDER.drain(3600)
+        bot.SENDER.stop()
+        wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+        bot.LAG.stop()
+    bot.shutdown_pools()
+    return {"wall": wall, "cpu": cpu}
+
+def _in_tmpdir(fn):
+    """اجرای fn در پوشه موقت (فایل‌های state نسبی هستند)"""
+    old = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="warbot-replay-") as d:
+        os.chdir(d)
+        try:
+            return fn()
+        finally:
+            os.chdir(old)
+
+# ══════════════════════════════════════════════════════════════════════════
+# record / synth
+# ══════════════════════════════════════════════════════════════════════════
+def cmd_record(args):
+    rec   = Recording(args.dir)
+    fakes = {TG_HOST: FakeTelegram(0.05), GEMINI_HOST: FakeGemini(0.2)}
+    def go():
+        _fresh_bot_state(args.seed)
+        bot.GEMINI_API_KEY = bot.GEMINI_API_KEY or "replay"
+        tr = RecordingTransport(httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=30)), rec, fakes)
+        cutoff = rec.recorded_at - timedelta(minutes=bot.MAX_LOOKBACK_MIN)
+        return asyncio.run(run_cycle(tr, cutoff))
+    res = _in_tmpdir(go)
+    rec.save()
+    n = sum(len(v) for v in rec.entries.values())
+    print(f"✅ {n} پاسخ ({len(rec.entries)} URL) در {args.dir} — چرخه {res['wall']:.1f}s")
+
+_ACTORS  = ["Iran", "Israel", "IRGC", "Hezbollah", "Houthis", "US Navy", "IDF", "Pentagon",
+            "Tehran", "Hamas", "CENTCOM", "Mossad"]
+_ACTIONS = ["launches missiles at", "strikes targets near", "intercepts drones over",
+            "warns of retaliation against", "deploys forces near", "shells positions in",
+            "reports explosions in", "claims attack on"]
+_PLACES  = ["Haifa", "Tel Aviv", "Isfahan", "Beirut", "Red Sea", "Natanz", "Damascus",
+            "Eilat", "Baghdad", "Strait of Hormuz", "Bandar Abbas", "Golan Heights"]
+
+def _headline(rng: random.Random) -> str:
+    return (f"{rng.choice(_ACTORS)} {rng.choice(_ACTIONS)} {rng.choice(_PLACES)}"
+            f" as {rng.randint(2, 90)} {rng.choice(['killed', 'wounded', 'missing', 'evacuated'])},"
+            f" officials say ({rng.randint(1000, 9999)})")
+
+def _search_items(handles: list, rng, t0) -> str:
+    out = []
+    for h in handles:
+        for i in range(rng.randint(0, 2)):
+            dt = (t0 + timedelta(minutes=rng.randint(0, 80))).strftime("%a, %d %b %Y %H:%M:%S GMT")
+            out.append(f"<item><title>{_headline(rng)}</title><dc:creator>@{h}</dc:creator>"
+                       f"<link>https://nitter.net/{h}/status/{rng.randint(10**17, 10**18)}#m</link>"
+                       f"<pubDate>{dt}</pubDate></item>")
+    return ('<?xml version="1.0"?><rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f"<channel><title>search</title>{''.join(out)}</channel></rss>")
+
+def cmd_synth(args):
+    import benchmark
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    t0  = now - timedelta(minutes=80)
+    rec = Recording(args.dir, now)
+    xml  = {"content-type": "application/rss+xml; charset=utf-8"}
+    html = {"content-type": "text/html; charset=utf-8"}
+    lat  = lambda: rng.uniform(0.1, 1.2)
+
+    for n, feed in enumerate(bot.ALL_RSS_FEEDS):
+        k    = rng.randint(5, 40)
+        body = benchmark.synth_rss(k, n, t0, lambda i: _headline(rng))
+        rec.add("GET", httpx.URL(feed["u"]), 200, xml, body.encode(), lat())
+        # صفحه مقاله با og:image — مسیر تصویر هم تمرین شود
+        for i in range(k):
+            page = (f"<html><head><meta property='og:image' content='https://img.example/{n % 7}.jpg'>"
+                    f"<meta property='og:image:width' content='1400'></head><body>"
+                    f"<article><p>{'text ' * 200}</p></article></body></html>")
+            rec.add("GET", httpx.URL(f"https://news.example/{n}/{i}"), 200, html, page.encode(), lat())
+    if bot.PIL_OK:
+        for k in range(7):
+            rec.add("GET", httpx.URL(f"https://img.example/{k}.jpg"), 200,
+                    {"content-type": "image/jpeg"}, benchmark._synth_jpeg(1400, 800), lat())
+
+    for n, (_, h) in enumerate(bot.TELEGRAM_CHANNELS):
+        page = benchmark.synth_tg_page(h, 20, 1000 + n * 50, t0, lambda i: _headline(rng))
+        rec.add("GET", httpx.URL(f"https://t.me/s/{h}"), 200, html, page.encode(), lat())
+
+    hs = [h for _, h in bot.TWITTER_HANDLES]
+    if bot.TW_BATCH_SIZE > 1:
+        for i in range(0, len(hs), bot.TW_BATCH_SIZE):
+            grp = hs[i:i + bot.TW_BATCH_SIZE]
+            q   = quote(" OR ".join(f"from:{h}" for h in grp))
+            url = httpx.URL(f"https://nitter.replay/search/rss?f=tweets&q={q}")
+            rec.add("GET", url, 200, xml, _search_items(grp, rng, t0).encode(), lat())
+    else:
+        # مسیر پیش‌فرض: هر handle جدا — همه candidate های _tw_candidates (hedge)
+        for h in hs:
+            body = _search_items([h], rng, t0).encode()
+            for url in (f"https://rsshub.replay/twitter/user/{h}",
+                        f"https://rsshub.replay/x/user/{h}", f"https://nitter.replay/{h}/rss"):
+                rec.add("GET", httpx.URL(url), 200, xml, body, lat())
+    rec.save()
+    print(f"✅ ضبط مصنوعی: {sum(len(v) for v in rec.entries.values())} پاسخ در {args.dir}")
+
+# ══════════════════════════════════════════════════════════════════════════
+# run — پخش + گزارش
+# ══════════════════════════════════════════════════════════════════════════
+def _hist_sum(name: str, by: str) -> dict:
+    out = {}
+    for k, h in bot.METRICS.hists.get(name, {}).items():
+        lbl = dict(k).get(by, "_")
+        out[lbl] = out.get(lbl, 0.0) + h[-2]
+    return out
+
+def cmd_run(args):
+    rec = Recording.load(args.dir)
+    cutoff = rec.recorded_at - timedelta(minutes=bot.MAX_LOOKBACK_MIN)
+    if args.repeat is None:         args.repeat = 3 if args.real else 1
+    if args.net_scale is None:      args.net_scale = 1.0 if args.real else 0.1
+    if args.tg_rate is None and not args.real:
+        args.tg_rate = RUN_FAST_TG_RATE
+    if args.tg_rate is not None:    bot.TG_CHAT_RATE = args.tg_rate / 60
+    if args.threads is not None:    bot.CPU_THREADS = args.threads
+    if args.procs is not None:      bot.CPU_PROCS = args.procs
+
+    def one(trace: bool) -> dict:
+        _fresh_bot_state(args.seed)
+        bot.GEMINI_API_KEY = "" if args.no_gemini else (bot.GEMINI_API_KEY or "replay")
+        rec.rewind()
+        tg = FakeTelegram(args.tg_latency, args.tg_429, args.tg_fail, args.tg_retry_after,
+                          args.tg_limit, args.seed)
+        gm = FakeGemini(args.gemini_latency, args.gemini_429, args.gemini_fail,
+                        args.gemini_drop, args.gemini_retry_delay, args.seed)
+        tr = ReplayTransport(rec, {TG_HOST: tg, GEMINI_HOST: gm}, args.net_scale)
+        if trace: tracemalloc.start()
+        res = asyncio.run(run_cycle(tr, cutoff))
+        if trace:
+            res["peak"] = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+        items = {dict(k).get("outcome"): v for k, v in bot.METRICS.ctrs.get("items_total", {}).items()}
+        sends = {dict(k).get("method"): h for k, h in bot.METRICS.hists.get("tg_send_seconds", {}).items()
+                 if dict(k).get("ok")}
+        res.update(items=items, tg=tg.stats, gemini=gm.stats, net=tr.stats,
+                   sends={m: (h[-1], h[-2] / h[-1]) for m, h in sends.items() if h[-1]},
+                   stages=_hist_sum("stage_seconds", "stage"),
+                   cpu_tasks=_hist_sum("cpu_task_seconds", "fn"),
+                   filter=sum(_hist_sum("filter_seconds", "_").values()),
+                   lag=bot.LAG.report())
+        return res
+
+    runs = [_in_tmpdir(lambda: one(False)) for _ in range(args.repeat)]
+    mem  = _in_tmpdir(lambda: one(True))["peak"] if args.mem else None
+
+    r     = runs[-1]
+    walls = [x["wall"] for x in runs]
+    wall  = statistics.median(walls)
+    raw, sent = r["items"].get("raw", 0), r["items"].get("sent", 0)
+    print(f"چرخه: median {wall:.2f}s  (min {min(walls):.2f}s، {len(runs)} اجرا)"
+          f"   CPU پروسه اصلی {statistics.median(x['cpu'] for x in runs):.2f}s")
+    print(f"آیتم: خام {raw}  جدید {r['items'].get('ok', 0)}  ارسال {sent}"
+          f"   → {raw / wall:,.0f} items/s   {sent / wall:.2f} sent/s")
+    if mem is not None:
+        print(f"حافظه اوج (tracemalloc، پروسه اصلی): {mem / 2**20:.1f} MB")
+    print("مراحل (زمان کار): " + "  ".join(f"{k} {v:.2f}s" for k, v in r["stages"].items()))
+    print(f"CPU-bound: filter {r['filter']:.3f}s  " +
+          "  ".join(f"{k} {v:.3f}s" for k, v in sorted(r["cpu_tasks"].items())))
+    if r["sends"]:
+        print("ارسال Telegram: " + "  ".join(f"{m} {n}× {avg * 1000:.0f}ms"
+                                             for m, (n, avg) in sorted(r["sends"].items())))
+    print(f"loop lag: p50 {r['lag'][0]:.0f}ms  p99 {r['lag'][1]:.0f}ms  max {r['lag'][2]:.0f}ms")
+    print(f"شبکه: hit {r['net']['hit']}  miss {r['net']['miss']}   "
+          f"Telegram {r['tg']}   Gemini {r['gemini']}")
+    if args.json:
+        Path(args.json).write_text(json.dumps({"wall": walls, "mem_peak": mem, "last": r},
+                                              ensure_ascii=False, indent=1, default=str), "utf-8")
+
+def main():
+    ap  = argparse.ArgumentParser(description="ضبط/پخش چرخه bot.py")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("record", "synth", "run"):
+        p = sub.add_parser(name)
+        p.add_argument("dir")
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument("-v", "--verbose", action="store_true")
+    p = sub.choices["run"]
+    p.add_argument("--real", action="store_true",
+                   help="تأخیر ضبط‌شده + نرخ واقعی صف ارسال + ۳ اجرا (کند)")
+    p.add_argument("--repeat", type=int, default=None, help="پیش‌فرض 1 (با --real: 3)")
+    p.add_argument("--net-scale", type=float, default=None,
+                   help="ضریب تأخیر ضبط‌شده شبکه (0 = بی‌تأخیر؛ پیش‌فرض 0.1، با --real: 1)")
+    p.add_argument("--tg-latency", type=float, default=0.15)
+    p.add_argument("--tg-429", type=float, default=0.0, help="احتمال 429 هر ارسال")
+    p.add_argument("--tg-fail", type=float, default=0.0)
+    p.add_argument("--tg-retry-after", type=int, default=1)
+    p.add_argument("--gemini-latency", type=float, default=1.5)
+    p.add_argument("--gemini-429", type=float, default=0.0)
+    p.add_argument("--gemini-fail", type=float, default=0.0)
+    p.add_argument("--gemini-drop", type=float, default=0.0, help="احتمال جا افتادن هر خبر در پاسخ")
+    p.add_argument("--gemini-retry-delay", type=int, default=5)
+    p.add_argument("--no-gemini", action="store_true", help="مسیر MyMemory (ضبط‌نشده → متن اصلی)")
+    p.add_argument("--tg-rate", type=float, default=None,
+                   help=f"نرخ صف ارسال، پیام/دقیقه (پیش‌فرض {RUN_FAST_TG_RATE}؛"
+                        f" با --real: {bot.TG_CHAT_RATE * 60:.0f})")
+    p.add_argument("--tg-limit", type=int, default=0,
+                   help="محدودیت شبیه‌سازی‌شده Telegram، پیام/دقیقه (0 = بی‌محدودیت)")
+    p.add_argument("--threads", type=int, default=None)
+    p.add_argument("--procs", type=int, default=None)
+    p.add_argument("--no-mem", dest="mem", action="store_false", help="بدون اجرای tracemalloc")
+    p.add_argument("--json", help="نتیجه کامل در این فایل")
+    args = ap.parse_args()
+
+    bot.log.setLevel("INFO" if args.verbose else "WARNING")
+    bot.logging.getLogger("httpx").setLevel("WARNING")
+    {"record": cmd_record, "synth": cmd_synth, "run": cmd_run}[args.cmd](args)
+
+if __name__ == "__main__":
+    main()